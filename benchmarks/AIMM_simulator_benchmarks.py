@@ -0,0 +1,227 @@
+# Benchmarks for the simulator core: end-to-end Sim.run throughput and peak
+# memory over grids of numbers of cells, UEs, subbands and pathloss models,
+# and microbenchmarks of the hot paths.  Results are written as JSON, and
+# may be compared with a stored baseline, flagging regressions.
+# Each end-to-end case runs in a fresh process, so that its peak memory is
+# its own.  AIMM_simulator must be importable (installed, or on PYTHONPATH).
+# Usage:
+# python3 benchmarks/AIMM_simulator_benchmarks.py -o=bench.json              # quick grid
+# python3 benchmarks/AIMM_simulator_benchmarks.py -grid=full -o=bench.json   # 10-10k cells, 10-100k UEs, 1-273 subbands
+# python3 benchmarks/AIMM_simulator_benchmarks.py -baseline=bench.json -threshold=0.1
+# python3 benchmarks/AIMM_simulator_benchmarks.py -only=micro   # names containing micro
+# python3 benchmarks/AIMM_simulator_benchmarks.py -only=import -import_budget=0.3
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import timeit
+from itertools import product
+from math import ceil,sqrt
+from time import perf_counter,strftime
+import numpy as np
+
+grids={
+  'quick': {'cells': (10,100),'UEs': (10,100,1000),'subbands': (1,12),'pathloss': ('UMa',),'max_pairs': 1e5},
+  'full':  {'cells': (10,100,1000,10000),'UEs': (10,100,1000,10000,100000),'subbands': (1,12,273),'pathloss': ('UMa','UMi','InH'),'max_pairs': 1e7},
+}
+
+def pathloss_model(name,params):
+  from AIMM_simulator.UMa_pathloss_model import UMa_pathloss
+  from AIMM_simulator.UMi_pathloss_model import UMi_streetcanyon_pathloss
+  from AIMM_simulator.InH_pathloss_model import InH_pathloss
+  if name=='UMa': return UMa_pathloss(fc_GHz=params['fc_GHz'],h_UT=params['h_UT'],h_BS=params['h_BS'])
+  if name=='UMi': return UMi_streetcanyon_pathloss(fc_GHz=params['fc_GHz'],h_UT=params['h_UT'],h_BS=10.0)
+  if name=='InH': return InH_pathloss(fc_GHz=params['fc_GHz'],h_UT=params['h_UT'],h_BS=4.0)
+  raise ValueError(f'unknown pathloss model {name}')
+
+def make_sim(ncells,nues,n_subbands=1,pathloss='UMa',isd=500.0,seed=0):
+  '''
+  Return a Sim with ncells on a square grid with spacing isd, nues UEs placed uniformly at random over the grid and attached to the nearest cell, and an MME.
+  '''
+  from AIMM_simulator import Sim,MME
+  params={'fc_GHz':3.5,'h_UT':2.0,'h_BS':20.0}
+  sim=Sim(params=params,rng_seed=seed,quiet=True)
+  side=ceil(sqrt(ncells))
+  for k in range(ncells):
+    sim.make_cell(xyz=(isd*(k%side),isd*(k//side),params['h_BS']),n_subbands=n_subbands)
+  model=pathloss_model(pathloss,params)
+  xy=sim.rng.uniform(0.0,isd*side,(nues,2))
+  for x,y in xy:
+    sim.make_UE(xyz=(x,y,params['h_UT']),pathloss_model=model).attach_to_nearest_cell()
+  sim.add_MME(MME(sim,interval=1.0))
+  return sim
+
+def peak_rss():
+  # peak resident set size of this process in bytes.  On Linux, ru_maxrss
+  # is inherited from the parent across exec, so VmHWM is used instead.
+  try:
+    with open('/proc/self/status') as f:
+      for line in f:
+        if line.startswith('VmHWM:'): return 1024*int(line.split()[1])
+  except OSError:
+    pass
+  import resource
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*(1 if sys.platform=='darwin' else 1024)
+
+def run_case(case):
+  # in a child process: build and run one end-to-end case, and return its results
+  t0=perf_counter()
+  sim=make_sim(case['cells'],case['UEs'],case['subbands'],case['pathloss'])
+  build=perf_counter()-t0
+  sim.run(until=case['until'])
+  stats=sim.stats()
+  return {'seconds': stats['wall_time']/case['until'], # wall-clock seconds per simulated second
+          'build_seconds': build,
+          'events_per_second': stats['events_per_wall_second'],
+          'UE_reports_per_second': (stats['UE_rsrp_reports']+stats['UE_cqi_reports'])/stats['wall_time'],
+          'max_rss': peak_rss()}
+
+def end_to_end(grid,until,only):
+  g=grids[grid]
+  results={}
+  for ncells,nues,n_subbands,pathloss in product(g['cells'],g['UEs'],g['subbands'],g['pathloss']):
+    name=f'run_cells={ncells}_UEs={nues}_subbands={n_subbands}_pathloss={pathloss}'
+    if only not in name: continue
+    if ncells*nues>g['max_pairs']:
+      print(f'{name}: skipped (cells*UEs>{g["max_pairs"]:g})',file=sys.stderr)
+      continue
+    case={'cells': ncells,'UEs': nues,'subbands': n_subbands,'pathloss': pathloss,'until': until}
+    p=subprocess.run([sys.executable,__file__,f'-case={json.dumps(case)}'],capture_output=True,text=True)
+    if p.returncode!=0:
+      print(f'{name}: failed\n{p.stderr[-2000:]}',file=sys.stderr)
+      continue
+    results[name]=dict(json.loads(p.stdout.splitlines()[-1]),**case)
+    print(f'{name}: {results[name]["seconds"]:.4g} s per simulated s, max_rss {results[name]["max_rss"]/2**20:.0f} MB',file=sys.stderr)
+  return results
+
+def time_call(stmt,repeat=5):
+  # seconds per call of stmt: the best of repeat timings, each long enough to be reliable
+  timer=timeit.Timer(stmt)
+  number,_=timer.autorange()
+  return min(timer.repeat(repeat=repeat,number=number))/number
+
+def micro(only):
+  from AIMM_simulator import Logger,Columnar_Logger
+  from AIMM_simulator.NR_5G_standard_functions import SINR_to_CQI,CQI_to_64QAM_efficiency
+  rng=np.random.default_rng(1)
+  params={'fc_GHz':3.5,'h_UT':2.0,'h_BS':20.0}
+  cell_xyz=np.array([500.0,500.0,20.0])
+  ue_xyz=np.array([700.0,400.0,2.0])
+  sinr=rng.uniform(-10.0,30.0,273)
+  benchmarks={}
+  for name in ('UMa','UMi','InH'):
+    model=pathloss_model(name,params)
+    benchmarks[f'micro_{name}_pathloss.__call__']=lambda model=model: model(cell_xyz,ue_xyz)
+  benchmarks['micro_SINR_to_CQI_scalar']=lambda: SINR_to_CQI(12.3)
+  benchmarks['micro_SINR_to_CQI_273_subbands']=lambda: SINR_to_CQI(sinr)
+  benchmarks['micro_CQI_to_64QAM_efficiency']=lambda: CQI_to_64QAM_efficiency(9)
+  results={}
+  for name,stmt in benchmarks.items():
+    if only in name: results[name]={'seconds': time_call(stmt)}
+  # handovers and loggers need a simulation with reports...
+  names=['micro_MME.do_handovers_cells=100_UEs=1000','micro_Logger.default_logger_cells=100_UEs=1000','micro_Columnar_Logger.default_columnar_logger_cells=100_UEs=1000']
+  if any(only in name for name in names):
+    sim=make_sim(100,1000)
+    with tempfile.TemporaryDirectory() as tmp, open('/dev/null' if sys.platform!='win32' else 'nul','w') as devnull:
+      logger=Logger(sim,f=devnull)
+      columnar=Columnar_Logger(sim,fn=tmp)
+      sim.run(until=2.0) # fill reports
+      for name,stmt in zip(names,(sim.mme.do_handovers,lambda: logger.default_logger(f=devnull),columnar.default_columnar_logger)):
+        if only in name: results[name]={'seconds': time_call(stmt)}
+  for name,r in results.items():
+    print(f'{name}: {1e6*r["seconds"]:.4g} us',file=sys.stderr)
+  return results
+
+import_code='''
+import sys
+from time import perf_counter
+t0=perf_counter()
+import AIMM_simulator
+t1=perf_counter()
+print(t1-t0,len(sys.modules),'matplotlib' in sys.modules)
+'''
+
+def import_time(repeat=5):
+  '''
+  Return the time to ``import AIMM_simulator`` in a fresh interpreter (the best of repeat), with the number of modules then loaded, and whether matplotlib was imported.
+  '''
+  times=[]
+  for k in range(repeat):
+    p=subprocess.run([sys.executable,'-c',import_code],capture_output=True,text=True,check=True)
+    seconds,modules,matplotlib=p.stdout.split()
+    times.append(float(seconds))
+  result={'seconds': min(times),'modules': int(modules),'matplotlib': matplotlib=='True'}
+  print(f'import_AIMM_simulator: {1e3*result["seconds"]:.1f} ms, {result["modules"]} modules',file=sys.stderr)
+  return result
+
+def meta(grid,until):
+  import simpy
+  from AIMM_simulator.AIMM_simulator import __version__
+  return {'date': strftime('%Y-%m-%d %H:%M:%S'),
+          'python': platform.python_version(),
+          'numpy': np.__version__,
+          'simpy': simpy.__version__,
+          'AIMM_simulator': __version__,
+          'machine': platform.platform(),
+          'processor': platform.processor(),
+          'grid': grid,
+          'until': until}
+
+def compare(results,baseline,threshold):
+  '''
+  Compare ``seconds`` and ``max_rss`` of each benchmark in both results and baseline, print a table, and return the list of regressions, those with a ratio (new/baseline) above 1+threshold.
+  '''
+  regressions=[]
+  print(f'{"benchmark":<72}{"metric":>9}{"baseline":>12}{"new":>12}{"ratio":>8}')
+  for name in sorted(set(results)&set(baseline)):
+    for metric in ('seconds','max_rss'):
+      if metric not in results[name] or metric not in baseline[name]: continue
+      old,new=baseline[name][metric],results[name][metric]
+      ratio=new/old if old>0 else float('inf')
+      flag=ratio>1.0+threshold
+      if flag: regressions.append((name,metric,ratio))
+      print(f'{name:<72}{metric:>9}{old:>12.4g}{new:>12.4g}{ratio:>8.3f}{"  REGRESSION" if flag else ""}')
+  for name in sorted(set(baseline)-set(results)): print(f'{name}: not run',file=sys.stderr)
+  return regressions
+
+if __name__=='__main__':
+  parser=argparse.ArgumentParser()
+  parser.add_argument('-grid',type=str,      help='grid of end-to-end cases: quick or full',default='quick',choices=tuple(grids))
+  parser.add_argument('-until',type=float,   help='simulated time of each end-to-end case',default=10.0)
+  parser.add_argument('-only',type=str,      help='run only benchmarks whose names contain this',default='')
+  parser.add_argument('-o',type=str,         help='output JSON file',default='')
+  parser.add_argument('-baseline',type=str,  help='baseline JSON file to compare with',default='')
+  parser.add_argument('-threshold',type=float,help='relative slowdown or memory growth flagged as a regression',default=0.1)
+  parser.add_argument('-import_budget',type=float,help='maximum seconds for import AIMM_simulator',default=0.3)
+  parser.add_argument('-case',type=str,      help=argparse.SUPPRESS,default='')
+  args=parser.parse_args()
+  if args.case: # child process
+    print(json.dumps(run_case(json.loads(args.case))))
+    sys.exit(0)
+  results={}
+  if args.only in 'import_AIMM_simulator':
+    results['import_AIMM_simulator']=import_time()
+  results.update(micro(args.only))
+  results.update(end_to_end(args.grid,args.until,args.only))
+  output={'meta': meta(args.grid,args.until),'results': results}
+  if args.o:
+    with open(args.o,'w') as f: json.dump(output,f,indent=1)
+    print(f'results written to {args.o}.',file=sys.stderr)
+  else:
+    json.dump(output,sys.stdout,indent=1)
+    print()
+  failed=False
+  if 'import_AIMM_simulator' in results:
+    r=results['import_AIMM_simulator']
+    if r['seconds']>args.import_budget or r['matplotlib']:
+      print(f'import AIMM_simulator took {r["seconds"]:.3f}s (budget {args.import_budget:g}s){", and imported matplotlib" if r["matplotlib"] else ""}.',file=sys.stderr)
+      failed=True
+  if args.baseline:
+    with open(args.baseline) as f: baseline=json.load(f)['results']
+    regressions=compare(results,baseline,args.threshold)
+    print(f'{len(regressions)} regressions above {100*args.threshold:g}%.',file=sys.stderr)
+    failed=failed or bool(regressions)
+  sys.exit(1 if failed else 0)
@@ -1,8 +1,12 @@
 # Keith Briggs 2022-11-14 like n9, but more cells and UEs
 # Keith Briggs 2021-05-12 add Q-learning
+# Warm up once and continue from the saved state (see Sim.checkpoint):
+# python3 AIMM_simulator_example_n10.py 10000 n10_warm.gz  # writes n10_warm.gz
+# python3 AIMM_simulator_example_n10.py 20000 n10_warm.gz  # restores it, runs 10000..20000
 # until=100000; python3 AIMM_simulator_example_n10.py "${until}" | ./realtime_plotter_03.py -np=6 -tm="${until}" -ylims='{0: (-0.5,6.5), 1: (-80,-25), 2: (-80,-25), 3: (-0.5,1.5), 4: (-0.5,1.5), 5: (0,10)}' -ylabels='{0: "serving cell",  1: "rsrp0", 2: "rsrp1", 3: "cell-edge", 4: "split", 5: "throughput",}' -fnb='img/AIMM_simulator_example_n10' -fst=2 -lw=1
 
 from sys import stderr,argv
+from os.path import exists
 from itertools import combinations
 import numpy as np
 from random import seed
@@ -31,8 +35,8 @@ class MyScenario(Scenario): # circle
   def loop(self,interval=1.0,speed=2.0):
     while True:
       for ue in self.sim.UEs:
-        ue.xyz[0]=500.0+150.0*np.cos(1e-3*self.sim.env.now)+10*np.random.standard_normal(1)
-        ue.xyz[1]=500.0+150.0*np.sin(1e-3*self.sim.env.now)+10*np.random.standard_normal(1)
+        ue.xyz[0]=500.0+150.0*np.cos(1e-3*self.sim.env.now)+10*np.random.standard_normal()
+        ue.xyz[1]=500.0+150.0*np.sin(1e-3*self.sim.env.now)+10*np.random.standard_normal()
       yield self.sim.wait(interval)
 
 class RSRPLogger(Logger):
@@ -43,10 +47,14 @@ class RSRPLogger(Logger):
       yield self.sim.wait(self.logging_interval)
 
 class ThroughputLogger(Logger):
+  tp_smoothed=0.0
+  def checkpoint(self):
+    return self.tp_smoothed
+  def restore(self,state):
+    self.tp_smoothed=state
   def loop(self):
     alpha=0.01; beta=1.0-alpha # smoothing parameters
     ric_celledge=self.sim.ric.celledge # set in RIC
-    tp_smoothed=0.0
     while True:
       rsrp=[cell.get_RSRP_reports_dict() for cell in self.sim.cells]
       for cell in self.sim.cells:
@@ -56,7 +64,7 @@ class ThroughputLogger(Logger):
           celledge=1 if (ue_i,cell.i,) in ric_celledge else 0
           xy=self.sim.get_UE_position(ue_i)[:2]
           tp=cell.get_UE_throughput(ue_i)
-          tp_smoothed=alpha*tp+beta*tp_smoothed
+          self.tp_smoothed=tp_smoothed=alpha*tp+beta*self.tp_smoothed
           mask=cell.get_subband_mask()
           split=1 if mask[0]!=mask[2] else 0 
           self.f.write(f'{self.sim.env.now:.1f}\t{cell.i}\t{rsrp[cell.i][ue_i]:.2f}\t{celledge}\t{split}\t{tp_smoothed:.2f}\n') # no x,y
@@ -77,20 +85,23 @@ class MyRIC(RIC):
     n_cells=len(cells)
     state=0 # initial state normal (no cell-edge UEs)
     throughputs_smoothed=np.zeros(n_ues)
-    MyRIC.ql.add_state(state,[0,])
-    for i,j in combinations(range(n_cells),2):
-      # state (i,j,l:bool) means that cells i and j have at least one 
-      # cell-edge UE, and that the spectrum is split (l)
-      # actions will be to split spectrum (or not) between cells i and j
-      actions=((i,j,False),(i,j,True))
-      MyRIC.ql.add_state((i,j,False),actions)
-      MyRIC.ql.add_state((i,j,True), actions)
+    if not MyRIC.ql.Q: # else restored from a checkpoint
+      MyRIC.ql.add_state(state,[0,])
+      for i,j in combinations(range(n_cells),2):
+        # state (i,j,l:bool) means that cells i and j have at least one 
+        # cell-edge UE, and that the spectrum is split (l)
+        # actions will be to split spectrum (or not) between cells i and j
+        actions=((i,j,False),(i,j,True))
+        MyRIC.ql.add_state((i,j,False),actions)
+        MyRIC.ql.add_state((i,j,True), actions)
     MyRIC.ql.show_Q(f=stderr)
-    yield self.sim.wait(10000.0) # wait before switching on Q-learner
+    # wait before switching on Q-learner (relative to now, so no
+    # further wait when restored from a later checkpoint)...
+    if self.sim.env.now<10000.0: yield self.sim.wait(10000.0-self.sim.env.now)
     while True:
       rsrp=[cell.get_RSRP_reports_dict() for cell in cells]
       while True: # wait for a throughput report
-        throughputs=np.array([cells[ue.serving_cell.i].get_UE_throughput(ue.i)[0] for ue in self.sim.UEs])
+        throughputs=np.array([cells[ue.serving_cell.i].get_UE_throughput(ue.i) for ue in self.sim.UEs])
         if not np.any(np.isneginf(throughputs)): break
         yield self.sim.wait(1.0) 
       throughputs/=n_ues # average throughput per UE
@@ -123,7 +134,7 @@ class MyRIC(RIC):
               cells[cell_j].set_subband_mask((1,1,1))
             while True: # wait for a throughput report
               yield self.sim.wait(1.0) 
-              tp=np.array([cells[serving_cell_i].get_UE_throughput(ue_k)[0] for ue in self.sim.UEs])
+              tp=np.array([cells[serving_cell_i].get_UE_throughput(ue_k) for ue in self.sim.UEs])
               if not np.any(np.isneginf(tp)): break
               yield self.sim.wait(1.0) 
             MyRIC.ql.update_Q(state,reward=np.min(tp))
@@ -137,15 +148,20 @@ class MyRIC(RIC):
             state=MyRIC.ql.episode(state)
             while True: # wait for a throughput report
               yield self.sim.wait(1.0) 
-              tp=np.array([cells[serving_cell_i].get_UE_throughput(ue_k)[0] for ue in self.sim.UEs])
+              tp=np.array([cells[serving_cell_i].get_UE_throughput(ue_k) for ue in self.sim.UEs])
               if not np.any(np.isneginf(tp)): break
               yield self.sim.wait(1.0) 
             MyRIC.ql.update_Q(state,reward=np.min(tp))
       yield self.sim.wait(interval)
+  def checkpoint(self):
+    return MyRIC.ql.Q,MyRIC.celledge
+  def restore(self,state):
+    MyRIC.ql.Q,MyRIC.celledge=state
+    MyRIC.ql.nstates=len(MyRIC.ql.Q)
   def finalize(self):
     MyRIC.ql.show_Q(f=stderr)
 
-def example_n10(until=1000):
+def example_n10(until=1000,checkpoint_fn=None):
   sim=Sim()
   # 7 cells in a hexagonal arrangement
   for i in range(2): # top row
@@ -163,7 +179,10 @@ def example_n10(until=1000):
   sim.add_scenario(MyScenario(sim))
   sim.add_MME(MME(sim,interval=10.0,verbosity=0))
   sim.add_ric(MyRIC(sim,interval=100.0))
+  warm=checkpoint_fn is not None and exists(checkpoint_fn)
+  if warm: sim.restore(checkpoint_fn)
   sim.run(until=until)
+  if checkpoint_fn is not None and not warm: sim.checkpoint(checkpoint_fn)
 
 if __name__ == '__main__':
   np.random.seed(1)
@@ -171,4 +190,4 @@ if __name__ == '__main__':
   until=1000
   argc=len(argv)
   if argc>1: until=float(argv[1])
-  example_n10(until)
+  example_n10(until,argv[2] if argc>2 else None)
@@ -0,0 +1,46 @@
+# Trace-driven mobility: UE positions replayed from a memory-mapped trace file.
+# python3 AIMM_simulator_example_n12.py | ../src/realtime_plotter.py -nplots=3 -tmax=1000 -ylims='{0: (0,1000), 1: (0,1000), 2: (0,10)}' -ylabels='{0: "UE[0] $x$", 1: "UE[0] $y$", 2: "UE[0] throughput"}'
+
+from os import remove
+from tempfile import mkstemp
+import numpy as np
+from AIMM_simulator import Sim,Logger,MME,Trace_Scenario,write_trace,np_array_to_str
+
+def make_trace(fn,nues,until,dt=0.5,chunk=100.0,seed=1):
+  # random walks, written chunk by chunk so that the whole trace is never in memory
+  rng=np.random.default_rng(seed)
+  xy=250.0+500.0*rng.random((nues,2))
+  t0=0.0
+  while t0<until:
+    ts=np.arange(t0,min(t0+chunk,until),dt)
+    rows=np.empty((len(ts)*nues,5))
+    for k,t in enumerate(ts):
+      xy+=rng.standard_normal((nues,2))
+      rows[k*nues:(k+1)*nues]=np.column_stack([np.full(nues,t),np.arange(nues),xy,np.full(nues,2.0)])
+    write_trace(fn,rows,append=t0>0.0)
+    t0+=chunk
+
+class MyLogger(Logger):
+  def loop(self):
+    while True:
+      ue0=self.sim.UEs[0]
+      tp=ue0.serving_cell.get_UE_throughput(0)
+      self.f.write(f'{self.sim.env.now:.1f}\t{np_array_to_str(ue0.xyz[:2])}\t{tp:.2f}\n')
+      yield self.sim.wait(self.logging_interval)
+
+def example_n12(until=1000.0,nues=20):
+  fd,fn=mkstemp(suffix='.trace')
+  make_trace(fn,nues,until)
+  sim=Sim()
+  for i in range(9):
+    sim.make_cell(xyz=(250.0*(1+i//3),250.0*(1+i%3),20.0))
+  for i in range(nues):
+    sim.make_UE().attach_to_nearest_cell()
+  sim.add_scenario(Trace_Scenario(sim,fn,interval=1.0))
+  sim.add_MME(MME(sim,interval=10.0))
+  sim.add_logger(MyLogger(sim,logging_interval=10.0))
+  sim.run(until=until)
+  remove(fn)
+
+if __name__=='__main__':
+  example_n12()
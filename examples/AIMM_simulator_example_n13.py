@@ -0,0 +1,40 @@
+# Monte Carlo replications in parallel: mean throughput with a confidence interval.
+# python3 AIMM_simulator_example_n13.py 2> /dev/null
+
+from AIMM_simulator import Sim,Logger,Scenario,MME,run_replications,replication_summary
+
+class MyScenario(Scenario):
+  def loop(self):
+    while True: # random walk of all UEs
+      self.sim.UE_locations[:,:2]+=self.sim.rng.standard_normal((self.sim.get_nues(),2))
+      yield self.sim.wait(self.interval)
+
+class KPI_Logger(Logger):
+  # accumulate the average throughput, and report it in finalize
+  def loop(self):
+    self.tp,self.n=0.0,0
+    while True:
+      self.tp+=self.sim.get_average_throughput()
+      self.n+=1
+      yield self.sim.wait(self.logging_interval)
+  def finalize(self):
+    self.sim.kpis['mean_throughput_Mbps']=float(self.tp/self.n)
+
+def build(seed):
+  sim=Sim(rng_seed=seed,show_params=False)
+  for i in range(9):
+    sim.make_cell(xyz=(250.0*(1+i//3),250.0*(1+i%3),20.0))
+  for i in range(20):
+    sim.make_UE().attach_to_nearest_cell()
+  sim.add_scenario(MyScenario(sim))
+  sim.add_MME(MME(sim,interval=10.0))
+  sim.add_logger(KPI_Logger(sim,logging_interval=10.0))
+  return sim
+
+if __name__=='__main__':
+  results=[]
+  for r in run_replications(build,seeds=range(8),until=200.0):
+    print(f'seed={r.seed} pid={r.pid} run_time={r.run_time:.2f}s kpis={r.kpis}')
+    results.append(r)
+  for k,v in replication_summary(results).items():
+    print(f'{k}: {v["mean"]:.3f} ± {v["ci"]:.3f} (n={v["n"]})')
@@ -0,0 +1,54 @@
+# What-if lookahead: at each decision time, a RIC forks the running
+# simulation into one branch per candidate subband split between two
+# neighbouring cells, simulates each for a few seconds, and applies the
+# split which gave the best mean throughput (Linux or macOS only).
+# python3 AIMM_simulator_example_n14.py 2> /dev/null
+
+import numpy as np
+from AIMM_simulator import Sim,Logger,Scenario,MME,RIC
+
+masks=[((1,1,1),(1,1,1)), ((1,1,0),(0,0,1)), ((1,0,0),(0,1,1))] # candidates for cells 0 and 1
+
+class MyScenario(Scenario):
+  def loop(self):
+    while True: # random walk of all UEs
+      self.sim.UE_locations[:,:2]+=3.0*self.sim.rng.standard_normal((self.sim.get_nues(),2))
+      yield self.sim.wait(self.interval)
+
+def apply_split(sim,k):
+  sim.cells[0].set_subband_mask(masks[k][0])
+  sim.cells[1].set_subband_mask(masks[k][1])
+
+def mean_throughput(sim):
+  return np.mean([ue.serving_cell.get_UE_throughput(ue.i) for ue in sim.UEs])
+
+class Lookahead_RIC(RIC):
+  def loop(self):
+    while True:
+      yield self.sim.wait(self.interval)
+      tp=self.sim.fork(len(masks),apply_split,horizon=5.0,kpi_fn=mean_throughput)
+      self.best=int(np.argmax(tp))
+      apply_split(self.sim,self.best)
+
+class MyLogger(Logger):
+  def loop(self):
+    yield self.sim.wait(1.0) # wait for the first reports
+    while True:
+      best=getattr(self.sim.ric,'best',0)
+      self.f.write(f'{self.sim.env.now:.0f}\t{best}\t{mean_throughput(self.sim):.3f}\n')
+      yield self.sim.wait(self.logging_interval)
+
+def example_n14(until=200.0):
+  sim=Sim(show_params=False)
+  sim.make_cell(xyz=(400.0,500.0,20.0),n_subbands=3)
+  sim.make_cell(xyz=(600.0,500.0,20.0),n_subbands=3)
+  for i in range(10):
+    sim.make_UE(xyz=(350.0+30.0*i,500.0+20.0*(i%3),2.0)).attach_to_nearest_cell()
+  sim.add_scenario(MyScenario(sim))
+  sim.add_MME(MME(sim,interval=10.0))
+  sim.add_ric(Lookahead_RIC(sim,interval=20.0))
+  sim.add_logger(MyLogger(sim,logging_interval=20.0))
+  sim.run(until=until)
+
+if __name__=='__main__':
+  example_n14()
@@ -0,0 +1,66 @@
+# Live view through shared memory: the simulation publishes UE positions,
+# serving cells, SINR and throughput into a shared memory block, and a
+# viewer in another process attaches and plots them at its own frame rate.
+# The simulation never waits for the viewer.
+# python3 AIMM_simulator_example_n15.py        # simulation only
+# python3 AIMM_simulator_example_n15.py view   # with live viewer (needs matplotlib)
+
+import sys
+import time
+from multiprocessing import Process
+from AIMM_simulator import Sim,Scenario,MME,Shared_state_publisher,Shared_state_reader
+
+class MyScenario(Scenario):
+  def loop(self):
+    while True: # random walk of all UEs, slowed to real time if pace>0
+      self.sim.UE_locations[:,:2]+=5.0*self.sim.rng.standard_normal((self.sim.get_nues(),2))
+      if self.pace>0.0: time.sleep(self.pace*self.interval)
+      yield self.sim.wait(self.interval)
+
+def viewer(name='AIMM_example_n15',fps=10.0):
+  import matplotlib.pyplot as plt
+  while True: # wait for the first update
+    try:
+      reader=Shared_state_reader(name)
+      break
+    except (FileNotFoundError,RuntimeError):
+      time.sleep(0.1)
+  fig,ax=plt.subplots(figsize=(6,6))
+  state=reader.read(('cell_xyz',))
+  ax.scatter(state['cell_xyz'][:,0],state['cell_xyz'][:,1],marker='^',s=100,c='k')
+  points=ax.scatter([],[],s=20,c=[],cmap='tab10',vmin=0,vmax=9)
+  ax.set_xlim(0.0,1000.0)
+  ax.set_ylim(0.0,1000.0)
+  plt.show(block=False)
+  while plt.fignum_exists(fig.number):
+    state=reader.read(('UE_xyz','serving_cell'))
+    if state is not None:
+      points.set_offsets(state['UE_xyz'][:,:2])
+      points.set_array(state['serving_cell'])
+      ax.set_title(f't={state["t"]:.0f}')
+    plt.pause(1.0/fps)
+  reader.close()
+
+def example_n15(until=500.0,pace=0.0):
+  sim=Sim(show_params=False)
+  for x in (250.0,750.0):
+    for y in (250.0,750.0):
+      sim.make_cell(xyz=(x,y,20.0),n_subbands=1)
+  for i in range(100):
+    sim.make_UE(xyz=(500.0+10.0*sim.rng.standard_normal(),500.0+10.0*sim.rng.standard_normal(),2.0)).attach_to_nearest_cell()
+  scenario=MyScenario(sim,interval=1.0)
+  scenario.pace=pace
+  sim.add_scenario(scenario)
+  sim.add_MME(MME(sim,interval=5.0))
+  publisher=Shared_state_publisher(sim,name='AIMM_example_n15',logging_interval=1.0)
+  sim.add_logger(publisher)
+  sim.run(until=until)
+
+if __name__=='__main__':
+  if sys.argv[1:]==['view']:
+    p=Process(target=viewer)
+    p.start()
+    example_n15(pace=0.05)
+    p.join()
+  else:
+    example_n15()
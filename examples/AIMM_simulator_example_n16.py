@@ -0,0 +1,80 @@
+# Forking with loggers: a RIC forks branches of the simulation in the
+# middle of a run (as in example 14), and the output of every logger of
+# the parent must be exactly what it is in the same run without forking,
+# since output of the branches is discarded (Linux or macOS only).
+# python3 AIMM_simulator_example_n16.py
+
+import sys
+from os import listdir,getpid
+from os.path import join
+from tempfile import TemporaryDirectory
+import numpy as np
+from AIMM_simulator import Sim,Logger,Scenario,MME,RIC,Async_writer,Columnar_Logger,read_columnar,Binary_Logger
+from AIMM_simulator import Shared_state_publisher,Shared_state_reader
+
+class MyScenario(Scenario):
+  def loop(self):
+    while True: # random walk of all UEs
+      self.sim.UE_locations[:,:2]+=3.0*self.sim.rng.standard_normal((self.sim.get_nues(),2))
+      yield self.sim.wait(self.interval)
+
+def branch(sim,k):
+  sim.cells[0].set_power_dBm(30.0+5.0*k) # make the branches differ
+
+class Forking_RIC(RIC):
+  def loop(self):
+    while True:
+      yield self.sim.wait(self.interval)
+      if self.fork: self.sim.fork(3,branch,horizon=25.0)
+      reader=Shared_state_reader(self.shared) # as published by the parent
+      state=reader.read()
+      self.seen.append((state['t'],state['updates'],state['UE_xyz'].tobytes()))
+      reader.close()
+
+def build(dirname,fork):
+  sim=Sim(show_params=False,quiet=True)
+  sim.make_cell(xyz=(400.0,500.0,20.0),n_subbands=2)
+  sim.make_cell(xyz=(600.0,500.0,20.0),n_subbands=2)
+  for i in range(10):
+    sim.make_UE(xyz=(350.0+30.0*i,500.0+20.0*(i%3),2.0)).attach_to_nearest_cell()
+  sim.add_scenario(MyScenario(sim))
+  sim.add_MME(MME(sim,interval=10.0))
+  ric=Forking_RIC(sim,interval=20.0)
+  ric.fork=fork
+  ric.shared=f'AIMM_example_n16_{getpid()}'
+  ric.seen=[]
+  sim.add_ric(ric)
+  sim.add_logger(Logger(sim,f=open(join(dirname,'text.tsv'),'w'),logging_interval=5.0))
+  sim.add_logger(Logger(sim,f=Async_writer(open(join(dirname,'async.tsv'),'w')),logging_interval=5.0))
+  sim.add_logger(Binary_Logger(sim,f=open(join(dirname,'frames.bin'),'wb'),logging_interval=5.0,batch_rows=16,max_latency=float('inf'))) # frames by size only, for comparison
+  sim.add_logger(Shared_state_publisher(sim,name=ric.shared,logging_interval=5.0))
+  sim.add_logger(Columnar_Logger(sim,fn=join(dirname,'columnar'),logging_interval=5.0,chunk_rows=16))
+  return sim
+
+def outputs(sim,dirname):
+  # everything written by the loggers of the parent
+  out={'shared state': repr(sim.ric.seen).encode()}
+  for fn in ('text.tsv','async.tsv','frames.bin'):
+    with open(join(dirname,fn),'rb') as f: out[fn]=f.read()
+  columns=read_columnar(join(dirname,'columnar'))
+  out['columnar']=b''.join(np.ascontiguousarray(columns[name]).tobytes() for name in sorted(columns))
+  with open(join(dirname,'columnar','schema.json'),'rb') as f: out['schema.json']=f.read()
+  out['files']=' '.join(sorted(listdir(join(dirname,'columnar')))).encode()
+  return out
+
+def example_n16(until=100.0):
+  results={}
+  for fork in (False,True):
+    with TemporaryDirectory() as dirname:
+      sim=build(dirname,fork)
+      sim.run(until=until)
+      results[fork]=outputs(sim,dirname)
+  ok=True
+  for name in results[False]:
+    same=results[False][name]==results[True][name]
+    print(f'{name:12s} {"unchanged" if same else "CHANGED"} by forking')
+    ok=ok and same
+  return ok
+
+if __name__=='__main__':
+  sys.exit(0 if example_n16() else 1)
@@ -0,0 +1,45 @@
+# UEs and cells added during a run: a scenario brings a new UE into the
+# network every 20 seconds, and a new cell at t=200, while a Summary_Logger
+# and a Metrics_store are sampling.  Their per-UE and per-cell state grows
+# with the network, and the new UEs read as having no report before they
+# arrived.
+# python3 AIMM_simulator_example_n17.py
+
+import sys
+import numpy as np
+from AIMM_simulator import Sim,Scenario,MME,Summary_Logger,Metrics_store
+
+class Arrivals(Scenario):
+  def loop(self):
+    while True:
+      yield self.sim.wait(self.interval)
+      xy=500.0+100.0*self.sim.rng.standard_normal(2)
+      ue=self.sim.make_UE(xyz=(xy[0],xy[1],2.0))
+      ue.attach_to_nearest_cell()
+      self.sim.env.process(ue.loop()) # main loops are started only by sim.run, so start this one here
+      if self.sim.env.now==200.0: self.sim.make_cell(xyz=(500.0,750.0,20.0),n_subbands=2)
+
+def example_n17(until=400.0,nues=5):
+  sim=Sim(show_params=False,quiet=True)
+  sim.make_cell(xyz=(400.0,500.0,20.0),n_subbands=2)
+  sim.make_cell(xyz=(600.0,500.0,20.0),n_subbands=2)
+  for i in range(nues):
+    sim.make_UE(xyz=(350.0+75.0*i,450.0,2.0)).attach_to_nearest_cell()
+  sim.add_scenario(Arrivals(sim,interval=20.0))
+  sim.add_MME(MME(sim,interval=10.0))
+  metrics=Metrics_store(sim,interval=5.0,capacity=32)
+  sim.add_metrics(metrics)
+  sim.add_logger(Summary_Logger(sim,logging_interval=5.0))
+  sim.run(until=until)
+  nues,ncells=sim.get_nues(),len(sim.cells)
+  summary=sim.kpis['summary']
+  times,tp=metrics.last('UE_throughput_Mbps')
+  print(f'{nues} UEs and {ncells} cells at the end')
+  print(f'mean UE throughput {sim.kpis["UE_throughput_Mbps_mean"]:.2f}Mb/s, p5 {sim.kpis["UE_throughput_Mbps_p5"]:.2f}Mb/s')
+  print(f'samples of each UE: {summary["UE_throughput_Mbps"]["count"]}')
+  print(f'mean throughput of each cell over the last 50s: {np.round(metrics.mean("cell_throughput_Mbps",50.0),2)}')
+  return (len(summary['UE_throughput_Mbps']['count'])==nues and len(summary['cell_n_attached']['count'])==ncells
+          and tp.shape[1]==nues and metrics.ema('UE_sinr_dB',20.0).shape==(nues,) and metrics.rate('cell_n_attached',50.0).shape==(ncells,))
+
+if __name__=='__main__':
+  sys.exit(0 if example_n17() else 1)
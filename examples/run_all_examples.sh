@@ -83,4 +83,52 @@ then
   exit 1
 fi
 
+# Trace-driven mobility example 12...
+python3 examples/AIMM_simulator_example_n12.py > /dev/null
+if [ $? -ne 0 ]
+then
+  echo "AIMM_simulator_example_n12.py failed - quitting!"
+  exit 1
+fi
+
+# Parallel replications example 13...
+python3 examples/AIMM_simulator_example_n13.py
+if [ $? -ne 0 ]
+then
+  echo "AIMM_simulator_example_n13.py failed - quitting!"
+  exit 1
+fi
+
+# What-if lookahead example 14...
+python3 examples/AIMM_simulator_example_n14.py
+if [ $? -ne 0 ]
+then
+  echo "AIMM_simulator_example_n14.py failed - quitting!"
+  exit 1
+fi
+
+# Shared memory live view example 15...
+python3 examples/AIMM_simulator_example_n15.py
+if [ $? -ne 0 ]
+then
+  echo "AIMM_simulator_example_n15.py failed - quitting!"
+  exit 1
+fi
+
+# Forking with loggers example 16...
+python3 examples/AIMM_simulator_example_n16.py
+if [ $? -ne 0 ]
+then
+  echo "AIMM_simulator_example_n16.py failed - quitting!"
+  exit 1
+fi
+
+# UEs and cells added during a run example 17...
+python3 examples/AIMM_simulator_example_n17.py
+if [ $? -ne 0 ]
+then
+  echo "AIMM_simulator_example_n17.py failed - quitting!"
+  exit 1
+fi
+
 #bash run_RIC_example.sh
@@ -11,21 +11,21 @@
 __version__='2.0.3'
 '''The AIMM simulator emulates a cellular radio system roughly following 5G concepts and channel models.'''
 
+import os
 from os.path import basename
 from sys import stderr,stdout,exit,version as pyversion
 from math import hypot,atan2,pi as math_pi
-from time import time,sleep
+from time import time,sleep,perf_counter
 from collections import deque
+import gzip,pickle,random
 try:
   import numpy as np
-except:
-  print('numpy not found: please do "pip install numpy"',file=stderr)
-  exit(1)
+except ImportError as e:
+  raise ImportError('numpy not found: please do "pip install numpy"') from e
 try:
   import simpy
-except:
-  print('simpy not found: please do "pip install simpy"',file=stderr)
-  exit(1)
+except ImportError as e:
+  raise ImportError('simpy not found: please do "pip install simpy"') from e
 from .NR_5G_standard_functions import SINR_to_CQI,CQI_to_64QAM_efficiency
 from .UMa_pathloss_model import UMa_pathloss
 
@@ -57,6 +57,40 @@ def _nearest_weighted_point(x,pts,w=1.0):
     print('weighted_distances=',weighted_distances)
   return weighted_distances[imin],imin
 
+# Sim.checkpoint, restore and fork need simpy internals which have no
+# public interface: the event queue, a heap of (time,priority,eid,event)
+# entries; the current time; and StopSimulation.callback, by which
+# env.run(until) stops.  All uses are in these functions, which
+# are written for simpy 4 (checked with 4.1); pyproject.toml
+# requires simpy<5 so that a change to them cannot go unnoticed.
+
+def _simpy_queue(env):
+  # internal use only - the (time,priority,eid,event) entries of the
+  # scheduled events of env
+  return env._queue
+
+def _simpy_set_now(env,now):
+  # internal use only - set the time of env, which must have no events
+  # scheduled, so that nothing is scheduled in its past
+  env._now=now
+
+def _simpy_cancel_until(env):
+  # internal use only - make env.run ignore the until of a run in progress
+  # (in a child of Sim.fork), by removing the callback which stops it
+  for event_t,priority,eid,event in env._queue:
+    if event.callbacks and simpy.core.StopSimulation.callback in event.callbacks:
+      event.callbacks.remove(simpy.core.StopSimulation.callback)
+
+class _Environment(simpy.Environment):
+  # internal use only - a simpy Environment which counts the events it
+  # processes, for Sim.stats (env.run calls step once for each event)
+  def __init__(s,*args,**kwargs):
+    simpy.Environment.__init__(s,*args,**kwargs)
+    s.n_events=0
+  def step(s):
+    s.n_events+=1
+    simpy.Environment.step(s)
+
 def to_dB(x):
   return 10.0*np.log10(x)
 
@@ -65,7 +99,7 @@ def from_dB(x):
 
 class Cell:
   '''
-  Class representing a single Cell (gNB).  As instances are created, the are automatically given indices starting from 0.  This index is available as the data member ``cell.i``.   The variable ``Cell.i`` is always the current number of cells.
+  Class representing a single Cell (gNB).  As instances are created, the are automatically given indices starting from 0 within their Sim, so that ``sim.cells[cell.i] is cell``.  This index is available as the data member ``cell.i``.  The current number of cells is ``sim.get_ncells()``.  Because indices belong to the Sim, any number of Sim instances can coexist in one process.
 
   Parameters
   ----------
@@ -94,7 +128,6 @@ class Cell:
   verbosity : int
       Level of debugging output (0=none).
   '''
-  i=0
 
   def __init__(s,
                sim,
@@ -110,7 +143,7 @@ class Cell:
                f_callback_kwargs={},
                verbosity=0):
     # default scene 1000m x 1000m, but keep cells near the centre
-    s.i=Cell.i; Cell.i+=1
+    s.i=sim._next_cell_i; sim._next_cell_i+=1
     s.sim=sim
     s.interval=interval
     s.bw_MHz=bw_MHz
@@ -229,11 +262,25 @@ class Cell:
     '''
     s.MIMO_gain_dB=MIMO_gain_dB
 
+  def _refresh_report(s,ue_i):
+    # internal use only - in lazy_reports mode, compute the report of UE[i]
+    # if it is attached here and its report is stale
+    if s.sim.lazy_reports and ue_i in s.attached:
+      s.sim.UEs[ue_i].refresh_report()
+
+  def refresh_reports(s):
+    '''
+    Bring the CQI and throughput reports of all UEs attached to this cell up to date.  This is only needed in ``lazy_reports`` mode (see ``Sim``), and only by code which reads ``cell.reports`` directly instead of using the accessor functions.
+    '''
+    if s.sim.lazy_reports:
+      for ue_i in list(s.attached): s.sim.UEs[ue_i].refresh_report()
+
   def get_UE_throughput(s,ue_i): # FIXME do we want an array over subbands?
     '''
     Return the total current throughput in Mb/s of UE[i] in the simulation.
     The value -np.inf indicates that there is no current report.
     '''
+    s._refresh_report(ue_i)
     reports=s.reports['throughput_Mbps']
     if ue_i in reports: return reports[ue_i][1]
     return -np.inf # special value to indicate no report
@@ -242,6 +289,7 @@ class Cell:
     '''
     Return the current CQI of UE[i] in the simulation, as an array across all subbands.  An array of NaNs is returned if there is no report.
     '''
+    s._refresh_report(ue_i)
     reports=s.reports['cqi']
     return reports[ue_i][1] if ue_i in reports else np.nan*np.ones(s.n_subbands)
 
@@ -263,6 +311,7 @@ class Cell:
     '''
     Return the average throughput over all UEs attached to this cell.
     '''
+    s.refresh_reports()
     reports,k=s.reports['throughput_Mbps'],0
     ave=np.zeros(s.n_subbands)
     for ue_i in reports:
@@ -300,7 +349,7 @@ class Cell:
 
 class UE:
   '''
-    Represents a single UE. As instances are created, the are automatically given indices starting from 0.  This index is available as the data member ``ue.i``.   The static (class-level) variable ``UE.i`` is always the current number of UEs.
+    Represents a single UE. As instances are created, the are automatically given indices starting from 0 within their Sim, so that ``sim.UEs[ue.i] is ue``.  This index is available as the data member ``ue.i``.  The current number of UEs is ``sim.get_nues()``.
 
     Parameters
     ----------
@@ -312,6 +361,8 @@ class UE:
       Antenna height of user terminal in metres; only used if xyz is not provided.
     reporting_interval : float
       Time interval between UE reports being sent to the serving cell.
+    reporting_policy :
+      If not ``None``, a callable object such as an ``Adaptive_reporting_interval`` instance, called as ``reporting_policy(ue)`` after each report, and returning the time until the next report.  In this case ``reporting_interval`` is not used.
     f_callback :
       A function with signature ``f_callback(self,kwargs)``, which will be called at each iteration of the main loop.
     f_callback_kwargs :
@@ -325,11 +376,10 @@ class UE:
       is used.
       See further ``NR_5G_standard_functions_00.py``.
   '''
-  i=0
 
-  def __init__(s,sim,xyz=None,reporting_interval=1.0,pathloss_model=None,h_UT=2.0,f_callback=None,f_callback_kwargs={},verbosity=0):
+  def __init__(s,sim,xyz=None,reporting_interval=1.0,reporting_policy=None,pathloss_model=None,h_UT=2.0,f_callback=None,f_callback_kwargs={},verbosity=0):
     s.sim=sim
-    s.i=UE.i; UE.i+=1
+    s.i=sim._next_UE_i; sim._next_UE_i+=1
     s.serving_cell=None
     s.f_callback=f_callback
     s.f_callback_kwargs=f_callback_kwargs
@@ -339,6 +389,7 @@ class UE:
     # This is for use in handover algorithms
     s.serving_cell_ids=deque([(-1,None)]*10,maxlen=10)
     s.reporting_interval=reporting_interval
+    s.reporting_policy=reporting_policy
     if xyz is not None:
       s.xyz=np.array(xyz,dtype=float)
     else:
@@ -355,12 +406,13 @@ class UE:
       s.pathloss=pathloss_model
       if s.pathloss.__doc__ is not None:
         if verbosity>1: print(f'Using user-specified pathloss model "{s.pathloss.__doc__}".',file=stderr)
-      else:
+      elif not s.sim.quiet:
         print(f'Using user-specified pathloss model.',file=stderr)
     s.verbosity=verbosity
     s.noise_power_dBm=-140.0
     s.cqi=None
     s.sinr_dB=None
+    s._report_stale=False # only used in lazy_reports mode
     # Keith Briggs 2022-10-12 loops now started in Sim.__init__
     #s.sim.env.process(s.run_subband_cqi_report())
     #s.sim.env.process(s.loop()) # this does reports to all cells
@@ -381,9 +433,15 @@ class UE:
     while True:
       if s.f_callback is not None: s.f_callback(s,**s.f_callback_kwargs)
       s.send_rsrp_reports()
-      s.send_subband_cqi_report() # FIXME merge these two reports
+      if s.sim.lazy_reports: # computed when next read
+        s._report_stale=True
+      else:
+        s.send_subband_cqi_report() # FIXME merge these two reports
       #print(f'dbg: Main loop of UE class started'); exit()
-      yield s.sim.env.timeout(s.reporting_interval)
+      if s.reporting_policy is None:
+        yield s.sim.env.timeout(s.reporting_interval)
+      else:
+        yield s.sim.env.timeout(s.reporting_policy(s))
 
   def get_serving_cell(s):
     '''
@@ -403,7 +461,10 @@ class UE:
 
   def get_xyz(s):
     '''
-    Return the current position of this UE.
+    Return the current position of this UE.  This is a view of a row of
+    ``sim.UE_locations``, which stops being the UE's position when that
+    storage is reallocated by a later ``make_UE`` (see ``Sim``), so should
+    not be kept.
     '''
     return s.xyz
 
@@ -411,7 +472,7 @@ class UE:
     '''
     Set a new position for this UE.
     '''
-    s.xyz=np.array(xyz)
+    s.xyz[:]=xyz # in place, since s.xyz is a row of sim.UE_locations
     if verbose: print(f'UE[{s.i}] is now at {s.xyz}',file=stderr)
 
   def attach(s,cell,quiet=True):
@@ -472,6 +533,7 @@ class UE:
     '''
     Return the current CQI of this UE, as an array across all subbands.
     '''
+    if s._report_stale: s.refresh_report()
     return s.cqi
 
   def get_SINR_dB(s):
@@ -479,14 +541,26 @@ class UE:
     Return the current SINR of this UE, as an array across all subbands.
     The return value ``None`` indicates that there is no current report.
     '''
+    if s._report_stale: s.refresh_report()
     return s.sinr_dB
 
+  def refresh_report(s):
+    '''
+    In ``lazy_reports`` mode (see ``Sim``), compute the CQI and throughput report of this UE if it is stale; otherwise do nothing.  The accessor functions of UE and Cell call this, so it is rarely needed directly.
+    '''
+    if s._report_stale:
+      s._report_stale=False
+      s.send_subband_cqi_report()
+
   def send_rsrp_reports(s,threshold=-120.0):
     '''
     Send RSRP reports in dBm to all cells for which it is over the threshold.
     Subbands not handled.
     '''
     # antenna pattern computation added Keith Briggs 2021-11-24.
+    counters=s.sim.counters
+    counters['UE_rsrp_reports']+=1
+    counters['pathloss_evaluations']+=len(s.sim.cells)
     for cell in s.sim.cells:
       pl_dB=s.pathloss(cell.xyz,s.xyz) # 2021-10-29
       antenna_gain_dB=0.0
@@ -511,6 +585,9 @@ class UE:
     Also saves the CQI[1]s in s.cqi, and returns the throughput value.
     '''
     if s.serving_cell is None: return 0.0 # 2022-08-08 detached
+    counters=s.sim.counters
+    counters['UE_cqi_reports']+=1
+    counters['pathloss_evaluations']+=len(s.sim.cells)
     interference=from_dB(s.noise_power_dBm)*np.ones(s.serving_cell.n_subbands)
     for cell in s.sim.cells:
       pl_dB=s.pathloss(cell.xyz,s.xyz)
@@ -544,36 +621,142 @@ class UE:
 
 # END class UE
 
+class Adaptive_reporting_interval:
+  '''
+  Mobility-aware reporting policy for UEs.  An instance is passed to UEs as
+  ``reporting_policy``, and may be shared by many UEs.  After each report,
+  the interval to the next report is multiplied by ``factor`` if the UE has
+  moved less than ``displacement_threshold`` and its SINR has changed by less
+  than ``sinr_threshold_dB`` (on every subband) since the previous report, and
+  divided by ``factor`` otherwise.  The interval always stays between
+  ``min_interval`` and ``max_interval``, so ``max_interval`` bounds the
+  staleness of the reports of every UE.  Nearly static UEs therefore report
+  rarely, while moving UEs report as often as with a fixed interval.  In
+  ``lazy_reports`` mode (see ``Sim``), the policy brings the report of the
+  UE up to date before comparing its SINR, so UEs using it gain nothing
+  from that mode.
+
+  Parameters
+  ----------
+  min_interval : float
+    Shortest interval between reports; used whenever a UE moves.
+  max_interval : float
+    Longest interval between reports.
+  displacement_threshold : float
+    Distance in metres moved since the last report, above which the interval shrinks.
+  sinr_threshold_dB : float
+    Change in SINR in dB since the last report, above which the interval shrinks.
+  factor : float
+    Factor by which the interval grows or shrinks at each report.
+  '''
+  def __init__(s,min_interval=1.0,max_interval=8.0,displacement_threshold=5.0,sinr_threshold_dB=1.0,factor=2.0):
+    assert 0.0<min_interval<=max_interval and factor>1.0
+    s.min_interval=min_interval
+    s.max_interval=max_interval
+    s.displacement_threshold=displacement_threshold
+    s.sinr_threshold_dB=sinr_threshold_dB
+    s.factor=factor
+    # state[ue] is (position, SINR, interval) at the last report of ue
+    s.state={}
+
+  def __call__(s,ue):
+    '''
+    Return the time until the next report of ue.
+    '''
+    sinr_dB=ue.get_SINR_dB() # computes a stale lazy report now
+    if sinr_dB is not None: sinr_dB=np.array(sinr_dB)
+    if ue not in s.state:
+      s.state[ue]=(ue.xyz.copy(),sinr_dB,s.min_interval)
+      return s.min_interval
+    xyz,last_sinr_dB,interval=s.state[ue]
+    if np.linalg.norm(ue.xyz-xyz)>s.displacement_threshold:
+      changed=True
+    elif sinr_dB is None or last_sinr_dB is None:
+      changed=(sinr_dB is None)!=(last_sinr_dB is None) # attached or detached
+    elif sinr_dB.shape!=last_sinr_dB.shape:
+      changed=True # handed over to a cell with a different number of subbands
+    else:
+      changed=np.any(np.abs(sinr_dB-last_sinr_dB)>s.sinr_threshold_dB)
+    if changed: interval=max(s.min_interval,interval/s.factor)
+    else:       interval=min(s.max_interval,interval*s.factor)
+    s.state[ue]=(ue.xyz.copy(),sinr_dB,interval)
+    return interval
+
+  def get_interval(s,ue):
+    '''
+    Return the current reporting interval of ue, or ``None`` if ue has not reported yet.
+    '''
+    return s.state[ue][2] if ue in s.state else None
+
+# END class Adaptive_reporting_interval
+
 class Sim:
   '''
   Class representing the complete simulation.
 
+  The positions of all UEs made by ``make_UE`` are held in the array
+  ``sim.UE_locations`` of shape (nues,3), whose row i is ``UE[i].xyz``, so
+  that a Scenario can move all UEs with one vectorized write.  The storage
+  is reallocated as UEs are added, so an array obtained from
+  ``sim.UE_locations``, ``get_UE_positions()`` or ``ue.get_xyz()`` stops
+  moving the UEs after a later ``make_UE``: fetch ``sim.UE_locations``
+  afresh at each step, as ``Trace_Scenario`` does.  A UE built directly
+  with ``UE(sim)`` instead of ``make_UE`` is not in ``sim.UE_locations``.
+
   Parameters
   ----------
   params : dict
-    A dictionary of additional global parameters which need to be accessible to downstream functions. In the instance, these parameters will be available as ``sim.params``.  If ``params['profile']`` is set to a non-empty string, then a code profile will be performed and the results saved to the filename given by the string.  There will be some execution time overhead when profiling.
+    A dictionary of additional global parameters which need to be accessible to downstream functions. In the instance, these parameters will be available as ``sim.params``.  If ``params['profile']`` is set to a non-empty string, then the wall-clock time spent in each kind of main loop (UEs, cells, MME, RIC, loggers, scenario, metrics) and in UE and cell callbacks is measured, printed as a table to stderr at the end of each run, and saved as JSON to the filename given by the string (see ``profiling.Loop_timer``).  If also ``params['profile_mode']=='sampling'``, the time is instead estimated by sampling the stack every ``params['profile_interval']`` (default 0.001) seconds, which has no overhead in the simulation and also reports the hottest functions (see ``profiling.Stack_sampler``).  If ``params['trace']`` is set to a filename, every resumption of every main loop is recorded, and written to that file at the end of each run in the Chrome trace-event format, for viewing in chrome://tracing or Perfetto; ``params['trace_kinds']`` may list the kinds of loop to trace (for example ``['ric','logger']``), and ``params['trace_sample_every']`` may be set to record only every n-th resumption of each kind (see ``profiling.Chrome_tracer``).  If ``params['lazy_reports']`` is true, then at each reporting time UE CQI and throughput reports are only marked stale, and are computed when first read through ``Cell.get_UE_CQI``, ``Cell.get_UE_throughput``, ``Cell.get_average_throughput``, ``UE.get_CQI`` or ``UE.get_SINR_dB``.  This saves most of the work when few reports are read, but code which reads ``cell.reports`` directly must call ``cell.refresh_reports()`` first.  The results may differ from those without lazy reports: a report is computed from the state (positions, powers, subband masks and attachments) when it is first read, not at the reporting time, and is stamped with the time it is read; and it is then kept until the next reporting time of the UE, even if that state changes in between.  If ``params['progress']`` is set to a number of seconds, a progress line is printed to stderr at most that often during a run (see ``stats``).
+  show_params : bool
+    Whether to print the parameters to stderr at startup.
+  rng_seed : int
+    Seed of the random number generator ``sim.rng``.
+  quiet : bool
+    If True, nothing is printed to stderr at startup, at the start and end of runs, or when the MME and RIC start, which saves time and clutter for batches of short runs.  Warnings, and output requested explicitly (such as progress lines), are still printed; profiles are only written to their JSON file.
   '''
 
-  def __init__(s,params={'fc_GHz':3.5,'h_UT':2.0,'h_BS':20.0},show_params=True,rng_seed=0):
+  def __init__(s,params={'fc_GHz':3.5,'h_UT':2.0,'h_BS':20.0},show_params=True,rng_seed=0,quiet=False):
     s.__version__=__version__
     s.params=params
+    s.quiet=quiet
     # set default values for operating frequenct, user terminal height, and
     # base station height...
     if 'fc_GHz' not in params: params['fc_GHz']=3.5
     if 'h_UT'   not in params: params['h_UT']=2.0
     if 'h_BS'   not in params: params['h_BS']=20.0
-    s.env=simpy.Environment()
+    s.lazy_reports=bool(params.get('lazy_reports',False))
+    s.env=_Environment()
     s.rng=np.random.default_rng(rng_seed)
     s.loggers=[]
     s.scenario=None
     s.ric=None
     s.mme=None
+    s.metrics=None
     s.hetnet=None # unknown at this point; will be set to True or False
     s.cells=[]
     s.UEs=[]
+    s._next_cell_i=s._next_UE_i=0 # indices of the next Cell and UE created
     s.events=[]
+    s._loops_started=False
     s.cell_locations=np.empty((0,3))
+    # kpis is filled in by user code (typically in finalize functions),
+    # and returned by run_replications and sweep
+    s.kpis={}
+    # performance counters, reported by stats()...
+    s.counters=dict.fromkeys(('UE_rsrp_reports','UE_cqi_reports','pathloss_evaluations','handovers','pingpongs_suppressed','RIC_invocations'),0)
+    s._loop_observers=[]
+    s._wall_time=0.0 # wall-clock seconds spent in env.run, over all runs
+    s._run_sim_time=0.0 # simulation time advanced by runs
+    s._run_t0=None # perf_counter() at start of the current run
+    s._profiler=None # see params['profile']
+    s._tracer=None # see params['trace']
+    s._memory_snapshot=None # tracemalloc snapshot of the last memory_report
+    # UE positions are rows of one array, so that they can be updated
+    # all at once (e.g. by Trace_Scenario).  ue.xyz is a view of its row.
+    s._UE_xyz=np.empty((0,3))
+    s.UE_locations=s._UE_xyz
     np.set_printoptions(precision=2,linewidth=200)
+    if quiet: return
     pyv=pyversion.replace('\n','') #[:pyversion.index('(default')]
     print(f'python version={pyv}',file=stderr)
     print(f'numpy  version={np.__version__}',file=stderr)
@@ -610,8 +793,23 @@ class Sim:
     Convenience function: make a new UE instance and add it to the simulation; parameters as for the UE class. Return the new UE instance.
     '''
     s.UEs.append(UE(s,**kwargs))
+    s._add_UE_location(s.UEs[-1])
     return s.UEs[-1]
 
+  def _add_UE_location(s,ue):
+    # internal use only - store the position of a new UE as the next row of
+    # s.UE_locations, and make ue.xyz a view of that row.  The storage grows
+    # by doubling, and all existing views are rebound when it does.
+    n=len(s.UEs)
+    if n>s._UE_xyz.shape[0]:
+      buf=np.empty((max(8,2*s._UE_xyz.shape[0]),3))
+      buf[:n-1]=s._UE_xyz[:n-1]
+      s._UE_xyz=buf
+      for k,ue_k in enumerate(s.UEs[:-1]): ue_k.xyz=buf[k]
+    s._UE_xyz[n-1]=ue.xyz
+    ue.xyz=s._UE_xyz[n-1]
+    s.UE_locations=s._UE_xyz[:n]
+
   def get_ncells(s):
     '''
     Return the current number of cells in the simulation.
@@ -630,6 +828,16 @@ class Sim:
     '''
     return s.UEs[ue_i].xyz
 
+  def get_UE_positions(s):
+    '''
+    Return the xyz positions of all UEs, as an array of shape (nues,3).
+    Row i is UE[i].xyz, and writing to the array moves the UEs, but only
+    until the next ``make_UE``, which may reallocate the storage: fetch the
+    array again after adding UEs, or at each step of a Scenario.  UEs not
+    made by ``make_UE`` are not included.
+    '''
+    return s.UE_locations
+
   def get_average_throughput(s):
     '''
     Return the average throughput over all UEs attached to all cells.
@@ -676,6 +884,12 @@ class Sim:
     assert isinstance(mme,MME)
     s.mme=mme
 
+  def add_metrics(s,metrics):
+    '''
+    Add a ``Metrics_store`` instance to the simulation; it is then available as ``sim.metrics``.
+    '''
+    s.metrics=metrics
+
   def add_event(s,event):
     s.events.append(event)
 
@@ -720,54 +934,177 @@ class Sim:
       if ave_rsrp>best_rsrp: k,best_rsrp=cell.i,ave_rsrp
     return k
 
-  def _start_loops(s):
-    # internal use only - start all main loops
-    for logger in s.loggers:
-      s.env.process(logger.loop())
-    if s.scenario is not None:
-      s.env.process(s.scenario.loop())
-    if s.ric is not None:
-      s.env.process(s.ric.loop())
-    if s.mme is not None:
-      s.env.process(s.mme.loop())
+  def _loop_owners(s):
+    # internal use only - the objects with main loops, with a key for each
+    owners=[(('logger',k),logger) for k,logger in enumerate(s.loggers)]
+    if s.scenario is not None: owners.append((('scenario',),s.scenario))
+    if s.ric is not None: owners.append((('ric',),s.ric))
+    if s.mme is not None: owners.append((('mme',),s.mme))
+    if s.metrics is not None: owners.append((('metrics',),s.metrics))
+    owners+=[(('cell',cell.i),cell) for cell in s.cells]
+    owners+=[(('UE',ue.i),ue) for ue in s.UEs]
+    return owners
+
+  def _start_loops(s,phases=None):
+    # internal use only - start all main loops.  If phases is given (when
+    # restoring a checkpoint), it maps the key of each loop owner to
+    # (delay,priority,order): the loop is started after the delay, and loops due at
+    # the same time keep their saved order.  Owners not in it are not started.
+    s._loops_started=True
+    s._processes={} # key -> simpy Process, for checkpoint
+    owners=s._loop_owners()
+    if phases is not None:
+      for key,owner in sorted((o for o in owners if o[0] in phases),key=lambda o: phases[o[0]]):
+        s._processes[key]=s.env.process(s._instrument(key,s._delayed_loop(phases[key][0],owner)))
+      if s.params.get('progress'): s.env.process(s._progress_loop())
+      return
+    n=sum(1 for key,owner in owners if key[0] not in ('cell','UE'))
+    for key,owner in owners[:n]: # loggers, scenario, RIC, MME, metrics
+      s._processes[key]=s.env.process(s._instrument(key,owner.loop()))
     for event in s.events: # TODO ?
       s.env.process(event)
-    for cell in s.cells: # 2022-10-12 start Cells
-      s.env.process(cell.loop())
-    for ue in s.UEs: # 2022-10-12 start UEs
-      #print(f'About to start main loop of UE[{ue.i}]..')
-      s.env.process(ue.loop())
-      #s.env.process(UE.run_subband_cqi_report())
-    #sleep(2); exit()
+    for key,owner in owners[n:]: # 2022-10-12 start Cells and UEs
+      s._processes[key]=s.env.process(s._instrument(key,owner.loop()))
+    if s.params.get('progress'): s.env.process(s._progress_loop())
+
+  def add_loop_observer(s,observer):
+    '''
+    Register ``observer(key,wall_begin,wall_end,sim_time)`` to be called
+    after every resumption of every main loop, with the loop's key (for
+    example ``('UE',3)``, ``('cell',0)``, ``('mme',)``, ``('ric',)``,
+    ``('logger',0)`` or ``('scenario',)``), the ``perf_counter`` times
+    before and after the resumption, and the simulation time.  Must be
+    called before the run starts.  Used by ``Loop_timer`` and
+    ``Chrome_tracer``; there is no overhead when no observer is registered.
+    '''
+    s._loop_observers.append(observer)
+
+  def _instrument(s,key,gen):
+    # internal use only - return the main loop generator gen, wrapped if
+    # its resumptions need to be counted or observed
+    if not s._loop_observers and key!=('ric',): return gen
+    return s._observed_loop(key,gen)
+
+  def _observed_loop(s,key,gen):
+    # internal use only - drive gen as simpy would, timing each resumption
+    observers=s._loop_observers
+    counters=s.counters
+    value,exc=None,None
+    while True:
+      t0=perf_counter()
+      try:
+        event=gen.send(value) if exc is None else gen.throw(exc)
+      except StopIteration:
+        return
+      finally:
+        t1=perf_counter()
+        if key==('ric',): counters['RIC_invocations']+=1
+        for observer in observers: observer(key,t0,t1,s.env.now)
+      try:
+        value,exc=(yield event),None
+      except GeneratorExit:
+        gen.close()
+        raise
+      except BaseException as e: # e.g. simpy.Interrupt: pass it on
+        value,exc=None,e
+
+  def _progress_loop(s):
+    # internal use only - print a progress line to stderr about every
+    # params['progress'] wall-clock seconds.  The loop sleeps for the
+    # simulation time expected to take the wall-clock time left until the
+    # next line, at the rate measured so far, so it wakes only a few times
+    # per line whatever the speed of the simulation
+    every=float(s.params['progress'])
+    last,now_last=perf_counter(),s.env.now
+    shortest=max(s.until,1e-9)*1e-6
+    step=max(s.until-s.env.now,1e-9)/1000.0 # first guess
+    while True:
+      yield s.env.timeout(step)
+      wall=perf_counter()-last
+      rate=(s.env.now-now_last)/max(wall,1e-9)
+      if wall<every: # early
+        step=max(rate*(every-wall),shortest)
+        continue
+      last,now_last=perf_counter(),s.env.now
+      step=max(rate*every,shortest)
+      st=s.stats()
+      rate=st['sim_seconds_per_wall_second']
+      eta=(s.until-s.env.now)/rate if rate>0 else float('inf')
+      print(f'Sim: t={float(s.env.now):.1f}/{s.until:g} ({100.0*s.env.now/s.until:.1f}%), {rate:.3g} sim-s/wall-s, {st["events_per_wall_second"]:.3g} events/s, ETA {eta:.0f}s',file=stderr)
+
+  def stats(s):
+    '''
+    Return a dictionary of performance statistics, which may be called
+    during or after a run: simulation time; wall-clock seconds spent in
+    runs; simulation seconds per wall-clock second; simpy events processed,
+    and per wall-clock second; and the counters ``UE_rsrp_reports``,
+    ``UE_cqi_reports``, ``pathloss_evaluations``, ``handovers``,
+    ``pingpongs_suppressed`` and ``RIC_invocations`` (resumptions of the
+    RIC loop).  If ``params['progress']`` is set, a progress line with these
+    rates and an estimated time to completion is printed to stderr at most
+    every ``params['progress']`` wall-clock seconds.
+    '''
+    wall=s._wall_time
+    sim_time=s._run_sim_time
+    if s._run_t0 is not None: # in a run
+      wall+=perf_counter()-s._run_t0
+      sim_time+=s.env.now-s._run_now0
+    events=s.env.n_events
+    return dict({'sim_time': float(s.env.now),
+                 'wall_time': wall,
+                 'sim_seconds_per_wall_second': sim_time/wall if wall>0 else 0.0,
+                 'events': events,
+                 'events_per_wall_second': events/wall if wall>0 else 0.0},**s.counters)
+
+  def memory_report(s,top=10):
+    '''
+    Return a dictionary of the estimated number of bytes held by each
+    subsystem: ``cell_reports`` (the ``reports`` dictionaries of all
+    cells), ``rsrp_history``, ``cells`` (everything else held by cells),
+    ``UEs``, ``loggers``, ``ric``, ``mme``, ``scenario`` and ``metrics``,
+    with their ``total``, and the maximum resident set size of the process
+    ``max_rss`` where available.  Sizes are found by walking attributes,
+    with numpy arrays counted by their data size, and nothing counted twice.
+    If tracemalloc is tracing (see ``memory.Memory_Logger``), the report
+    also gives the ``traced_current`` and ``traced_peak`` memory, the
+    ``top`` allocation sites by size, and the ``growth`` of each since the
+    previous report, as lists of (site,bytes,count).  This may be called at
+    any time, for example periodically by a ``memory.Memory_Logger``.
+    '''
+    from .memory import memory_report
+    return memory_report(s,top)
+
+  def _delayed_loop(s,delay,owner):
+    # internal use only - wait, then run the main loop of owner from its start
+    yield s.env.timeout(delay)
+    yield from owner.loop()
 
   def run(s,until):
     s._set_hetnet()
     s.until=until
-    print(f'Sim: starting run for simulation time {until} seconds...',file=stderr)
-    s._start_loops()
+    if not s.quiet: print(f'Sim: starting run for simulation time {until} seconds...',file=stderr)
+    profile_filename=s.params.get('profile')
+    if profile_filename and s._profiler is None:
+      from .profiling import Loop_timer,Stack_sampler
+      if s.params.get('profile_mode','timer')=='sampling':
+        s._profiler=Stack_sampler(s,interval=s.params.get('profile_interval',0.001))
+      else: # must be created before the loops are started
+        s._profiler=Loop_timer(s)
+      if not s.quiet: print(f'profiling enabled: output file will be {profile_filename}.',file=stderr)
+    trace_filename=s.params.get('trace')
+    if trace_filename and s._tracer is None:
+      from .profiling import Chrome_tracer
+      s._tracer=Chrome_tracer(s,kinds=s.params.get('trace_kinds'),sample_every=s.params.get('trace_sample_every',1))
+    if not s._loops_started: s._start_loops() # not when continuing a run, or after restore
     t0=time()
-    if 'profile' in s.params and s.params['profile']:
-      # https://docs.python.org/3.6/library/profile.html
-      # to keep python 3.6 compatibility, we don't use all the
-      # features for profiling added in 3.8 or 3.9.
-      profile_filename=s.params['profile']
-      print(f'profiling enabled: output file will be {profile_filename}.',file=stderr)
-      import cProfile,pstats,io
-      pr=cProfile.Profile()
-      pr.enable()
-      s.env.run(until=until) # this is what is profiled
-      pr.disable()
-      strm=io.StringIO()
-      ps=pstats.Stats(pr,stream=strm).sort_stats('tottime')
-      ps.print_stats()
-      tbl=strm.getvalue().split('\n')
-      profile_file=open(profile_filename,'w')
-      for line in tbl[:50]: print(line,file=profile_file)
-      profile_file.close()
-      print(f'profile written to {profile_filename}.',file=stderr)
-    else:
-      s.env.run(until=until)
-    print(f'Sim: finished main loop in {(time()-t0):.2f} seconds.',file=stderr)
+    s._run_t0,s._run_now0=perf_counter(),s.env.now
+    if s._profiler is not None: s._profiler.start()
+    s.env.run(until=until)
+    if s._profiler is not None: s._profiler.stop()
+    s._wall_time+=perf_counter()-s._run_t0
+    s._run_sim_time+=s.env.now-s._run_now0
+    s._run_t0=None
+    if not s.quiet: print(f'Sim: finished main loop in {(time()-t0):.2f} seconds.',file=stderr)
     #print(f'Sim: hetnet={s.hetnet}.',file=stderr)
     if s.mme is not None:
       s.mme.finalize()
@@ -775,6 +1112,185 @@ class Sim:
       s.ric.finalize()
     for logger in s.loggers:
       logger.finalize()
+    if s._profiler is not None:
+      from .profiling import write_profile
+      if not s.quiet: print(s._profiler.table(),file=stderr)
+      write_profile(s._profiler,profile_filename)
+      if not s.quiet: print(f'profile written to {profile_filename}.',file=stderr)
+    if s._tracer is not None:
+      s._tracer.write(trace_filename)
+      if not s.quiet: print(f'trace written to {trace_filename}.',file=stderr)
+
+  def checkpoint(s,fn):
+    '''
+    Save the state of the simulation to the file ``fn`` (gzipped pickle),
+    so that it can be continued later by ``restore``.  This may be called
+    between runs (``sim.run`` may be called repeatedly with increasing
+    ``until``), or from within a loop.  The state saved is the simulation
+    time; the state of the Sim random number generator, and of the global
+    numpy and ``random`` generators; the powers, MIMO gains, subband masks,
+    attachments, reports and RSRP histories of all cells; the positions,
+    serving cells, serving cell histories and latest reports of all UEs;
+    ``sim.kpis``; and the time at which each main loop is next due to
+    wake.  Logger, Scenario, RIC, MME and Metrics_store objects may define a method
+    ``checkpoint()`` returning any further picklable state of their own,
+    which is passed to their method ``restore(state)``.  Generators in
+    ``sim.events`` cannot be saved, and are not restored.
+    '''
+    now=s.env.now
+    wake={} # (time,priority,order) at which each scheduled event will fire
+    for event_t,priority,eid,event in _simpy_queue(s.env): wake[id(event)]=(event_t,priority,eid)
+    phases={}
+    for key,process in getattr(s,'_processes',{}).items():
+      if not process.is_alive: continue
+      target=process.target
+      if isinstance(target,simpy.Timeout) and id(target) in wake:
+        event_t,priority,eid=wake[id(target)]
+        phases[key]=(event_t-now,priority,eid)
+      else: # waiting on anything but a timeout: restart immediately
+        phases[key]=(0.0,0,-1)
+    state={
+      'version': __version__,
+      'now': now,
+      'rng': s.rng.bit_generator.state,
+      'np_random': np.random.get_state(),
+      'random': random.getstate(),
+      'hetnet': s.hetnet,
+      'kpis': s.kpis,
+      'loops_started': s._loops_started,
+      'phases': phases,
+      'UE_locations': np.array(s.UE_locations),
+      'cells': [{'xyz': cell.xyz,
+                 'power_dBm': cell.power_dBm,
+                 'MIMO_gain_dB': cell.MIMO_gain_dB,
+                 'subband_mask': cell.subband_mask,
+                 'attached': cell.attached,
+                 'reports': cell.reports,
+                 'rsrp_history': cell.rsrp_history} for cell in s.cells],
+      'UEs': [{'serving_cell': ue.get_serving_cell_i(),
+               'serving_cell_ids': ue.serving_cell_ids,
+               'reporting_interval': ue.reporting_interval,
+               'cqi': ue.cqi,
+               'sinr_dB': ue.sinr_dB,
+               'report_stale': ue._report_stale} for ue in s.UEs],
+      'user': {key: owner.checkpoint() for key,owner in s._loop_owners() if key[0] in ('logger','scenario','ric','mme','metrics') and hasattr(owner,'checkpoint')},
+    }
+    with gzip.open(fn,'wb') as f:
+      pickle.dump(state,f,protocol=pickle.HIGHEST_PROTOCOL)
+    if not s.quiet: print(f'Sim: checkpoint at t={now:.2f} written to {fn}.',file=stderr)
+
+  def restore(s,fn):
+    '''
+    Restore a state saved by ``checkpoint`` into this Sim, which must have
+    been built in the same way as the one saved (the same cells, UEs,
+    loggers, scenario, RIC and MME, added in the same order), but not yet
+    run.  A following ``sim.run(until)`` continues from the saved time.
+    Each main loop is restarted from its beginning when it was next due to
+    wake, so loops which keep state in local variables should save it
+    through ``checkpoint()`` and ``restore(state)`` methods, and loops with
+    an initial delay should skip it if ``sim.env.now`` is already past it
+    (as ``MME.loop`` does).
+    '''
+    if s._loops_started or s.env.now>0.0:
+      raise RuntimeError('Sim.restore: the Sim must not have been run')
+    with gzip.open(fn,'rb') as f:
+      state=pickle.load(f)
+    if len(state['cells'])!=len(s.cells) or len(state['UEs'])!=len(s.UEs):
+      raise ValueError(f'Sim.restore: checkpoint {fn} has {len(state["cells"])} cells and {len(state["UEs"])} UEs, but this Sim has {len(s.cells)} and {len(s.UEs)}')
+    if state['version']!=__version__:
+      print(f'Sim.restore: warning: checkpoint {fn} was written by version {state["version"]}.',file=stderr)
+    _simpy_set_now(s.env,state['now'])
+    s.rng.bit_generator.state=state['rng']
+    np.random.set_state(state['np_random'])
+    random.setstate(state['random'])
+    s.kpis=state['kpis']
+    for cell,c in zip(s.cells,state['cells']):
+      cell.xyz=c['xyz']
+      cell.power_dBm=c['power_dBm']
+      cell.MIMO_gain_dB=c['MIMO_gain_dB']
+      cell.subband_mask=c['subband_mask']
+      cell.attached=c['attached']
+      cell.reports=c['reports']
+      cell.rsrp_history=c['rsrp_history']
+    s.cell_locations=np.array([cell.xyz for cell in s.cells]).reshape(-1,3)
+    s.UE_locations[:]=state['UE_locations']
+    for ue,u in zip(s.UEs,state['UEs']):
+      ue.serving_cell=None if u['serving_cell'] is None else s.cells[u['serving_cell']]
+      ue.serving_cell_ids=u['serving_cell_ids']
+      ue.reporting_interval=u['reporting_interval']
+      ue.cqi,ue.sinr_dB,ue._report_stale=u['cqi'],u['sinr_dB'],u['report_stale']
+    for key,owner in s._loop_owners():
+      if key in state['user']: owner.restore(state['user'][key])
+    s._set_hetnet()
+    if state['loops_started']: s._start_loops(phases=state['phases'])
+    if not s.quiet: print(f'Sim: restored checkpoint {fn} at t={s.env.now:.2f}.',file=stderr)
+
+  def fork(s,n,branch_fn=None,horizon=10.0,kpi_fn=None,workers=None):
+    '''
+    Simulate ``n`` branches of the future of this simulation, each in a
+    child process created by ``os.fork`` (so Linux or macOS only), and
+    return the list of their KPIs.  A child starts with a copy-on-write copy
+    of the whole state of the parent, so this is much cheaper than
+    rebuilding and warming up a Sim for each branch.  It may be called
+    between runs, or from within a main loop, typically by a RIC trying
+    candidate actions before choosing one; the simulation in the parent is
+    unaffected.  In each child, ``branch_fn(sim,k)`` (k=0,...,n-1) is
+    called, the simulation is run for a further time ``horizon``, the MME,
+    RIC and loggers are finalized, and the KPIs ``kpi_fn(sim)`` (default
+    ``sim.kpis``) are sent back over a pipe; they must be picklable.
+    Output of the children to stdout and stderr is discarded, and so is
+    the output of loggers, which is redirected by their method
+    ``_fork_child()`` (called in each child before ``branch_fn``); the
+    default replaces ``logger.f`` by ``os.devnull``, and loggers which
+    write elsewhere override it.
+    The loop calling ``fork`` (if any) does not run in the children.  All
+    children start with the same random number generator states, so
+    branches are compared under common random numbers unless branch_fn
+    reseeds ``sim.rng``.  At most ``workers`` (default the number of CPUs)
+    children run at once.
+    '''
+    if not hasattr(os,'fork'):
+      raise RuntimeError('Sim.fork: os.fork is not available on this platform')
+    workers=os.cpu_count() if workers is None else workers
+    files=[logger.f for logger in s.loggers if hasattr(logger.f,'flush')]
+    for f in files+[stdout,stderr]: f.flush() # else buffered output is duplicated
+    results,running=[None]*n,{}
+    def collect(pid):
+      k,fd=running.pop(pid)
+      with os.fdopen(fd,'rb') as f:
+        ok,value=pickle.load(f)
+      os.waitpid(pid,0)
+      if not ok: raise RuntimeError(f'Sim.fork: branch {k} failed:\n{value}')
+      results[k]=value
+    for k in range(n):
+      if len(running)>=workers: collect(next(iter(running)))
+      r,w=os.pipe()
+      pid=os.fork()
+      if pid==0: # child: must never return from here
+        try:
+          os.close(r)
+          devnull=os.open(os.devnull,os.O_WRONLY)
+          os.dup2(devnull,1); os.dup2(devnull,2)
+          for logger in s.loggers: logger._fork_child()
+          try:
+            if branch_fn is not None: branch_fn(s,k)
+            if not s._loops_started: s._start_loops()
+            _simpy_cancel_until(s.env) # the parent's, if fork was called in a run
+            s.env.run(until=s.env.now+horizon)
+            if s.mme is not None: s.mme.finalize()
+            if s.ric is not None: s.ric.finalize()
+            for logger in s.loggers: logger.finalize()
+            reply=pickle.dumps((True,s.kpis if kpi_fn is None else kpi_fn(s)),protocol=pickle.HIGHEST_PROTOCOL)
+          except BaseException:
+            import traceback
+            reply=pickle.dumps((False,traceback.format_exc()))
+          with os.fdopen(w,'wb') as f: f.write(reply)
+        finally:
+          os._exit(0)
+      os.close(w)
+      running[pid]=(k,r)
+    while running: collect(next(iter(running)))
+    return results
 
 # END class Sim
 
@@ -841,6 +1357,7 @@ class Logger:
 
   def default_logger(s,f=stdout):
     for cell in s.sim.cells:
+      cell.refresh_reports()
       for ue_i in cell.reports['cqi']:
         rep=cell.reports['cqi'][ue_i]
         if rep is None: continue
@@ -859,8 +1376,15 @@ class Logger:
   def finalize(s):
     '''
     Function called at end of simulation, to implement any required finalization actions.
+    The default flushes the output file (waiting for an ``Async_writer`` to finish).
     '''
-    pass
+    if hasattr(s.f,'flush'): s.f.flush()
+
+  def _fork_child(s):
+    # internal use only - called by Sim.fork in each child process, so
+    # that the child's output does not go to the parent's file.  Loggers
+    # which write through anything other than s.f must override this.
+    s.f=open(os.devnull,'w')
 
 # END class Logger
 
@@ -888,7 +1412,7 @@ class MME:
     s.strategy=strategy
     s.anti_pingpong=anti_pingpong
     s.verbosity=verbosity
-    print(f'MME: using handover strategy {s.strategy}.',file=stderr)
+    if not sim.quiet: print(f'MME: using handover strategy {s.strategy}.',file=stderr)
 
   def do_handovers(s):
     '''
@@ -898,7 +1422,7 @@ class MME:
     for ue in s.sim.UEs:
       if ue.serving_cell is None: continue # no handover needed for this UE. 2022-08-08 added None test
       oldcelli=ue.serving_cell.i # 2022-08-26
-      CQI_before=ue.serving_cell.get_UE_CQI(ue.i)
+      if s.verbosity>1: CQI_before=ue.serving_cell.get_UE_CQI(ue.i)
       previous,tm=ue.serving_cell_ids[1]
       if s.strategy=='strongest_cell_simple_pathloss_model':
         celli=s.sim.get_strongest_cell_simple_pathloss_model(ue.xyz)
@@ -914,11 +1438,16 @@ class MME:
         if s.sim.env.now-tm<s.anti_pingpong:
           if s.verbosity>2:
             print(f't={float(s.sim.env.now):8.2f} handover of UE[{ue.i}] suppressed by anti_pingpong heuristic.',file=stderr)
+          s.sim.counters['pingpongs_suppressed']+=1
           continue # not enough time since we were last on this cell
+      s.sim.counters['handovers']+=1
       ue.detach(quiet=True)
       ue.attach(s.sim.cells[celli])
       ue.send_rsrp_reports() # make sure we have reports immediately
-      ue.send_subband_cqi_report()
+      if s.sim.lazy_reports:
+        ue._report_stale=True
+      else:
+        ue.send_subband_cqi_report()
       if s.verbosity>1:
         CQI_after=ue.serving_cell.get_UE_CQI(ue.i)
         print(f't={float(s.sim.env.now):8.2f} handover of UE[{ue.i:3}] from Cell[{oldcelli:3}] to Cell[{ue.serving_cell.i:3}]',file=stderr,end=' ')
@@ -928,8 +1457,9 @@ class MME:
     '''
     Main loop of MME.
     '''
-    yield s.sim.env.timeout(0.5*s.interval) # stagger the intervals
-    print(f'MME started at {float(s.sim.env.now):.2f}, using strategy="{s.strategy}" and anti_pingpong={s.anti_pingpong:.0f}.',file=stderr)
+    if s.sim.env.now<0.5*s.interval: # stagger the intervals (not again after restore)
+      yield s.sim.env.timeout(0.5*s.interval-s.sim.env.now)
+    if not s.sim.quiet: print(f'MME started at {float(s.sim.env.now):.2f}, using strategy="{s.strategy}" and anti_pingpong={s.anti_pingpong:.0f}.',file=stderr)
     while True:
       s.do_handovers()
       yield s.sim.env.timeout(s.interval)
@@ -971,7 +1501,7 @@ class RIC:
     '''
     Main loop of RIC class.  Must be overridden to provide functionality.
     '''
-    print(f'RIC started at {float(s.sim.env.now):.2}.',file=stderr)
+    if not s.sim.quiet: print(f'RIC started at {float(s.sim.env.now):.2}.',file=stderr)
     while True:
       yield s.sim.env.timeout(s.interval)
 # END class RIC
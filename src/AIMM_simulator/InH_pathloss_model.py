@@ -3,6 +3,7 @@
 
 from sys import exit,stderr
 from math import log10
+import numpy as np
 from numpy.linalg import norm
 
 class InH_pathloss:
@@ -52,6 +53,18 @@ class InH_pathloss:
     # else NLOS:
     return s.const_NLOS+43.3*log10(d3D_m)
 
+  def vectorized(s,xyz_cell,xyz_UE):
+    '''
+    Vectorized version of ``__call__``.  The arrays xyz_cell and xyz_UE have
+    last axis of length 3, and other axes which broadcast against each
+    other; for example shapes (ncells,3) and (nues,1,3) give a result of
+    shape (nues,ncells).
+    '''
+    log10_d3D_m=np.log10(norm(np.asarray(xyz_cell)-np.asarray(xyz_UE),axis=-1))
+    if s.LOS:
+      return s.const_LOS+16.9*log10_d3D_m
+    return s.const_NLOS+43.3*log10_d3D_m
+
 def plot():
   ' Plot the pathloss model predictions, as a self-test. '
   import numpy as np
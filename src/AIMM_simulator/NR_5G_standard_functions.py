@@ -168,7 +168,19 @@ def _DMRS_RE(typ,mapping,length,addPos):
 
 # plot functions - only for testing...
 
+def _pyplot():
+  # internal use only - import matplotlib when first plotting, so that it
+  # is only needed by those who plot
+  global plt,fig_timestamp
+  try:
+    import matplotlib.pyplot as plt
+  except ImportError as e:
+    raise ImportError('matplotlib not found: please do "pip install matplotlib"') from e
+  if 'fig_timestamp' not in globals():
+    from .fig_timestamp import fig_timestamp
+
 def plot_SINR_to_CQI(fn='img/plot_SINR_to_CQI'):
+  _pyplot()
   n,bot,top=1000,-10.0,35.0
   x=np.linspace(bot,top,n)
   y=[SINR_to_CQI(x[i]) for i in range(n)]
@@ -194,6 +206,7 @@ def plot_SINR_to_CQI(fn='img/plot_SINR_to_CQI'):
   print('evince %s.pdf &'%fn)
 
 def plot_CQI_to_efficiency_QPSK(fn='img/plot_CQI_to_efficiency_QPSK'):
+  _pyplot()
   bot,top=0,15
   x=range(bot,1+top)
   y=[CQI_to_efficiency_QPSK(xi) for xi in x]
@@ -225,7 +238,14 @@ def CQI_to_64QAM_efficiency(cqi):
   CQI_to_MCS=max(0,min(28,int(28*cqi/15.0)))
   return MCS_to_Qm_table_64QAM[CQI_to_MCS][2]
 
+_CQI_to_64QAM_efficiency_table=np.array([CQI_to_64QAM_efficiency(cqi) for cqi in range(16)])
+
+def CQI_to_64QAM_efficiency_array(cqi):
+  ' Vectorized version of CQI_to_64QAM_efficiency, for an integer array of CQIs. '
+  return _CQI_to_64QAM_efficiency_table[np.clip(cqi,0,15)]
+
 def plot_CQI_to_efficiency(fn='img/plot_CQI_to_efficiency'):
+  _pyplot()
   # TODO 256QAM
   bot,top=0,15
   cqi=range(bot,1+top)
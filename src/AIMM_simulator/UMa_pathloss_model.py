@@ -5,6 +5,7 @@
 # Self-test (makes a plot): python3 UMa_pathloss_model_01.py
 
 from math import log10,hypot
+import numpy as np
 from numpy.linalg import norm
 
 class UMa_pathloss:
@@ -77,6 +78,23 @@ class UMa_pathloss:
     PL3D_UMa_NLOS=161.04-7.1*log10(s.W)+7.5*log10(s.h)-(24.37-3.7*(s.h/s.h_BS)**2)*log10(s.h_BS)+(43.42-3.1*log10(s.h_BS))*(log10(d3D_m)-3.0)+20*log10(s.fc)-(c1)-0.6*(s.h_UT-1.5) # TODO pre-compute more constants to speed this up!
     return max(PL3D_UMa_NLOS,PL3D_UMa_LOS)
 
+  def vectorized(s,xyz_cell,xyz_UE):
+    '''
+    Vectorized version of ``__call__``.  The arrays xyz_cell and xyz_UE have
+    last axis of length 3, and other axes which broadcast against each
+    other; for example shapes (ncells,3) and (nues,1,3) give a result of
+    shape (nues,ncells).
+    '''
+    d3D_m=norm(np.asarray(xyz_cell)-np.asarray(xyz_UE),axis=-1)
+    log10_d3D_m=np.log10(d3D_m)
+    PL3D_UMa_LOS=np.where(d3D_m<s.dBP,s.const_close+22.0*log10_d3D_m,s.const_far+40.0*log10_d3D_m)
+    if s.LOS:
+      return PL3D_UMa_LOS
+    c1=-9.1904695449517596702522e-4 # as in __call__
+    const_NLOS=161.04-7.1*log10(s.W)+7.5*log10(s.h)-(24.37-3.7*(s.h/s.h_BS)**2)*log10(s.h_BS)+20*log10(s.fc)-(c1)-0.6*(s.h_UT-1.5)
+    PL3D_UMa_NLOS=const_NLOS+(43.42-3.1*log10(s.h_BS))*(log10_d3D_m-3.0)
+    return np.maximum(PL3D_UMa_NLOS,PL3D_UMa_LOS)
+
 def plot():
   ' Plot the pathloss model predictions, as a self-test. '
   import numpy as np
@@ -1,6 +1,7 @@
 # Henry Brice 2022-04-25
 
 from math import log10,hypot
+import numpy as np
 from numpy.linalg import norm
 
 class UMi_streetcanyon_pathloss:
@@ -66,6 +67,21 @@ class UMi_streetcanyon_pathloss:
     PL3D_UMi_NLOS=36.7*log10(d3D_m)+22.7+26*log10(s.fc)-0.3*(s.h_UT-1.5)
     return max(PL3D_UMi_NLOS,PL3D_UMi_LOS)
 
+  def vectorized(s,xyz_cell,xyz_UE):
+    '''
+    Vectorized version of ``__call__``.  The arrays xyz_cell and xyz_UE have
+    last axis of length 3, and other axes which broadcast against each
+    other; for example shapes (ncells,3) and (nues,1,3) give a result of
+    shape (nues,ncells).
+    '''
+    d3D_m=norm(np.asarray(xyz_cell)-np.asarray(xyz_UE),axis=-1)
+    log10_d3D_m=np.log10(d3D_m)
+    PL3D_UMi_LOS=np.where(d3D_m<s.dBP,s.const_close+22.0*log10_d3D_m,s.const_far+40.0*log10_d3D_m)
+    if s.LOS:
+      return PL3D_UMi_LOS
+    PL3D_UMi_NLOS=36.7*log10_d3D_m+22.7+26*log10(s.fc)-0.3*(s.h_UT-1.5)
+    return np.maximum(PL3D_UMi_NLOS,PL3D_UMi_LOS)
+
 def plot():
   ' Plot the pathloss model predictions, as a self-test. '
   import numpy as np
@@ -4,3 +4,34 @@ from .NR_5G_standard_functions import *
 from .InH_pathloss_model import InH_pathloss
 from .UMa_pathloss_model import UMa_pathloss
 from .UMi_pathloss_model import UMi_streetcanyon_pathloss
+
+# The extensions below are imported when first used, to keep
+# "import AIMM_simulator" fast (see benchmarks/AIMM_simulator_benchmarks.py)...
+_lazy={
+  'sweep': ('sweep','expand_grid','load_sweep','Sweep_result'),
+  'trace_scenario': ('Trace_Scenario','open_trace','write_trace'),
+  'replications': ('run_replications','replication_summary','Replication_result'),
+  'lockstep': ('Lockstep_Sim',),
+  'partitioned': ('Partitioned_Sim',),
+  'loggers': ('Columnar_Logger','read_columnar','columnar_to_tsv','Async_writer','Frame_writer','Binary_Logger'),
+  'metrics': ('Metrics_store','Ring_buffer'),
+  'aggregators': ('Welford','Histogram','P2_quantile','Summary_Logger'),
+  'profiling': ('Loop_timer','Stack_sampler','Chrome_tracer','write_profile'),
+  'memory': ('Memory_Logger',),
+  'shared_state': ('Shared_state_publisher','Shared_state_reader'),
+}
+_lazy_names={name: module for module,names in _lazy.items() for name in names}
+__all__=[name for name in globals() if not name.startswith('_')]+list(_lazy_names)
+
+def __getattr__(name):
+  if name not in _lazy_names:
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+  from importlib import import_module
+  module=import_module(f'.{_lazy_names[name]}',__name__)
+  # bind all the names of the module, since importing the submodule sweep
+  # binds the name sweep to the submodule, not the function...
+  for n in _lazy[_lazy_names[name]]: globals()[n]=getattr(module,n)
+  return globals()[name]
+
+def __dir__():
+  return sorted(set(globals())|set(_lazy_names))
@@ -0,0 +1,296 @@
+# Streaming aggregators: statistics of a stream of observations kept in
+# constant memory, each updated with one observation per entity (UE or
+# cell) at a time, vectorized over the entities.  NaN observations are
+# ignored.  ``grow`` adds entities, with no observations, for UEs and
+# cells added during a run.  Summary_Logger uses them to summarize UE and cell KPIs over a
+# whole run without logging every sample.
+
+import numpy as np
+from .AIMM_simulator import Logger
+from .NR_5G_standard_functions import SINR_to_CQI
+from .metrics import sample_UEs
+
+class Welford:
+  '''
+  Running count, mean and variance of each entity (Welford's algorithm).
+  '''
+
+  def __init__(s,shape=()):
+    s.count=np.zeros(shape,dtype=int)
+    s.mu=np.zeros(shape)
+    s.m2=np.zeros(shape)
+
+  def update(s,x):
+    ok=~np.isnan(x)
+    s.count=s.count+ok
+    delta=np.where(ok,x-s.mu,0.0)
+    s.mu=s.mu+delta/np.maximum(s.count,1)
+    s.m2=s.m2+np.where(ok,delta*(x-s.mu),0.0)
+
+  def grow(s,n):
+    ''' Extend the first axis to n entities, the new ones with no observations. '''
+    m=n-s.count.shape[0]
+    if m<=0: return
+    pad=((0,m),)+((0,0),)*(s.count.ndim-1)
+    s.count=np.pad(s.count,pad)
+    s.mu=np.pad(s.mu,pad)
+    s.m2=np.pad(s.m2,pad)
+
+  def mean(s):
+    return np.where(s.count>0,s.mu,np.nan)
+
+  def var(s):
+    ''' Sample variance (NaN for fewer than two observations). '''
+    return np.where(s.count>1,s.m2/np.maximum(s.count-1,1),np.nan)
+
+  def std(s):
+    return np.sqrt(s.var())
+
+  def pooled(s):
+    '''
+    Return (count,mean,std) over the observations of all entities together.
+    '''
+    n=np.sum(s.count)
+    if n==0: return 0,np.nan,np.nan
+    mean=np.sum(s.count*s.mu)/n
+    m2=np.sum(s.m2)+np.sum(s.count*(s.mu-mean)**2)
+    return int(n),float(mean),float(np.sqrt(m2/(n-1))) if n>1 else np.nan
+
+# END class Welford
+
+class Histogram:
+  '''
+  Counts of the observations of each entity in fixed bins with edges
+  ``edges``, plus an underflow count (first) and an overflow count (last).
+  '''
+
+  def __init__(s,edges,shape=()):
+    s.edges=np.asarray(edges,dtype=float)
+    s.shape=tuple(shape)
+    s.counts=np.zeros(s.shape+(len(s.edges)+1,),dtype=int)
+
+  def update(s,x):
+    x=np.broadcast_to(x,s.shape)
+    ok=~np.isnan(x)
+    k=np.searchsorted(s.edges,x,side='right') # 0=underflow, len(edges)=overflow
+    n=len(s.edges)+1
+    flat=(np.arange(x.size).reshape(s.shape)*n+k)[ok]
+    s.counts+=np.bincount(flat,minlength=x.size*n).reshape(s.counts.shape)
+
+  def grow(s,n):
+    ''' Extend the first axis to n entities, the new ones with no observations. '''
+    m=n-s.shape[0]
+    if m<=0: return
+    s.shape=(n,)+s.shape[1:]
+    s.counts=np.pad(s.counts,((0,m),)+((0,0),)*(s.counts.ndim-1))
+
+  def pooled(s):
+    ''' Return the counts over all entities together. '''
+    return s.counts.reshape(-1,s.counts.shape[-1]).sum(axis=0)
+
+  def quantile(s,p,counts=None):
+    '''
+    Return the p-quantile estimated from the pooled counts (or ``counts``), by linear interpolation within bins.
+    '''
+    c=s.pooled() if counts is None else counts
+    cum=np.cumsum(c)
+    if cum[-1]==0: return np.nan
+    target=p*cum[-1]
+    k=int(np.searchsorted(cum,target))
+    if k==0: return float(s.edges[0])
+    if k>=len(s.edges): return float(s.edges[-1])
+    lo,hi=s.edges[k-1],s.edges[k]
+    below=cum[k-1]
+    return float(lo+(hi-lo)*(target-below)/max(c[k],1))
+
+# END class Histogram
+
+class P2_quantile:
+  '''
+  Running estimate of the p-quantile of each entity's observations, by
+  the P² algorithm (R. Jain and I. Chlamtac, Comm. ACM 28, 1985), which
+  keeps five markers per entity.  Exact for fewer than five observations.
+  '''
+
+  def __init__(s,p,shape=()):
+    s.p=p
+    s.shape=tuple(shape)
+    s.count=np.zeros(shape,dtype=int)
+    s.q=np.full(s.shape+(5,),np.nan) # marker heights; first observations until count>=5
+    s.npos=np.tile(np.arange(1.0,6.0),s.shape+(1,)) # marker positions
+    s.nd0=np.array([1.0,1.0+2*p,1.0+4*p,3.0+2*p,5.0])
+    s.nd=np.tile(s.nd0,s.shape+(1,)) # desired positions
+    s.dn=np.array([0.0,p/2,p,(1+p)/2,1.0])
+
+  def update(s,x):
+    x=np.broadcast_to(np.asarray(x,dtype=float),s.shape)
+    ok=~np.isnan(x)
+    # the first five observations of each entity are stored, then sorted...
+    start=ok&(s.count<5)
+    if np.any(start):
+      idx=np.nonzero(start)
+      s.q[idx+(s.count[start],)]=x[start]
+      full=start&(s.count==4)
+      s.q[full]=np.sort(s.q[full],axis=-1)
+    run=ok&(s.count>=5)
+    s.count=s.count+ok
+    if not np.any(run): return
+    q,npos,nd,xr=s.q[run],s.npos[run],s.nd[run],x[run]
+    # find the cell k with q[k]<=x<q[k+1], extending the extreme markers...
+    q[:,0]=np.minimum(q[:,0],xr)
+    q[:,4]=np.maximum(q[:,4],xr)
+    k=np.clip(np.sum(q[:,1:4]<=xr[:,None],axis=1),0,3)
+    npos+=np.arange(5)>k[:,None]
+    nd+=s.dn
+    for i in (1,2,3): # adjust the middle markers
+      d=nd[:,i]-npos[:,i]
+      move=((d>=1)&(npos[:,i+1]-npos[:,i]>1))|((d<=-1)&(npos[:,i-1]-npos[:,i]<-1))
+      if not np.any(move): continue
+      d=np.where(move,np.sign(d),0.0)
+      j=(i+np.where(move,d,1.0)).astype(int)
+      rows=np.arange(len(q))
+      with np.errstate(divide='ignore',invalid='ignore'): # in rows which do not move
+        qp=q[:,i]+d/(npos[:,i+1]-npos[:,i-1])*((npos[:,i]-npos[:,i-1]+d)*(q[:,i+1]-q[:,i])/(npos[:,i+1]-npos[:,i])
+                                               +(npos[:,i+1]-npos[:,i]-d)*(q[:,i]-q[:,i-1])/(npos[:,i]-npos[:,i-1]))
+        linear=q[:,i]+d*(q[rows,j]-q[:,i])/(npos[rows,j]-npos[:,i])
+      parabolic_ok=(q[:,i-1]<qp)&(qp<q[:,i+1])
+      q[:,i]=np.where(move,np.where(parabolic_ok,qp,linear),q[:,i])
+      npos[:,i]+=np.where(move,d,0.0)
+    s.q[run],s.npos[run],s.nd[run]=q,npos,nd
+
+  def grow(s,n):
+    ''' Extend the first axis to n entities, the new ones with no observations. '''
+    m=n-s.shape[0]
+    if m<=0: return
+    new=(m,)+s.shape[1:]
+    s.shape=(n,)+s.shape[1:]
+    s.count=np.concatenate([s.count,np.zeros(new,dtype=int)])
+    s.q=np.concatenate([s.q,np.full(new+(5,),np.nan)])
+    s.npos=np.concatenate([s.npos,np.tile(np.arange(1.0,6.0),new+(1,))])
+    s.nd=np.concatenate([s.nd,np.tile(s.nd0,new+(1,))])
+
+  def value(s):
+    ''' Return the current estimate for each entity (NaN if no observations). '''
+    est=s.q[...,2].copy()
+    few=s.count<5
+    if np.any(few):
+      est[few]=[np.quantile(q[:n],s.p) if n>0 else np.nan for q,n in zip(s.q[few],s.count[few])]
+    return est
+
+# END class P2_quantile
+
+class Summary_Logger(Logger):
+  '''
+  A Logger which, instead of writing samples, keeps streaming summaries of
+  UE and cell KPIs over the whole run, and exports them to ``sim.kpis`` at
+  ``finalize``.  Every ``logging_interval`` it samples each UE's
+  throughput (Mb/s), SINR (dB, mean over subbands) and CQI of that SINR,
+  and each cell's total throughput and number of attached UEs.  For each
+  KPI and each UE or cell it keeps the count, mean and standard deviation
+  (``Welford``), running quantiles (``P2_quantile``) and a histogram
+  (``Histogram``).  UEs and cells added during the run are summarized from
+  their first sample on.
+
+  At finalize, ``sim.kpis`` gets, for each KPI, scalars pooled over all
+  UEs or cells, for example ``UE_throughput_Mbps_mean``,
+  ``UE_throughput_Mbps_std`` and ``UE_throughput_Mbps_p50`` (quantiles
+  from the pooled histogram), which ``replication_summary`` and ``sweep``
+  handle directly; and ``sim.kpis['summary']``, a dictionary mapping each
+  KPI to per-entity lists ``count``, ``mean``, ``std``, ``p<percent>``,
+  the histogram ``edges`` and ``counts`` (with underflow and overflow
+  bins first and last), and the pooled ``cdf`` at the edges.
+
+  Parameters
+  ----------
+  sim : Sim
+    The Sim instance which will manage this Logger.
+  logging_interval : float
+    Time interval between samples.
+  quantiles : tuple of float
+    Quantiles to estimate.
+  edges : dict
+    Histogram bin edges for each KPI, overriding the defaults.
+  '''
+
+  default_edges={'UE_throughput_Mbps': np.linspace(0.0,100.0,201),
+                 'UE_sinr_dB': np.linspace(-20.0,40.0,121),
+                 'UE_cqi': np.arange(0.5,15.0,1.0),
+                 'cell_throughput_Mbps': np.linspace(0.0,200.0,201),
+                 'cell_n_attached': np.arange(0.5,100.0,1.0)}
+
+  def __init__(s,sim,logging_interval=1.0,quantiles=(0.05,0.5,0.95),edges={}):
+    s.sim=sim
+    s.f=None
+    s.func=None
+    s.logging_interval=float(logging_interval)
+    s.quantiles=tuple(quantiles)
+    s.edges=dict(Summary_Logger.default_edges,**edges)
+    s.aggregators=None # made when the numbers of UEs and cells are known
+
+  def _make(s):
+    # internal use only
+    s.aggregators={}
+    for name in s.edges:
+      shape=(len(s.sim.UEs),) if name.startswith('UE_') else (len(s.sim.cells),)
+      s.aggregators[name]=(Welford(shape),[P2_quantile(p,shape) for p in s.quantiles],Histogram(s.edges[name],shape))
+
+  def sample(s):
+    '''
+    Update all aggregators with the current KPIs; called every logging_interval by ``loop``.
+    '''
+    if s.aggregators is None: s._make()
+    tp,sinr,rsrp,serving=sample_UEs(s.sim)
+    attached=~np.isnan(serving)
+    srv=serving[attached].astype(int)
+    ncells=len(s.sim.cells)
+    cell_tp=np.bincount(srv,weights=np.nan_to_num(tp[attached]),minlength=ncells)
+    values={'UE_throughput_Mbps': tp,
+            'UE_sinr_dB': sinr,
+            'UE_cqi': np.where(np.isnan(sinr),np.nan,np.maximum(SINR_to_CQI(np.nan_to_num(sinr)),0)),
+            'cell_throughput_Mbps': np.where(np.bincount(srv,minlength=ncells)>0,cell_tp,0.0),
+            'cell_n_attached': np.bincount(srv,minlength=ncells).astype(float)}
+    for name,(welford,p2s,histogram) in s.aggregators.items():
+      x=values[name]
+      for aggregator in (welford,histogram,*p2s): aggregator.grow(len(x))
+      welford.update(x)
+      for p2 in p2s: p2.update(x)
+      histogram.update(x)
+
+  def loop(s):
+    '''
+    Main loop of Summary_Logger.
+    '''
+    while True:
+      s.sample()
+      yield s.sim.env.timeout(s.logging_interval)
+
+  def summary(s):
+    '''
+    Return the (kpis,summary) pair described above, for the data so far.
+    '''
+    kpis,summary={},{}
+    if s.aggregators is None: return kpis,summary
+    for name,(welford,p2s,histogram) in s.aggregators.items():
+      n,mean,std=welford.pooled()
+      kpis[f'{name}_mean']=mean
+      kpis[f'{name}_std']=std
+      counts=histogram.pooled()
+      for p in s.quantiles:
+        kpis[f'{name}_p{100*p:g}']=histogram.quantile(p,counts)
+      entry={'count': welford.count.tolist(),
+             'mean': welford.mean().tolist(),
+             'std': welford.std().tolist(),
+             'edges': histogram.edges.tolist(),
+             'counts': histogram.counts.tolist(),
+             'cdf': (np.cumsum(counts)[:-1]/max(1,counts.sum())).tolist()}
+      for p,p2 in zip(s.quantiles,p2s):
+        entry[f'p{100*p:g}']=p2.value().tolist()
+      summary[name]=entry
+    return kpis,summary
+
+  def finalize(s):
+    kpis,summary=s.summary()
+    s.sim.kpis.update(kpis)
+    s.sim.kpis['summary']=summary
+
+# END class Summary_Logger
@@ -3,13 +3,24 @@
 
 from sys import stderr,exit
 import numpy as np
-try: # if matplotlib is not installed, turn off plotting...
-  from matplotlib import rcParams as matplotlib_rcParams
-  import matplotlib.pyplot as plt
-  from mpl_toolkits.mplot3d.art3d import Poly3DCollection
-  from fig_timestamp import fig_timestamp
-except:
-  plt=None
+plt=None # matplotlib is only imported when first plotting, by _pyplot
+
+def _pyplot():
+  # internal use only - import matplotlib, and return pyplot, or None if
+  # matplotlib is not installed, which turns off plotting
+  global plt,matplotlib_rcParams,Poly3DCollection,fig_timestamp
+  if plt is None:
+    try:
+      from matplotlib import rcParams as matplotlib_rcParams
+      from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+      try:
+        from .fig_timestamp import fig_timestamp
+      except ImportError: # run as a script
+        from fig_timestamp import fig_timestamp
+      import matplotlib.pyplot as plt
+    except ImportError:
+      pass
+  return plt
 
 class Plane:
   ''' Represents an infinite plane, defined by a point on the plane and a normal vector '''
@@ -59,7 +70,7 @@ class Ray:
     return Ray(intersection,reflected/np.linalg.norm(reflected))
   def plot(s,ax,length=1.0,color='b',alpha=0.5):
     ''' Plots the ray in 3d '''
-    if plt is None: return
+    if _pyplot() is None: return
     tip=s.tail+length*s.dv/np.linalg.norm(s.dv)
     x=(s.tail[0],tip[0])
     y=(s.tail[1],tip[1])
@@ -83,7 +94,7 @@ class Triangle:
     return Triangle(s.p0+c,s.p1+c,s.p2+c)
   def plot(s,ax,color='y',alpha=0.5,drawedges=True):
     ''' Plots the triangle in 3d. For kwargs, see https://matplotlib.org/stable/api/collections_api.html#matplotlib.collections.Collection '''
-    if plt is None: return
+    if _pyplot() is None: return
     if drawedges:
       pc=Poly3DCollection([(s.p0,s.p1,s.p2)],facecolor=color,edgecolor='olive',linewidth=0.5,alpha=alpha)
     else:
@@ -180,6 +191,9 @@ class Building:
 
 def draw_building_3d(building,rays=[],line_segments=[],dots=[],color='y',fontsize=6,limits=[(0,10),(0,10),(0,5)],labels=['','',''],drawedges=True,show=True,pdffn='',pngfn='',dbg=False):
   ' General function to draw a building, also rays and lines. '
+  if _pyplot() is None:
+    print('draw_building_3d: matplotlib not found: please do "pip install matplotlib"',file=stderr)
+    return
   matplotlib_rcParams.update({'font.size': fontsize})
   fig=plt.figure()
   fig_timestamp(fig)
@@ -287,6 +301,7 @@ def test_03():
   print(f'ris={ris}')
 
 def test_04(dbg=False,fontsize=4):
+  _pyplot()
   fig=plt.figure()
   ax=fig.add_subplot(projection='3d')
   t0=Triangle((0,0,0),(0,1,0),(0,0,1))
@@ -0,0 +1,185 @@
+# Vectorized measurement kernels: pathloss, received power, SINR, CQI and
+# throughput for whole arrays of UEs and cells at once.  UE arrays may have
+# any number of leading axes (for example a replication axis), so the
+# shapes below are written with ... for those axes.  The arithmetic follows
+# UE.send_rsrp_reports and UE.send_subband_cqi_report exactly.
+
+import numpy as np
+from math import pi as math_pi
+from concurrent.futures import ThreadPoolExecutor
+from .NR_5G_standard_functions import SINR_to_CQI,CQI_to_64QAM_efficiency_array
+
+def pathloss_matrix(pathloss,xyz_cells,xyz_UEs):
+  '''
+  Return the pathloss in dB from each cell to each UE, with shape (...,nues,ncells).
+  xyz_cells has shape (ncells,3) and xyz_UEs has shape (...,nues,3).
+  The pathloss model's ``vectorized`` method is used if it has one, and
+  otherwise it is called once for each (cell,UE) pair.
+  '''
+  xyz_UEs=np.asarray(xyz_UEs)
+  if hasattr(pathloss,'vectorized'):
+    return pathloss.vectorized(xyz_cells,xyz_UEs[...,None,:])
+  flat=xyz_UEs.reshape(-1,3)
+  pl=np.array([[pathloss(xyz_cell,xyz_UE) for xyz_cell in xyz_cells] for xyz_UE in flat])
+  return pl.reshape(xyz_UEs.shape[:-1]+(len(xyz_cells),))
+
+def antenna_gain_matrix(patterns,xyz_cells,xyz_UEs):
+  '''
+  Return the antenna gain in dB of each cell towards each UE, with shape
+  (...,nues,ncells), or 0.0 if no cell has a pattern.  patterns is a list
+  with one entry per cell, each ``None``, a 360-element array, or a
+  function of the angle in degrees, as for ``Cell``.
+  '''
+  if all(pattern is None for pattern in patterns): return 0.0
+  vector=np.asarray(xyz_UEs)[...,None,:]-xyz_cells # vectors pointing from cells to UEs
+  angle_degrees=(180.0/math_pi)*np.arctan2(vector[...,1],vector[...,0])
+  gain=np.zeros(angle_degrees.shape)
+  for k,pattern in enumerate(patterns):
+    if pattern is None: continue
+    if callable(pattern):
+      gain[...,k]=np.vectorize(pattern,otypes=[float])(angle_degrees[...,k])
+    else:
+      gain[...,k]=np.asarray(pattern)[angle_degrees[...,k].astype(int)%360]
+  return gain
+
+def received_power_dBm(pl_dB,gain_dB,power_dBm):
+  '''
+  Return the received power in dBm (excluding MIMO gain) of each cell at
+  each UE, with shape (...,nues,ncells).  power_dBm has shape (...,ncells).
+  '''
+  return np.asarray(power_dBm)[...,None,:]+gain_dB-pl_dB
+
+def sinr_dB_kernel(rx_dBm,MIMO_gain_dB,serving,subband_mask,noise_power_dBm=-140.0):
+  '''
+  Return the SINR in dB of each UE on each subband of its serving cell,
+  with shape (...,nues,nsubbands).
+
+  Parameters
+  ----------
+  rx_dBm : array of shape (...,nues,ncells)
+    Received power, as returned by ``received_power_dBm``.
+  MIMO_gain_dB : array of shape (...,ncells)
+    MIMO gain of each cell, applied to the wanted signal only.
+  serving : integer array of shape (...,nues)
+    Index of the serving cell of each UE; -1 means not attached, giving NaN.
+  subband_mask : array of shape (...,ncells,nsubbands)
+    Subband mask of each cell, applied to interference.
+  '''
+  attached=serving>=0
+  srv=np.where(attached,serving,0)
+  MIMO_gain_dB=np.broadcast_to(MIMO_gain_dB,serving.shape[:-1]+rx_dBm.shape[-1:])
+  wanted_dBm=np.take_along_axis(rx_dBm,srv[...,None],axis=-1)[...,0]+np.take_along_axis(MIMO_gain_dB,srv,axis=-1)
+  wanted=np.power(10.0,wanted_dBm/10.0)
+  rx=np.power(10.0,rx_dBm/10.0)
+  np.put_along_axis(rx,srv[...,None],0.0,axis=-1) # the serving cell does not interfere
+  interference=np.power(10.0,noise_power_dBm/10.0)+rx@subband_mask
+  sinr_dB=10.0*np.log10(wanted[...,None]/interference)
+  sinr_dB[~attached]=np.nan
+  return sinr_dB
+
+def attached_counts(serving,ncells):
+  '''
+  Return the number of UEs attached to each cell, with shape (...,ncells).
+  '''
+  attached=serving>=0
+  lead=serving.shape[:-1]
+  offsets=(np.arange(int(np.prod(lead,dtype=int)))*ncells).reshape(lead+(1,))
+  return np.bincount((serving+offsets)[attached],minlength=int(np.prod(lead,dtype=int))*ncells).reshape(lead+(ncells,))
+
+def throughput_Mbps_kernel(sinr_dB,serving,subband_mask,bw_MHz,ncells,nattached=None):
+  '''
+  Return (cqi,throughput_Mbps): the CQI of each UE on each subband, with
+  shape (...,nues,nsubbands), and the throughput of each UE, with shape
+  (...,nues), shared equally among the UEs attached to each cell.
+  bw_MHz has shape (ncells,).  Unattached UEs get CQI 0 and throughput NaN.
+  If serving is only a subset of the UEs, nattached must be given, as
+  returned by ``attached_counts`` for all UEs.
+  '''
+  attached=serving>=0
+  srv=np.where(attached,serving,0)
+  cqi=SINR_to_CQI(np.where(np.isnan(sinr_dB),-np.inf,sinr_dB))
+  cqi=np.maximum(cqi,0)
+  spectral_efficiency=CQI_to_64QAM_efficiency_array(cqi)
+  lead=serving.shape[:-1]
+  if nattached is None: nattached=attached_counts(serving,ncells)
+  mask=np.take_along_axis(np.broadcast_to(subband_mask,lead+np.shape(subband_mask)[-2:]),srv[...,None],axis=-2)
+  n_subbands=mask.shape[-1]
+  bw=np.asarray(bw_MHz)[srv]
+  throughput_Mbps=bw*np.sum(spectral_efficiency*mask,axis=-1)/n_subbands/np.maximum(1,np.take_along_axis(nattached,srv,axis=-1))
+  throughput_Mbps[~attached]=np.nan
+  return cqi,throughput_Mbps
+
+# Chunked measurements on a thread pool.  numpy releases the GIL in its
+# array loops and in matmul, so threads working on separate chunks of UEs
+# run in parallel, as long as each chunk is large enough to amortize the
+# Python overhead and small enough for its temporaries to stay in cache.
+
+_pool=None
+
+def kernel_pool(threads):
+  '''
+  Return a thread pool with ``threads`` threads, shared by all callers of
+  ``measure_chunked``.  It is created on first use, and recreated if the
+  number of threads changes.
+  '''
+  global _pool
+  if _pool is None or _pool._max_workers!=threads:
+    if _pool is not None: _pool.shutdown()
+    _pool=ThreadPoolExecutor(max_workers=threads,thread_name_prefix='AIMM_kernel')
+  return _pool
+
+def chunk_size(ncells,n_subbands=1,n_leading=1,cache_bytes=1<<20):
+  '''
+  Return a number of UEs per chunk such that the float64 temporaries of one
+  chunk (about four per UE-cell pair and three per UE-subband pair, for
+  each of n_leading replications) fit in ``cache_bytes`` (default 1MiB, a
+  typical per-core L2 cache).
+  '''
+  bytes_per_UE=8*n_leading*(4*ncells+3*n_subbands)
+  return max(1,cache_bytes//bytes_per_UE)
+
+def measure_chunked(pathloss,patterns,xyz_cells,xyz_UEs,power_dBm,MIMO_gain_dB,serving,subband_mask,bw_MHz,noise_power_dBm=-140.0,threads=None,chunk=None):
+  '''
+  Return (rsrp_dBm,sinr_dB,cqi,throughput_Mbps) for all UEs, with the
+  shapes returned by the kernels above, computing chunks of UEs on a pool
+  of ``threads`` threads.  The results are those of calling the kernels on
+  all UEs at once, except for rounding differences in the interference
+  matrix product, which may be blocked differently.
+
+  Parameters
+  ----------
+  pathloss, patterns, xyz_cells, xyz_UEs :
+    As for ``pathloss_matrix`` and ``antenna_gain_matrix``.
+  power_dBm, MIMO_gain_dB, serving, subband_mask, bw_MHz, noise_power_dBm :
+    As for ``received_power_dBm``, ``sinr_dB_kernel`` and ``throughput_Mbps_kernel``.
+  threads : int
+    Number of threads; if None or 1, the chunks are computed in the calling thread.
+  chunk : int
+    Number of UEs per chunk; the default is given by ``chunk_size``.
+  '''
+  xyz_UEs=np.asarray(xyz_UEs)
+  serving=np.asarray(serving)
+  ncells,nues=len(xyz_cells),xyz_UEs.shape[-2]
+  lead=xyz_UEs.shape[:-2]
+  n_subbands=np.shape(subband_mask)[-1]
+  if chunk is None: chunk=chunk_size(ncells,n_subbands,int(np.prod(lead,dtype=int)))
+  nattached=attached_counts(serving,ncells) # over all UEs, before chunking
+  rsrp_dBm=np.empty(lead+(nues,ncells))
+  sinr_dB=np.empty(lead+(nues,n_subbands))
+  cqi=np.empty(lead+(nues,n_subbands),dtype=int)
+  throughput_Mbps=np.empty(lead+(nues,))
+  def work(lo):
+    hi=min(nues,lo+chunk)
+    xyz,srv=xyz_UEs[...,lo:hi,:],serving[...,lo:hi]
+    pl_dB=pathloss_matrix(pathloss,xyz_cells,xyz)
+    gain_dB=antenna_gain_matrix(patterns,xyz_cells,xyz)
+    rx_dBm=received_power_dBm(pl_dB,gain_dB,power_dBm)
+    rsrp_dBm[...,lo:hi,:]=rx_dBm+np.asarray(MIMO_gain_dB)[...,None,:]
+    sinr_dB[...,lo:hi,:]=sinr_dB_kernel(rx_dBm,MIMO_gain_dB,srv,subband_mask,noise_power_dBm)
+    cqi[...,lo:hi,:],throughput_Mbps[...,lo:hi]=throughput_Mbps_kernel(sinr_dB[...,lo:hi,:],srv,subband_mask,bw_MHz,ncells,nattached)
+  starts=range(0,nues,chunk)
+  if threads is None or threads==1 or len(starts)==1:
+    for lo in starts: work(lo)
+  else:
+    for _ in kernel_pool(threads).map(work,starts): pass # re-raises any exception
+  return rsrp_dBm,sinr_dB,cqi,throughput_Mbps
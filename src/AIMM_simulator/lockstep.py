@@ -0,0 +1,203 @@
+# Lockstep replications: R replications of one scenario advanced together
+# in a single vectorized simulation, with a leading replication axis on
+# every state array.
+
+from sys import stderr
+import numpy as np
+from .AIMM_simulator import from_dB
+from .kernels import pathloss_matrix,antenna_gain_matrix,received_power_dBm,sinr_dB_kernel,throughput_Mbps_kernel,measure_chunked
+
+class Lockstep_Sim:
+  '''
+  R replications of one scenario, sharing one simulation structure and
+  advanced together in fixed time steps.  The cells, UEs, initial
+  attachments, pathloss model and MME settings are copied from a template
+  ``Sim`` which has been built as usual but not run.  Every state array has
+  a leading replication axis of length R, and every measurement is one
+  vectorized computation over all replications, so for modest numbers of
+  UEs many replications cost little more than one.  Replications differ
+  through their random number generators ``rngs`` (one per seed), and may
+  also differ in cell parameters, by writing to ``power_dBm``,
+  ``MIMO_gain_dB`` or ``subband_mask``.
+
+  Each step of length ``interval`` does, in order: handovers, if the MME
+  interval is due, based on the state at the end of the previous step; the
+  ``mobility`` function; measurements (RSRP, SINR, CQI, throughput); and
+  the ``f_callback`` function.  This is the order in which a Sim with an
+  MME, a Scenario and UEs usually runs, but simpy event ordering within one
+  instant is not reproduced in general, and the best_rsrp_cell strategy
+  uses the latest RSRP of every cell rather than the last report.
+
+  Parameters
+  ----------
+  sim : Sim
+    Template simulation.  All UEs must use the same pathloss model
+    parameters, and all cells the same number of subbands.
+  n_replications : int
+    Number of replications R.
+  seeds : sequence of int
+    One seed per replication; default ``range(n_replications)``.
+  interval : float
+    Time step; default the reporting interval of UE[0].
+  mobility : function
+    ``mobility(ls)``, called at each step to update ``ls.UE_locations``.
+  f_callback : function
+    ``f_callback(ls)``, called at the end of each step, typically to log or accumulate KPIs.
+  threads : int
+    If not None, measurements are computed in chunks of UEs on a pool of this many threads (see ``kernels.measure_chunked``); worthwhile for large numbers of UEs and cells.
+  chunk : int
+    Number of UEs per chunk when threads is set; the default is sized to fit in cache.
+  verbosity : int
+    Level of debugging output (0=none).
+
+  Attributes
+  ----------
+  UE_locations : (R,nues,3) array
+  serving : (R,nues) integer array of serving cell indices (-1=not attached)
+  power_dBm, MIMO_gain_dB : (R,ncells) arrays
+  subband_mask : (R,ncells,nsubbands) array
+  rsrp_dBm : (R,nues,ncells) array
+  sinr_dB, cqi : (R,nues,nsubbands) arrays
+  throughput_Mbps : (R,nues) array
+  '''
+
+  def __init__(s,sim,n_replications,seeds=None,interval=None,mobility=None,f_callback=None,threads=None,chunk=None,verbosity=0):
+    if not sim.UEs or not sim.cells:
+      raise ValueError('Lockstep_Sim: the template Sim must have at least one cell and one UE')
+    n_subbands=set(cell.n_subbands for cell in sim.cells)
+    if len(n_subbands)>1:
+      raise ValueError('Lockstep_Sim: all cells must have the same number of subbands')
+    s.pathloss=sim.UEs[0].pathloss
+    for ue in sim.UEs[1:]:
+      if ue.pathloss is not s.pathloss and (type(ue.pathloss) is not type(s.pathloss) or vars(ue.pathloss)!=vars(s.pathloss)):
+        raise ValueError('Lockstep_Sim: all UEs must use the same pathloss model')
+    R=s.R=n_replications
+    s.sim=sim
+    s.n_cells,s.n_ues,s.n_subbands=len(sim.cells),len(sim.UEs),n_subbands.pop()
+    s.seeds=list(range(R)) if seeds is None else list(seeds)
+    assert len(s.seeds)==R
+    s.rngs=[np.random.default_rng(seed) for seed in s.seeds]
+    s.interval=sim.UEs[0].reporting_interval if interval is None else interval
+    s.mobility=mobility
+    s.f_callback=f_callback
+    s.threads=threads
+    s.chunk=chunk
+    s.verbosity=verbosity
+    s.now=0.0
+    # cells...
+    s.cell_locations=np.array([cell.xyz for cell in sim.cells],dtype=float)
+    s.patterns=[cell.pattern for cell in sim.cells]
+    s.bw_MHz=np.array([cell.bw_MHz for cell in sim.cells])
+    s.power_dBm=np.tile([cell.power_dBm for cell in sim.cells],(R,1)).astype(float)
+    s.MIMO_gain_dB=np.tile([cell.MIMO_gain_dB for cell in sim.cells],(R,1)).astype(float)
+    s.subband_mask=np.tile(np.array([cell.subband_mask for cell in sim.cells],dtype=float),(R,1,1))
+    # UEs...
+    s.noise_power_dBm=sim.UEs[0].noise_power_dBm
+    s.UE_locations=np.tile(sim.UE_locations,(R,1,1))
+    s.serving=np.tile([-1 if ue.serving_cell is None else ue.serving_cell.i for ue in sim.UEs],(R,1))
+    # the last two recorded serving cells with their times of attachment,
+    # as in ue.serving_cell_ids, for the anti-pingpong rule
+    ids=[ue.serving_cell_ids for ue in sim.UEs]
+    s.current=np.tile([i[0][0] for i in ids],(R,1))
+    s.attach_time=np.tile([-np.inf if i[0][1] is None else i[0][1] for i in ids],(R,1))
+    s.previous=np.tile([i[1][0] for i in ids],(R,1))
+    s.previous_time=np.tile([-np.inf if i[1][1] is None else i[1][1] for i in ids],(R,1))
+    s.n_handovers=np.zeros(R,dtype=int)
+    # MME...
+    mme=sim.mme
+    s.mme_interval=None if mme is None else mme.interval
+    s.strategy=None if mme is None else mme.strategy
+    s.anti_pingpong=0.0 if mme is None else mme.anti_pingpong
+    if s.strategy not in (None,'strongest_cell_simple_pathloss_model','best_rsrp_cell'):
+      raise ValueError(f'Lockstep_Sim: strategy {s.strategy} not implemented')
+    s.next_handover_time=np.inf if mme is None else 0.5*mme.interval
+    s.kpis={}
+    s.measure()
+
+  def standard_normal(s,shape=()):
+    '''
+    Return an array of shape (R,)+shape of standard normal samples, each
+    replication drawing from its own generator.
+    '''
+    return np.stack([rng.standard_normal(shape) for rng in s.rngs])
+
+  def measure(s):
+    '''
+    Compute RSRP, SINR, CQI and throughput for all UEs in all replications.
+    '''
+    if s.threads is not None:
+      s.rsrp_dBm,s.sinr_dB,s.cqi,s.throughput_Mbps=measure_chunked(s.pathloss,s.patterns,s.cell_locations,s.UE_locations,s.power_dBm,s.MIMO_gain_dB,s.serving,s.subband_mask,s.bw_MHz,s.noise_power_dBm,s.threads,s.chunk)
+      return
+    pl_dB=pathloss_matrix(s.pathloss,s.cell_locations,s.UE_locations)
+    gain_dB=antenna_gain_matrix(s.patterns,s.cell_locations,s.UE_locations)
+    rx_dBm=received_power_dBm(pl_dB,gain_dB,s.power_dBm)
+    s.rsrp_dBm=rx_dBm+s.MIMO_gain_dB[:,None,:]
+    s.sinr_dB=sinr_dB_kernel(rx_dBm,s.MIMO_gain_dB,s.serving,s.subband_mask,s.noise_power_dBm)
+    s.cqi,s.throughput_Mbps=throughput_Mbps_kernel(s.sinr_dB,s.serving,s.subband_mask,s.bw_MHz,s.n_cells)
+
+  def strongest_cell_simple_pathloss_model(s,alpha=3.5):
+    '''
+    Return the (R,nues) array of cells which ``Sim.get_strongest_cell_simple_pathloss_model`` would choose.
+    '''
+    w=from_dB(s.power_dBm)**(-1.0/alpha)
+    d=np.linalg.norm(s.UE_locations[:,:,None,:]-s.cell_locations,axis=-1)
+    return np.argmin(w[:,None,:]*d,axis=-1)
+
+  def do_handovers(s,threshold=-120.0):
+    '''
+    Vectorized equivalent of ``MME.do_handovers``, including the anti-pingpong rule.
+    '''
+    if s.strategy=='best_rsrp_cell':
+      rsrp=np.where(s.rsrp_dBm>threshold,s.rsrp_dBm,-np.inf)
+      target=np.argmax(rsrp,axis=-1)
+      none=np.isneginf(np.max(rsrp,axis=-1))
+      target[none]=s.strongest_cell_simple_pathloss_model()[none]
+    else:
+      target=s.strongest_cell_simple_pathloss_model()
+    move=(s.serving>=0)&(target!=s.serving)
+    if s.anti_pingpong>0.0:
+      pingpong=(target==s.previous)&(s.now-s.previous_time<s.anti_pingpong)
+      move&=~pingpong
+    s.previous=np.where(move,s.current,s.previous)
+    s.previous_time=np.where(move,s.attach_time,s.previous_time)
+    s.current=np.where(move,target,s.current)
+    s.attach_time=np.where(move,s.now,s.attach_time)
+    s.serving=np.where(move,target,s.serving)
+    s.n_handovers+=np.sum(move,axis=-1)
+
+  def step(s):
+    '''
+    Advance all replications by one time step.
+    '''
+    if s.now>=s.next_handover_time:
+      s.do_handovers()
+      s.next_handover_time+=s.mme_interval
+    if s.mobility is not None: s.mobility(s)
+    s.measure()
+    if s.f_callback is not None: s.f_callback(s)
+    s.now+=s.interval
+
+  def run(s,until):
+    '''
+    Advance all replications until time ``until``.
+    '''
+    s.until=until
+    nsteps=0
+    while s.now<until:
+      s.step()
+      nsteps+=1
+    if s.verbosity>0:
+      print(f'Lockstep_Sim: {s.R} replications advanced {nsteps} steps to t={s.now:.2f}.',file=stderr)
+
+  def get_average_throughput(s):
+    '''
+    Return an (R,) array: for each replication, the average over cells of the mean throughput of the UEs attached to each cell (0 for cells with no UEs).
+    '''
+    attached=s.serving>=0
+    srv=np.where(attached,s.serving,0)+s.n_cells*np.arange(s.R)[:,None]
+    tp=np.where(attached,s.throughput_Mbps,0.0)
+    total=np.bincount(srv[attached],weights=tp[attached],minlength=s.R*s.n_cells).reshape(s.R,s.n_cells)
+    count=np.bincount(srv[attached],minlength=s.R*s.n_cells).reshape(s.R,s.n_cells)
+    return np.mean(total/np.maximum(count,1),axis=-1)
+
+# END class Lockstep_Sim
@@ -0,0 +1,12 @@
+# Convert a binary log written by Columnar_Logger to tab-separated text:
+# python -m AIMM_simulator.log_to_tsv log_directory > log.tsv
+
+from sys import argv,stderr,exit
+from os.path import join,exists
+from .loggers import columnar_to_tsv
+
+if __name__=='__main__':
+  if len(argv)<2 or not exists(join(argv[1],'schema.json')):
+    print('usage: python -m AIMM_simulator.log_to_tsv log_directory > log.tsv',file=stderr)
+    exit(1)
+  columnar_to_tsv(argv[1])
@@ -0,0 +1,482 @@
+# Logger backends which avoid per-record text formatting.
+# Columnar_Logger appends typed columns to preallocated in-memory chunks,
+# and writes each full chunk as one .npz segment in a log directory, with
+# a JSON schema describing the columns.  read_columnar reads such a log,
+# and columnar_to_tsv (also run as python -m AIMM_simulator.log_to_tsv)
+# converts it to the usual tab-separated text.
+# Async_writer is a file-like object which any Logger can write to, and
+# which moves the actual writing to a background thread.
+# Frame_writer and Binary_Logger write rows of float64 in binary frames,
+# which realtime_plotter.py reads without parsing text.
+
+import json
+import atexit
+import struct
+from time import perf_counter
+from threading import Thread
+from queue import Queue,Full,Empty
+from sys import stdout
+from os import makedirs,devnull
+from os.path import join
+import numpy as np
+from .AIMM_simulator import Logger
+
+class Columnar_Logger(Logger):
+  '''
+  A Logger which stores records as typed columns in memory, and writes
+  them in binary segments, so that logging costs about as much as copying
+  the data.  Records are appended with ``append``, either by ``func`` or
+  by user code at any time; by default one row is logged for each CQI
+  report held by each cell, with columns ``t``, ``cell``, ``ue`` and
+  ``cqi`` (one value per subband).  Each segment holds up to
+  ``chunk_rows`` rows and is written as ``segment_NNNNNN.npz`` in the
+  directory ``fn``, together with ``schema.json``; the last partial
+  segment is written by ``finalize``.
+
+  Parameters
+  ----------
+  sim : Sim
+    The Sim instance which will manage this Logger.
+  fn : str
+    Log directory; created if necessary.  Existing segments are overwritten.
+  columns : list of tuples
+    (name,dtype) or (name,dtype,shape) for each column, where shape is the shape of one entry; default as above.
+  func : function
+    If not None, ``func(logger)`` is called every ``logging_interval`` and should call ``logger.append``.  Default ``default_columnar_logger``.
+  logging_interval : float
+    Time interval between logging actions.
+  chunk_rows : int
+    Number of rows per segment.
+  compress : bool
+    Whether to compress segments (smaller files, slower writes).
+  '''
+
+  def __init__(s,sim,fn='log',columns=None,func=None,logging_interval=10,chunk_rows=1<<16,compress=False):
+    s.sim=sim
+    s.fn=fn
+    s.logging_interval=float(logging_interval)
+    s.chunk_rows=int(chunk_rows)
+    s.compress=compress
+    s.f=None
+    s.func=s.default_columnar_logger if func is None else func
+    if columns is None:
+      n_subbands=max((cell.n_subbands for cell in sim.cells),default=1)
+      columns=[('t','f8'),('cell','i4'),('ue','i4'),('cqi','i1',(n_subbands,))]
+    s.columns=[(c[0],np.dtype(c[1]),tuple(c[2]) if len(c)>2 else ()) for c in columns]
+    s.buffers={name: np.empty((s.chunk_rows,)+shape,dtype=dtype) for name,dtype,shape in s.columns}
+    s.n=0 # rows in the current chunk
+    s.n_rows=0 # rows written to segments
+    s.segments=[]
+    makedirs(fn,exist_ok=True)
+    s._write_schema()
+
+  def _write_schema(s):
+    # internal use only
+    schema={'columns': [{'name': name,'dtype': dtype.str,'shape': list(shape)} for name,dtype,shape in s.columns],
+            'segments': s.segments,
+            'n_rows': s.n_rows}
+    with open(join(s.fn,'schema.json'),'w') as f: json.dump(schema,f,indent=1)
+
+  def append(s,**columns):
+    '''
+    Append rows.  Each keyword argument gives one column, as a scalar (repeated for every row) or as an array with one entry per row; all columns must be given.
+    '''
+    n=max((np.shape(v)[0] for (name,dtype,shape),v in ((c,columns[c[0]]) for c in s.columns) if np.ndim(v)>len(shape)),default=1)
+    k=0
+    while k<n: # the rows may span several chunks
+      m=min(n-k,s.chunk_rows-s.n)
+      for name,dtype,shape in s.columns:
+        v=columns[name]
+        s.buffers[name][s.n:s.n+m]=v[k:k+m] if np.ndim(v)>len(shape) else v
+      s.n+=m
+      k+=m
+      if s.n==s.chunk_rows: s.flush()
+
+  def flush(s):
+    '''
+    Write the rows in the current chunk as a new segment.
+    '''
+    if s.n==0: return
+    if s.fn is None: # in a Sim.fork child: discard
+      s.n=0
+      return
+    name=f'segment_{len(s.segments):06d}.npz'
+    save=np.savez_compressed if s.compress else np.savez
+    save(join(s.fn,name),**{c: b[:s.n] for c,b in s.buffers.items()})
+    s.segments.append(name)
+    s.n_rows+=s.n
+    s.n=0
+    s._write_schema()
+
+  def default_columnar_logger(s,logger=None):
+    ''' Log t, cell, ue and cqi for every CQI report held by every cell. '''
+    now=s.sim.env.now
+    for cell in s.sim.cells:
+      cell.refresh_reports()
+      reports=[(ue_i,rep[1]) for ue_i,rep in cell.reports['cqi'].items() if rep is not None]
+      if not reports: continue
+      s.append(t=now,cell=cell.i,ue=np.array([r[0] for r in reports]),cqi=np.array([r[1] for r in reports]))
+
+  def loop(s):
+    '''
+    Main loop of Columnar_Logger.
+    '''
+    while True:
+      s.func(s)
+      yield s.sim.env.timeout(s.logging_interval)
+
+  def finalize(s):
+    '''
+    Write the last partial segment.
+    '''
+    s.flush()
+
+  def _fork_child(s):
+    # internal use only - in a Sim.fork child, write nothing, as segment
+    # numbers and schema.json would collide with those of the parent
+    s.fn=None
+
+# END class Columnar_Logger
+
+def read_columnar(fn,segments=False):
+  '''
+  Read a log written by ``Columnar_Logger`` from the directory ``fn``, and
+  return a dictionary mapping column names to arrays.  If ``segments`` is
+  True, return instead a generator yielding one such dictionary per
+  segment, so that logs larger than memory can be processed.
+  '''
+  with open(join(fn,'schema.json')) as f: schema=json.load(f)
+  def generate():
+    for name in schema['segments']:
+      with np.load(join(fn,name)) as data:
+        yield {c['name']: data[c['name']] for c in schema['columns']}
+  if segments: return generate()
+  parts=list(generate())
+  return {c['name']: np.concatenate([p[c['name']] for p in parts]) if parts else
+          np.empty((0,)+tuple(c['shape']),dtype=c['dtype']) for c in schema['columns']}
+
+def columnar_to_tsv(fn,f=stdout,header=True,precision=6):
+  '''
+  Write a log written by ``Columnar_Logger`` to the file object ``f`` as
+  tab-separated text, one line per row, with each entry of an array column
+  in its own field (as ``np_array_to_str`` does for text logs).  Floats are
+  written with ``precision`` significant digits.
+  '''
+  with open(join(fn,'schema.json')) as g: schema=json.load(g)
+  if header:
+    names=[]
+    for c in schema['columns']:
+      size=int(np.prod(c['shape'],dtype=int))
+      names+=[c['name']] if not c['shape'] else [f'{c["name"]}[{k}]' for k in range(size)]
+    f.write('\t'.join(names)+'\n')
+  for seg in read_columnar(fn,segments=True):
+    fields=[]
+    for c in schema['columns']:
+      x=seg[c['name']]
+      x=np.char.mod(f'%.{precision}g',x) if x.dtype.kind=='f' else x.astype(str)
+      fields+=list(x.reshape(len(x),-1).T)
+    for row in zip(*fields): f.write('\t'.join(row)+'\n')
+
+class Async_writer:
+  '''
+  A file-like object which passes everything written to it to the file
+  object ``f`` in a background thread, so that a slow disk or a slow
+  reader of a pipe (such as ``realtime_plotter.py``) does not stall the
+  simulation.  Each call of ``write`` is one record (str, or bytes
+  for a binary file); records are
+  collected into batches of ``batch_records``, which are passed to the
+  writer thread through a queue holding at most ``max_batches`` batches.
+  A partial batch is passed on when a record is written ``max_latency``
+  wall-clock seconds or more after the last batch was queued, so that a live
+  reader (such as ``realtime_plotter.py``) is not kept waiting for a full batch.
+  When the queue is full, ``policy`` decides what happens to a new batch:
+
+  ``'block'``: wait for space, so no records are lost (backpressure).
+
+  ``'drop_oldest'``: discard the oldest queued batch, so the output keeps up with the simulation.
+
+  ``'sample'``: keep only every ``sample_every``-th record of the batch, and wait for space.
+
+  ``stats()`` reports how many records were written and dropped, and how
+  far the writer is lagging.  ``flush`` waits until everything queued has
+  been written; ``Logger.finalize`` calls it, and ``close`` is called at
+  exit if it has not been called before.  The underlying file is flushed
+  whenever the queue becomes empty, but is never closed.
+  Usage: ``Logger(sim,f=Async_writer(stdout))``.
+  '''
+
+  policies=('block','drop_oldest','sample')
+
+  def __init__(s,f=stdout,max_batches=64,batch_records=1024,policy='block',sample_every=10,max_latency=0.1):
+    if policy not in Async_writer.policies:
+      raise ValueError(f'Async_writer: policy must be one of {Async_writer.policies}')
+    s.f=f
+    s.batch_records=batch_records
+    s.policy=policy
+    s.sample_every=sample_every
+    s.max_latency=max_latency
+    s.last=perf_counter() # when the last batch was queued
+    s.queue=Queue(maxsize=max_batches)
+    s.batch=[]
+    s.n_enqueued=0
+    s.n_written=0
+    s.n_dropped=0
+    s.max_queued=0
+    s.blocked_time=0.0 # seconds the simulation waited for the writer
+    s.error=None
+    s.closed=False
+    s.thread=Thread(target=s._writer,name='Async_writer',daemon=True)
+    s.thread.start()
+    atexit.register(s.close)
+
+  def _writer(s):
+    # internal use only - main function of the writer thread
+    while True:
+      batch=s.queue.get()
+      try:
+        if batch is None: return
+        if s.error is None:
+          s.f.write(batch[0][:0].join(batch)) # str or bytes
+          s.n_written+=len(batch)
+          if s.queue.empty(): s.f.flush()
+        else: # after an error, nothing more is written
+          s.n_dropped+=len(batch)
+      except Exception as e: # e.g. a broken pipe: reported by the next write
+        s.error=e
+        s.n_dropped+=len(batch) # not known to have been written
+      finally:
+        s.queue.task_done()
+
+  def _put(s,batch):
+    # internal use only - queue a batch according to the overflow policy
+    try:
+      s.queue.put_nowait(batch)
+    except Full:
+      if s.policy=='drop_oldest':
+        while True:
+          try:
+            s.queue.put_nowait(batch)
+            break
+          except Full:
+            try:
+              old=s.queue.get_nowait()
+              s.n_dropped+=len(old)
+              s.queue.task_done()
+            except Empty: pass
+      else:
+        if s.policy=='sample':
+          s.n_dropped+=len(batch)-len(batch[::s.sample_every])
+          batch=batch[::s.sample_every]
+        t0=perf_counter()
+        s.queue.put(batch)
+        s.blocked_time+=perf_counter()-t0
+    s.max_queued=max(s.max_queued,s.queue.qsize())
+    s.last=perf_counter()
+
+  def write(s,record):
+    '''
+    Queue one record (a string, usually one line) for writing.
+    '''
+    if s.error is not None: raise s.error
+    s.batch.append(record)
+    s.n_enqueued+=1
+    if len(s.batch)>=s.batch_records or perf_counter()-s.last>s.max_latency:
+      s._put(s.batch)
+      s.batch=[]
+    return len(record)
+
+  def flush(s):
+    '''
+    Queue the current partial batch, and wait until all queued records have been written.
+    '''
+    if s.closed: return
+    if s.batch:
+      s._put(s.batch)
+      s.batch=[]
+    s.queue.join()
+    if s.error is not None: raise s.error
+
+  def close(s):
+    '''
+    Flush, and stop the writer thread.
+    '''
+    if s.closed: return
+    atexit.unregister(s.close)
+    try:
+      s.flush()
+    finally:
+      s.closed=True
+      s.queue.put(None)
+      s.thread.join()
+
+  def stats(s):
+    '''
+    Return a dictionary with the numbers of records ``enqueued``, ``written`` and ``dropped``, the current ``lag`` (records accepted but not yet written or dropped), the maximum number of batches ever queued, and the time in seconds the simulation spent blocked waiting for the writer.
+    '''
+    return {'enqueued': s.n_enqueued,
+            'written': s.n_written,
+            'dropped': s.n_dropped,
+            'lag': s.n_enqueued-s.n_written-s.n_dropped,
+            'max_queued_batches': s.max_queued,
+            'blocked_time': s.blocked_time}
+
+# END class Async_writer
+
+FRAME_MAGIC=b'\x93AIMMROW' # first 8 bytes of a framed binary stream
+
+class Frame_writer:
+  '''
+  Writes rows of ``ncols`` numbers to the binary file object ``f`` in the
+  framed format read by ``realtime_plotter.py`` (which detects it
+  automatically, and otherwise reads tab-separated text).  The stream
+  starts with a header: the 8 bytes ``FRAME_MAGIC``; version, ncols
+  (little-endian uint16 each); the dtype, 4 bytes ``b'<f8\\0'``; and the
+  length (uint32) of a UTF-8 JSON list of column names which follows.
+  Then come frames, each the number of rows (uint32) followed by that many
+  rows of ncols little-endian float64.  Rows are collected in a
+  preallocated batch of ``batch_rows``, which is written as one frame when
+  full, or when ``max_latency`` wall-clock seconds have passed since the
+  last frame, so that a live plot does not lag.  ``flush`` writes the
+  current batch at once.  If ``f`` is a text file with a binary buffer
+  (such as ``sys.stdout``), the buffer is used.
+  '''
+
+  version=1
+
+  def __init__(s,f=stdout,ncols=None,names=None,batch_rows=64,max_latency=0.1):
+    s.f=getattr(f,'buffer',f)
+    s.names=list(names) if names is not None else None
+    s.ncols=ncols if ncols is not None else (len(names) if names is not None else None)
+    s.batch_rows=batch_rows
+    s.max_latency=max_latency
+    s.batch=None
+    s.n=0
+    s.last=perf_counter()
+    if s.ncols is not None: s._start()
+
+  def _start(s):
+    # internal use only - allocate the batch and write the header
+    s.batch=np.empty((s.batch_rows,s.ncols),dtype='<f8')
+    names=json.dumps(s.names if s.names is not None else []).encode()
+    s.f.write(FRAME_MAGIC+struct.pack('<HH4sI',Frame_writer.version,s.ncols,b'<f8\0',len(names))+names)
+
+  def write_rows(s,rows):
+    '''
+    Write one row (a sequence of ncols numbers), or a 2-d array of rows.
+    '''
+    rows=np.asarray(rows,dtype=float)
+    if rows.ndim==1: rows=rows[None,:]
+    if s.batch is None:
+      s.ncols=rows.shape[1]
+      s._start()
+    elif rows.shape[1]!=s.ncols:
+      raise ValueError(f'Frame_writer: rows must have {s.ncols} columns, not {rows.shape[1]}')
+    k=0
+    while k<len(rows):
+      m=min(len(rows)-k,s.batch_rows-s.n)
+      s.batch[s.n:s.n+m]=rows[k:k+m]
+      s.n+=m
+      k+=m
+      if s.n==s.batch_rows: s.flush()
+    if s.n and perf_counter()-s.last>s.max_latency: s.flush()
+
+  def flush(s):
+    '''
+    Write the current batch as a frame, and flush the file.
+    '''
+    if s.n:
+      s.f.write(struct.pack('<I',s.n)+s.batch[:s.n].tobytes())
+      s.n=0
+    s.last=perf_counter()
+    if hasattr(s.f,'flush'): s.f.flush()
+
+# END class Frame_writer
+
+class Binary_Logger(Logger):
+  '''
+  A Logger which writes rows of numbers with a ``Frame_writer``, for
+  ``realtime_plotter.py`` or other readers, avoiding the cost of formatting
+  and parsing text.  Rows are written with ``append``, by ``func`` or by
+  user code at any time.  By default one row is logged for each CQI
+  report held by each cell, with columns ``t``, ``cell``, ``ue`` and one
+  ``cqi`` column per subband; every row must have the same length.
+
+  Parameters
+  ----------
+  sim : Sim
+    The Sim instance which will manage this Logger.
+  func : function
+    If not None, ``func(logger)`` is called every ``logging_interval`` and should call ``logger.append``.  Default ``default_binary_logger``.
+  f : file object
+    An open file object (binary, or text with a binary buffer, such as ``sys.stdout``).
+  logging_interval : float
+    Time interval between logging actions.
+  columns : list of str
+    Column names written in the header; default as above if func is None.
+  batch_rows : int
+    Rows per frame.
+  max_latency : float
+    Maximum wall-clock time a row waits before being written.
+  '''
+
+  def __init__(s,sim,func=None,f=stdout,logging_interval=10,columns=None,batch_rows=64,max_latency=0.1):
+    s.sim=sim
+    s.logging_interval=float(logging_interval)
+    s.func=s.default_binary_logger if func is None else func
+    if columns is None and func is None:
+      n_subbands=max((cell.n_subbands for cell in sim.cells),default=1)
+      columns=['t','cell','ue']+[f'cqi[{k}]' for k in range(n_subbands)]
+    s.writer=Frame_writer(f,names=columns,batch_rows=batch_rows,max_latency=max_latency)
+
+  @property
+  def f(s):
+    ''' The binary file object written, which is that of the ``Frame_writer``. '''
+    return s.writer.f
+
+  @f.setter
+  def f(s,f):
+    s.writer.f=getattr(f,'buffer',f)
+
+  def append(s,*values):
+    '''
+    Write one row, given as numbers, or as one sequence or 2-d array of rows.
+    '''
+    s.writer.write_rows(values[0] if len(values)==1 and np.ndim(values[0])>0 else values)
+
+  def default_binary_logger(s,logger=None):
+    ''' Log t, cell, ue and cqi for every CQI report held by every cell. '''
+    now=s.sim.env.now
+    ncqi=s.writer.ncols-3
+    for cell in s.sim.cells:
+      cell.refresh_reports()
+      reports=[(ue_i,rep[1]) for ue_i,rep in cell.reports['cqi'].items() if rep is not None]
+      if not reports: continue
+      rows=np.full((len(reports),3+ncqi),np.nan)
+      rows[:,0]=now
+      rows[:,1]=cell.i
+      for k,(ue_i,cqi) in enumerate(reports):
+        rows[k,2]=ue_i
+        rows[k,3:3+len(cqi)]=cqi
+      s.writer.write_rows(rows)
+
+  def loop(s):
+    '''
+    Main loop of Binary_Logger.
+    '''
+    while True:
+      s.func(s)
+      yield s.sim.env.timeout(s.logging_interval)
+
+  def finalize(s):
+    '''
+    Write the last partial frame.
+    '''
+    s.writer.flush()
+
+  def _fork_child(s):
+    # internal use only - in a Sim.fork child, discard the rows of the
+    # parent not yet written (the parent writes them), and write to devnull
+    s.writer.n=0
+    s.f=open(devnull,'wb')
+
+# END class Binary_Logger
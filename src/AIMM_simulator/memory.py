@@ -0,0 +1,145 @@
+# Memory accounting by subsystem: bytes held by cells, their reports and
+# RSRP histories, UEs, loggers, the RIC, MME, scenario and metrics store,
+# found by walking their attributes and counting numpy arrays by their data
+# size; optionally with tracemalloc statistics of allocation sites, and
+# their growth since the previous report.  Sim.memory_report uses
+# memory_report, and Memory_Logger calls it periodically during a run.
+
+import sys
+import tracemalloc
+from types import ModuleType,FunctionType,BuiltinFunctionType,MethodType,GeneratorType
+from io import IOBase
+import numpy as np
+from .AIMM_simulator import Logger
+
+_opaque=(type,ModuleType,FunctionType,BuiltinFunctionType,MethodType,IOBase)
+
+def sizeof(obj,seen=None):
+  '''
+  Return an estimate of the number of bytes held by obj and everything it
+  refers to, excluding objects whose ids are in the set ``seen`` (to which
+  the ids of all objects counted are added, so that nothing is counted
+  twice), code, classes, modules and files.  numpy arrays are counted by
+  their data size, or by their header only if they are views.  Generators
+  (for example main loops) are counted without their local variables.
+  '''
+  if seen is None: seen=set()
+  total=0
+  stack=[obj]
+  while stack:
+    x=stack.pop()
+    if id(x) in seen or isinstance(x,_opaque): continue
+    seen.add(id(x))
+    if isinstance(x,np.ndarray):
+      total+=sys.getsizeof(x) if x.base is not None else x.nbytes+sys.getsizeof(x)-(x.nbytes if x.flags.owndata else 0)
+      if x.dtype==object: stack.extend(x.ravel())
+      continue
+    total+=sys.getsizeof(x)
+    if isinstance(x,(str,bytes,int,float,complex,bool,GeneratorType)): continue
+    if isinstance(x,dict):
+      stack.extend(x.keys()); stack.extend(x.values())
+    elif isinstance(x,(list,tuple,set,frozenset)) or type(x).__name__=='deque':
+      stack.extend(x)
+    if hasattr(x,'__dict__'): stack.append(x.__dict__)
+  return total
+
+def _class_state(obj):
+  # internal use only - data held as class attributes of user subclasses
+  # (such as a Q-table shared by all instances)
+  state={}
+  for cls in type(obj).__mro__:
+    if cls.__module__.startswith('AIMM_simulator') or cls is object: continue
+    state.update((k,v) for k,v in vars(cls).items() if not k.startswith('__') and not callable(v))
+  return state
+
+def memory_report(sim,top=10):
+  '''
+  Return a dictionary of the estimated bytes held by each subsystem of the
+  simulation ``sim``, see ``Sim.memory_report``.
+  '''
+  # the snapshot is taken first, so that it excludes the data of this function...
+  traced={}
+  if tracemalloc.is_tracing():
+    traced['traced_current'],traced['traced_peak']=tracemalloc.get_traced_memory()
+    snapshot=tracemalloc.take_snapshot().filter_traces((
+      tracemalloc.Filter(False,tracemalloc.__file__),
+      tracemalloc.Filter(False,'<frozen importlib._bootstrap*>'),))
+    traced['top']=[(str(st.traceback),st.size,st.count) for st in snapshot.statistics('lineno')[:top]]
+    if sim._memory_snapshot is not None:
+      traced['growth']=[(str(st.traceback),st.size_diff,st.count_diff) for st in snapshot.compare_to(sim._memory_snapshot,'lineno')[:top]]
+    sim._memory_snapshot=snapshot
+  # the sim, environment and all main-loop owners are excluded from each
+  # other's totals, so each is counted only under its own subsystem...
+  owners=[owner for key,owner in sim._loop_owners()]
+  seen={id(sim),id(sim.env)}|{id(owner) for owner in owners}
+  report={}
+  report['cell_reports']=sum(sizeof(cell.reports,seen) for cell in sim.cells)
+  report['rsrp_history']=sum(sizeof(cell.rsrp_history,seen) for cell in sim.cells)
+  def subsystem(objects):
+    total=0
+    for obj in objects:
+      seen.discard(id(obj))
+      total+=sizeof(obj,seen)+sizeof(_class_state(obj),seen)
+    return total
+  report['cells']=subsystem(sim.cells)
+  report['UEs']=subsystem(sim.UEs)+sizeof(sim._UE_xyz,seen)
+  report['loggers']=subsystem(sim.loggers)
+  for name in ('ric','mme','scenario','metrics'):
+    obj=getattr(sim,name)
+    report[name]=subsystem([obj]) if obj is not None else 0
+  report['total']=sum(report.values())
+  try:
+    import resource
+    report['max_rss']=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*(1 if sys.platform=='darwin' else 1024)
+  except ImportError: # not unix
+    pass
+  report.update(traced)
+  return report
+
+class Memory_Logger(Logger):
+  '''
+  A Logger which calls ``sim.memory_report()`` every ``logging_interval``,
+  keeps the reports in the list ``history`` as (time,report) pairs, and
+  writes one line per report, with the time followed by the bytes held by
+  each subsystem, tab-separated, after a header line naming them.  If
+  ``trace`` is true, tracemalloc is started, so that the reports also give
+  the allocation sites holding the most memory, and those which grew most
+  since the previous report (which costs time and memory).
+
+  Parameters
+  ----------
+  sim : Sim
+    The Sim instance which will manage this Logger.
+  f : file object
+    An open file object which will be written or appended to.
+  logging_interval : float
+    Time interval between reports.
+  trace : bool
+    Whether to start tracemalloc.
+  top : int
+    Number of allocation sites in each tracemalloc list.
+  '''
+
+  def __init__(s,sim,f=sys.stderr,logging_interval=100.0,trace=False,top=10):
+    s.sim=sim
+    s.f=f
+    s.logging_interval=float(logging_interval)
+    s.top=top
+    s.history=[]
+    s.columns=None
+    if trace and not tracemalloc.is_tracing(): tracemalloc.start()
+
+  def loop(s):
+    '''
+    Main loop of Memory_Logger.
+    '''
+    while True:
+      report=s.sim.memory_report(top=s.top)
+      s.history.append((s.sim.env.now,report))
+      if s.columns is None:
+        s.columns=[k for k,v in report.items() if isinstance(v,int)]
+        s.f.write('t\t'+'\t'.join(s.columns)+'\n')
+      s.f.write(f'{s.sim.env.now:.1f}\t'+'\t'.join(str(report.get(k,0)) for k in s.columns)+'\n')
+      yield s.sim.env.timeout(s.logging_interval)
+
+# END class Memory_Logger
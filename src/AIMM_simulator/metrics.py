@@ -0,0 +1,227 @@
+# In-memory time-series store: fixed-size ring buffers of timestamped
+# samples, one per metric, each sample being a scalar (a global metric) or
+# an array over UEs or cells.  Queries over the last n samples or a time
+# window are vectorized over UEs and cells.  When UEs or cells are added
+# during a run, the buffers of the metrics over them are widened, and the
+# earlier samples of the new UEs or cells read as NaN (no report).
+
+import numpy as np
+
+def sample_UEs(sim):
+  '''
+  Return arrays over UEs of throughput (Mb/s), SINR (dB, mean over
+  subbands), RSRP reported to the serving cell (dBm), and serving cell
+  index, from the latest reports, with NaN where there is none.  This is
+  one pass over the UEs, shared by ``Metrics_store`` and ``Summary_Logger``.
+  '''
+  UEs=sim.UEs
+  tp=np.full(len(UEs),np.nan)
+  sinr=np.full(len(UEs),np.nan)
+  rsrp=np.full(len(UEs),np.nan)
+  serving=np.full(len(UEs),np.nan)
+  for ue in UEs:
+    cell=ue.serving_cell
+    if cell is None: continue
+    serving[ue.i]=cell.i
+    x=cell.get_UE_throughput(ue.i)
+    if np.isfinite(x): tp[ue.i]=x
+    if ue.get_SINR_dB() is not None: sinr[ue.i]=np.mean(ue.sinr_dB)
+    rep=cell.reports['rsrp'].get(ue.i)
+    if rep is not None: rsrp[ue.i]=rep[1]
+  return tp,sinr,rsrp,serving
+
+class Ring_buffer:
+  '''
+  A fixed-capacity buffer of timestamped samples, each an array of shape ``shape``; when full, each new sample overwrites the oldest.
+  '''
+
+  def __init__(s,capacity,shape=(),dtype=float):
+    s.capacity=capacity
+    s.times=np.full(capacity,np.nan)
+    s.values=np.full((capacity,)+tuple(shape),np.nan,dtype=dtype)
+    s.n=0 # total number of samples ever appended
+
+  def append(s,t,value):
+    k=s.n%s.capacity
+    s.times[k]=t
+    s.values[k]=value
+    s.n+=1
+
+  def widen(s,n):
+    '''
+    Extend the first axis of the sample shape to n, filling the earlier samples of the new entries with NaN.
+    '''
+    values=s.values
+    if values.ndim<2 or n<=values.shape[1]: return
+    s.values=np.full((values.shape[0],n)+values.shape[2:],np.nan,dtype=values.dtype)
+    s.values[:,:values.shape[1]]=values
+
+  def __len__(s):
+    return min(s.n,s.capacity)
+
+  def last(s,n=None):
+    '''
+    Return (times,values) of the last n samples (default all held), oldest first.
+    '''
+    m=len(s) if n is None else min(n,len(s))
+    idx=np.arange(s.n-m,s.n)%s.capacity
+    return s.times[idx],s.values[idx]
+
+  def since(s,t0):
+    '''
+    Return (times,values) of the samples with time >= t0, oldest first.
+    '''
+    times,values=s.last()
+    k=np.searchsorted(times,t0)
+    return times[k:],values[k:]
+
+# END class Ring_buffer
+
+class Metrics_store:
+  '''
+  A store of recent values of named metrics, shared by the RIC, loggers
+  and user code, and attached to a Sim by ``sim.add_metrics(store)``, after
+  which it is ``sim.metrics``.  Each metric keeps its last ``capacity``
+  samples with their times, in a ``Ring_buffer``.  Every ``interval`` the
+  store samples each of its metrics by calling its function; other values
+  can be recorded at any time with ``record``.  Built-in metrics, sampled
+  unless ``metrics`` is given as a list of the ones required, are:
+
+  ``UE_throughput_Mbps``, ``UE_sinr_dB`` (mean over subbands), ``UE_rsrp_dBm`` (reported to the serving cell) and ``UE_serving_cell``: arrays over UEs, NaN where there is no report;
+
+  ``cell_n_attached`` and ``cell_throughput_Mbps`` (total over attached UEs): arrays over cells;
+
+  ``average_throughput_Mbps``: mean throughput over all UEs with reports.
+
+  Parameters
+  ----------
+  sim : Sim
+    The Sim instance which will manage this store.
+  interval : float
+    Time interval between samples.
+  capacity : int
+    Number of samples kept for each metric.
+  metrics : list of str
+    Built-in metrics to sample; default all.
+  '''
+
+  builtin=('UE_throughput_Mbps','UE_sinr_dB','UE_rsrp_dBm','UE_serving_cell','cell_n_attached','cell_throughput_Mbps','average_throughput_Mbps')
+
+  def __init__(s,sim,interval=1.0,capacity=1024,metrics=None):
+    s.sim=sim
+    s.interval=interval
+    s.capacity=capacity
+    s.buffers={}
+    s.funcs={}
+    for name in (Metrics_store.builtin if metrics is None else metrics):
+      if name not in Metrics_store.builtin:
+        raise ValueError(f'Metrics_store: unknown built-in metric {name}')
+      s.funcs[name]=None
+
+  def add(s,name,func):
+    '''
+    Add a metric sampled every interval as ``func(sim)``, which must return a scalar or an array of fixed shape.
+    '''
+    s.funcs[name]=func
+
+  def record(s,name,value,t=None):
+    '''
+    Record a value of a metric at time t (default now).  The buffer is created on first use, with the shape of value.  If value is an array longer (in its first axis) than earlier ones, as it is for the metrics over UEs or cells when some are added, the buffer is widened, with NaN for the earlier samples of the new entries.
+    '''
+    if name not in s.buffers:
+      s.buffers[name]=Ring_buffer(s.capacity,np.shape(value))
+    buffer=s.buffers[name]
+    shape=np.shape(value)
+    if len(shape)>0 and shape[1:]==buffer.values.shape[2:]: buffer.widen(shape[0])
+    buffer.append(s.sim.env.now if t is None else t,value)
+
+  def sample(s):
+    '''
+    Record one sample of every metric; called every interval by ``loop``.
+    '''
+    now=s.sim.env.now
+    builtin=[name for name,func in s.funcs.items() if func is None]
+    if builtin:
+      tp,sinr,rsrp,serving=sample_UEs(s.sim)
+      ncells=len(s.sim.cells)
+      attached=~np.isnan(serving)
+      srv=serving[attached].astype(int)
+      values={'UE_throughput_Mbps': tp,
+              'UE_sinr_dB': sinr,
+              'UE_rsrp_dBm': rsrp,
+              'UE_serving_cell': serving,
+              'cell_n_attached': np.bincount(srv,minlength=ncells).astype(float),
+              'cell_throughput_Mbps': np.bincount(srv,weights=np.nan_to_num(tp[attached]),minlength=ncells),
+              'average_throughput_Mbps': np.nanmean(tp) if np.any(np.isfinite(tp)) else np.nan}
+      for name in builtin: s.record(name,values[name],now)
+    for name,func in s.funcs.items():
+      if func is not None: s.record(name,func(s.sim),now)
+
+  def loop(s):
+    '''
+    Main loop of Metrics_store.
+    '''
+    while True:
+      s.sample()
+      yield s.sim.env.timeout(s.interval)
+
+  def last(s,name,n=None):
+    '''
+    Return (times,values) of the last n samples of a metric (default all held), oldest first; values has shape (n,)+shape of one sample.
+    '''
+    return s.buffers[name].last(n)
+
+  def window(s,name,duration):
+    '''
+    Return (times,values) of the samples of a metric in the last ``duration`` of simulation time.
+    '''
+    return s.buffers[name].since(s.sim.env.now-duration)
+
+  def mean(s,name,duration):
+    '''
+    Return the mean of a metric over the last ``duration``, for each UE or cell, ignoring NaNs.
+    '''
+    times,values=s.window(name,duration)
+    if len(times)==0: return np.full(values.shape[1:],np.nan)
+    count=np.sum(~np.isnan(values),axis=0)
+    return np.where(count>0,np.nansum(values,axis=0)/np.maximum(count,1),np.nan)
+
+  def ema(s,name,tau):
+    '''
+    Return the exponentially-weighted moving average of a metric at the current time, with time constant ``tau`` (sample weights exp(-age/tau)), for each UE or cell, ignoring NaNs.
+    '''
+    times,values=s.last(name)
+    w=np.exp(-(s.sim.env.now-times)/tau).reshape((-1,)+(1,)*(values.ndim-1))
+    w=np.where(np.isnan(values),0.0,w)
+    total=np.sum(w,axis=0)
+    return np.where(total>0,np.sum(w*np.nan_to_num(values),axis=0)/np.where(total>0,total,1.0),np.nan)
+
+  def rate(s,name,duration):
+    '''
+    Return the rate of change per unit time of a metric over the last ``duration`` (least-squares slope), for each UE or cell; NaN where there are fewer than two valid samples.
+    '''
+    times,values=s.window(name,duration)
+    t=np.broadcast_to(times.reshape((-1,)+(1,)*(values.ndim-1)),values.shape)
+    ok=~np.isnan(values)
+    n=np.sum(ok,axis=0)
+    tm=np.sum(np.where(ok,t,0.0),axis=0)/np.maximum(n,1)
+    vm=np.sum(np.where(ok,values,0.0),axis=0)/np.maximum(n,1)
+    dt=np.where(ok,t-tm,0.0)
+    stt=np.sum(dt*dt,axis=0)
+    stv=np.sum(dt*np.where(ok,values-vm,0.0),axis=0)
+    return np.where((n>1)&(stt>0),stv/np.where(stt>0,stt,1.0),np.nan)
+
+  def __contains__(s,name):
+    return name in s.buffers
+
+  def names(s):
+    ''' Return the names of all metrics recorded so far. '''
+    return list(s.buffers)
+
+  def checkpoint(s):
+    return s.buffers
+
+  def restore(s,state):
+    s.buffers=state
+
+# END class Metrics_store
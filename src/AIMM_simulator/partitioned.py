@@ -0,0 +1,252 @@
+# Spatial domain decomposition: a large deployment split into rectangular
+# tiles, each simulated by its own Sim in its own worker process, with halo
+# cell state exchanged and UEs migrated between workers at every tick.
+
+from sys import stderr
+from collections import deque
+from multiprocessing import Process,Pipe
+import numpy as np
+import simpy
+from .AIMM_simulator import Sim,MME,Scenario
+
+def _interruptible(gen):
+  # internal use only - run a loop generator until its process is interrupted
+  try:
+    yield from gen
+  except simpy.Interrupt:
+    return
+
+def _UE_states(sim,tile):
+  # internal use only - gather function returning the state of all UEs in a tile
+  ues=[sim.UEs[i] for i in tile['UE_gids']]
+  gids=np.array(list(tile['UE_gids'].values()),dtype=int)
+  xyz=np.array([ue.xyz for ue in ues]).reshape(-1,3)
+  serving=np.array([tile['cell_gids'][ue.serving_cell.i] for ue in ues],dtype=int)
+  tp=np.array([ue.serving_cell.get_UE_throughput(ue.i) for ue in ues],dtype=float)
+  return gids,xyz,serving,tp
+
+def _tile_worker(conn,index,cells,owned,ghosts,exported,ues,ue_kwargs,sim_kwargs,mme_kwargs,mobility,mobility_interval,build_fn):
+  # internal use only - main function of a worker process simulating one tile
+  sim=Sim(show_params=False,**sim_kwargs)
+  local={} # global cell index -> local Cell
+  for g in owned+ghosts:
+    kwargs=dict(cells[g])
+    if g in ghosts: kwargs['f_callback']=None # ghosts only radiate
+    local[g]=sim.make_cell(**kwargs)
+  tile={'index': index,
+        'cell_gids': list(owned+ghosts), # local cell index -> global index
+        'ghosts': set(local[g].i for g in ghosts),
+        'UE_gids': {}} # local UE index -> global index, for active UEs only
+  if mme_kwargs is not None: sim.add_MME(MME(sim,**mme_kwargs))
+  if mobility is not None: sim.add_scenario(Scenario(sim,func=mobility,interval=mobility_interval))
+  if build_fn is not None: build_fn(sim,tile)
+  sim._set_hetnet()
+  sim._start_loops() # no UEs yet; their loops are started as they arrive
+  free,processes=[],{}
+  def translate(history,table,default=-1):
+    return deque(((table.get(c,default) if c>=0 else -1,t) for c,t in history),maxlen=10)
+  def add_UE(gid,xyz,cell_gid,history):
+    if free:
+      ue=sim.UEs[free.pop()]
+      ue.set_xyz(xyz)
+    else:
+      ue=sim.make_UE(xyz=xyz,**ue_kwargs)
+    tile['UE_gids'][ue.i]=gid
+    if cell_gid is None: # initial attachment
+      ue.attach_to_strongest_cell_simple_pathloss_model()
+    else: # arriving by handover, already recorded in history
+      cell=local[cell_gid]
+      cell.attached.add(ue.i)
+      ue.serving_cell=cell
+      ue.serving_cell_ids=translate(history,{g: c.i for g,c in local.items()})
+    processes[ue.i]=sim.env.process(_interruptible(ue.loop()))
+  def emigrants():
+    out=[]
+    for i in list(tile['UE_gids']):
+      ue=sim.UEs[i]
+      if ue.serving_cell.i not in tile['ghosts']: continue
+      history=translate(ue.serving_cell_ids,dict(enumerate(tile['cell_gids'])))
+      out.append((tile['UE_gids'].pop(i),ue.xyz.copy(),tile['cell_gids'][ue.serving_cell.i],list(history)))
+      ue.detach()
+      if i in processes: processes.pop(i).interrupt()
+      free.append(i)
+    return out
+  for gid,xyz in ues: add_UE(gid,xyz,None,None)
+  conn.send(emigrants())
+  while True:
+    msg=conn.recv()
+    if msg[0]=='step':
+      _,t_end,halo,incoming=msg
+      for g,(power_dBm,MIMO_gain_dB,subband_mask) in halo.items():
+        cell=local[g]
+        cell.power_dBm,cell.MIMO_gain_dB,cell.subband_mask=power_dBm,MIMO_gain_dB,subband_mask
+      if halo: sim._set_hetnet()
+      for gid,xyz,cell_gid,history in incoming: add_UE(gid,xyz,cell_gid,history)
+      sim.env.run(until=t_end)
+      halo_out={g: (local[g].power_dBm,local[g].MIMO_gain_dB,np.array(local[g].subband_mask)) for g in exported}
+      conn.send((emigrants(),halo_out))
+    elif msg[0]=='gather':
+      conn.send(msg[1](sim,tile))
+    elif msg[0]=='finish':
+      if sim.mme is not None: sim.mme.finalize()
+      if sim.ric is not None: sim.ric.finalize()
+      for logger in sim.loggers: logger.finalize()
+      conn.send(sim.kpis)
+      break
+  conn.close()
+
+class Partitioned_Sim:
+  '''
+  A large deployment split into a grid of rectangular tiles, each simulated
+  by an ordinary ``Sim`` in its own worker process.  Each cell belongs to
+  the tile containing it, and each worker also holds "ghost" copies of the
+  cells of other tiles within ``halo`` metres of its tile, so that the UEs
+  it simulates see interference from neighbouring tiles.  A UE belongs to
+  the worker which owns its serving cell, so that every attachment is local
+  and throughput sharing is exact; when the MME hands a UE over to a ghost
+  cell (typically because it has crossed a tile boundary) the UE migrates
+  to the worker owning that cell.  At every tick of length
+  ``sync_interval``, each worker advances its Sim, the power, MIMO gain and
+  subband mask of every cell in a halo are sent to the workers holding its
+  ghosts, and migrating UEs are delivered.  The transport is a
+  ``multiprocessing`` pipe to each worker, so this is intended for one
+  large machine.  The main program must be protected by
+  ``if __name__=='__main__':``.
+
+  Parameters
+  ----------
+  cells : list of dict
+    Keyword arguments for ``Sim.make_cell`` for each cell; each must include ``xyz``.  They must be picklable.
+  ue_xyz : array of shape (nues,3)
+    Initial UE positions.  UEs initially attach to the strongest cell (simple pathloss model) known to the tile containing them.
+  tiles : (int,int)
+    Number of tiles in x and y; there is one worker process per tile.
+  halo : float
+    Distance in metres beyond each tile within which other tiles' cells are ghosted.
+  sync_interval : float
+    Simulation time between halo exchanges and UE migrations.
+  ue_kwargs : dict
+    Keyword arguments for ``Sim.make_UE``, common to all UEs.
+  params : dict
+    ``params`` for each worker's Sim.
+  rng_seed : int
+    Worker k uses rng_seed+k.
+  mme_kwargs : dict
+    Keyword arguments for each worker's ``MME``, or ``None`` for no MME.
+  mobility : function
+    If not ``None``, ``mobility(sim)`` is called every ``mobility_interval`` in each worker, and should move all of ``sim.UEs``.
+  mobility_interval : float
+    Time interval between calls of mobility.
+  build_fn : function
+    If not ``None``, ``build_fn(sim,tile)`` is called in each worker after its cells and MME are made, for example to add loggers or a RIC.  ``tile`` is a dictionary with keys ``index``, ``cell_gids`` (global index of each local cell), ``ghosts`` (local indices of ghost cells) and ``UE_gids`` (local UE index -> global UE index, for UEs currently in the tile).
+  All functions must be picklable, so defined at the top level of a module.
+  '''
+
+  def __init__(s,cells,ue_xyz,tiles=(2,2),halo=1000.0,sync_interval=1.0,ue_kwargs={},params=None,rng_seed=0,mme_kwargs={'interval': 10.0},mobility=None,mobility_interval=1.0,build_fn=None,verbosity=0):
+    s.cells=cells
+    s.sync_interval=sync_interval
+    s.verbosity=verbosity
+    s.now=0.0
+    xyz=np.array([cell['xyz'] for cell in cells],dtype=float)
+    ue_xyz=np.asarray(ue_xyz,dtype=float)
+    nx,ny=tiles
+    s.ntiles=nx*ny
+    lo,hi=np.min(xyz[:,:2],axis=0),np.max(xyz[:,:2],axis=0)
+    s.tile_size=np.maximum((hi-lo)/(nx,ny),1e-9)
+    s.origin=lo
+    s.tiles=(nx,ny)
+    cell_tile=s.tile_of(xyz)
+    s.owner=cell_tile # owning tile of each cell
+    owned=[list(np.flatnonzero(cell_tile==k)) for k in range(s.ntiles)]
+    ghosts=[]
+    for k in range(s.ntiles):
+      tlo=lo+s.tile_size*(k%nx,k//nx)
+      thi=tlo+s.tile_size
+      # distance from each cell to the tile rectangle...
+      d=np.linalg.norm(np.maximum(0.0,np.maximum(tlo-xyz[:,:2],xyz[:,:2]-thi)),axis=1)
+      ghosts.append([g for g in np.flatnonzero(d<=halo) if cell_tile[g]!=k])
+    # ghosted_by[g] is the list of tiles holding a ghost of cell g
+    s.ghosted_by={}
+    for k in range(s.ntiles):
+      for g in ghosts[k]: s.ghosted_by.setdefault(g,[]).append(k)
+    ue_tile=s.tile_of(ue_xyz)
+    sim_kwargs={'params': dict(params) if params is not None else {'fc_GHz':3.5,'h_UT':2.0,'h_BS':20.0},'quiet': verbosity<1}
+    s.connections,s.workers=[],[]
+    for k in range(s.ntiles):
+      exported=[g for g in owned[k] if g in s.ghosted_by]
+      ues=[(gid,ue_xyz[gid]) for gid in np.flatnonzero(ue_tile==k)]
+      parent,child=Pipe()
+      worker=Process(target=_tile_worker,args=(child,k,cells,owned[k],ghosts[k],exported,ues,ue_kwargs,dict(sim_kwargs,rng_seed=rng_seed+k),mme_kwargs,mobility,mobility_interval,build_fn),daemon=True)
+      worker.start()
+      s.connections.append(parent)
+      s.workers.append(worker)
+      if verbosity>0:
+        print(f'Partitioned_Sim: tile {k} owns {len(owned[k])} cells, ghosts {len(ghosts[k])}, starts with {len(ues)} UEs.',file=stderr)
+    s.incoming=[[] for k in range(s.ntiles)]
+    s.halo=[{} for k in range(s.ntiles)]
+    s.n_migrations=0
+    for conn in s.connections: s._route(conn.recv())
+
+  def tile_of(s,xyz):
+    '''
+    Return the index of the tile containing each point of xyz (shape (n,2) or (n,3)); points outside the grid belong to the nearest tile.
+    '''
+    nx,ny=s.tiles
+    ij=np.floor((np.asarray(xyz)[:,:2]-s.origin)/s.tile_size).astype(int)
+    return np.clip(ij[:,0],0,nx-1)+nx*np.clip(ij[:,1],0,ny-1)
+
+  def _route(s,emigrants):
+    # internal use only - deliver migrating UEs to the owners of their new serving cells
+    for gid,xyz,cell_gid,history in emigrants:
+      s.incoming[s.owner[cell_gid]].append((gid,xyz,cell_gid,history))
+      s.n_migrations+=1
+
+  def run(s,until):
+    '''
+    Advance all tiles to simulation time ``until``, exchanging halo cell state and migrating UEs every ``sync_interval``.  May be called repeatedly to continue.
+    '''
+    while s.now<until:
+      t_end=min(until,s.now+s.sync_interval)
+      for k,conn in enumerate(s.connections):
+        conn.send(('step',t_end,s.halo[k],s.incoming[k]))
+      s.incoming=[[] for k in range(s.ntiles)]
+      s.halo=[{} for k in range(s.ntiles)]
+      for conn in s.connections:
+        emigrants,halo_out=conn.recv()
+        s._route(emigrants)
+        for g,state in halo_out.items():
+          for k in s.ghosted_by[g]: s.halo[k][g]=state
+      s.now=t_end
+
+  def gather(s,func):
+    '''
+    Call ``func(sim,tile)`` in every worker, and return the list of results, one per tile.  See the class documentation for ``tile``.  func and its results must be picklable.
+    '''
+    for conn in s.connections: conn.send(('gather',func))
+    return [conn.recv() for conn in s.connections]
+
+  def get_UE_states(s):
+    '''
+    Return (xyz,serving,throughput_Mbps) for all UEs, indexed by global UE index: positions of shape (nues,3), global serving cell indices, and current throughputs.  UEs in transit between tiles are not included, and have serving cell -1.
+    '''
+    parts=s.gather(_UE_states)
+    n=1+max((int(p[0].max()) for p in parts if len(p[0])),default=-1)
+    xyz=np.full((n,3),np.nan)
+    serving=np.full(n,-1)
+    tp=np.full(n,np.nan)
+    for gids,x,srv,t in parts:
+      xyz[gids],serving[gids],tp[gids]=x,srv,t
+    return xyz,serving,tp
+
+  def finalize(s):
+    '''
+    Finalize every worker's Sim (MME, RIC and loggers), stop the workers, and return the list of their ``sim.kpis``.
+    '''
+    for conn in s.connections: conn.send(('finish',))
+    kpis=[conn.recv() for conn in s.connections]
+    for worker in s.workers: worker.join()
+    if s.verbosity>0:
+      print(f'Partitioned_Sim: finished at t={s.now:.2f} after {s.n_migrations} UE migrations.',file=stderr)
+    return kpis
+
+# END class Partitioned_Sim
@@ -0,0 +1,248 @@
+# Low-overhead profiling by subsystem: wall-clock time spent in each kind
+# of main loop (UE, cell, MME, RIC, logger, scenario, metrics) and in user
+# callbacks, either measured around every loop resumption (Loop_timer) or
+# estimated by sampling the main thread's stack (Stack_sampler).  Sim.run
+# uses these when params['profile'] is set.  Chrome_tracer records each
+# loop resumption as an event in the Chrome trace-event JSON format, for
+# viewing in chrome://tracing or Perfetto; Sim.run uses it when
+# params['trace'] is set.
+
+import json
+import sys
+from threading import Thread,Event,main_thread
+from time import perf_counter
+from collections import Counter
+
+def _table(rows,total,title,count='calls'):
+  # internal use only - format summary rows as a text table
+  lines=[title,f'{"subsystem":<16}{count:>10}{"seconds":>11}{"mean us":>10}{"max us":>10}{"% run":>8}']
+  for name,r in rows.items():
+    mean=f'{1e6*r["seconds"]/r["calls"]:.1f}' if 'calls' in r else '-'
+    mx=f'{1e6*r["max"]:.1f}' if 'max' in r else '-'
+    pct=100.0*r['seconds']/total if total>0 else 0.0
+    lines.append(f'{name:<16}{r[count]:>10}{r["seconds"]:>11.3f}{mean:>10}{mx:>10}{pct:>8.1f}')
+  return '\n'.join(lines)
+
+class Loop_timer:
+  '''
+  Accumulate the wall-clock time of every resumption of every main loop,
+  by kind (``UE``, ``cell``, ``mme``, ``ric``, ``logger``, ``scenario``,
+  ``metrics``), using ``sim.add_loop_observer``; and the time spent in the
+  ``f_callback`` functions of UEs and cells, which is part of the time of
+  their loops.  If ``per_key`` is true, times are also kept for each
+  individual loop (for example each logger).  Must be created before the
+  run starts.
+  '''
+
+  def __init__(s,sim,per_key=False):
+    s.sim=sim
+    s.per_key=per_key
+    s.calls=Counter()
+    s.seconds=Counter()
+    s.max={}
+    sim.add_loop_observer(s)
+    for objects,name in ((sim.UEs,'UE.f_callback'),(sim.cells,'cell.f_callback')):
+      for x in objects:
+        if x.f_callback is not None: x.f_callback=s._timed(x.f_callback,name)
+
+  def _timed(s,func,name):
+    # internal use only - wrap func so that the time spent in it is recorded
+    def timed(*args,**kwargs):
+      t0=perf_counter()
+      try:
+        return func(*args,**kwargs)
+      finally:
+        s._record(name,perf_counter()-t0)
+    return timed
+
+  def _record(s,name,dt):
+    # internal use only
+    s.calls[name]+=1
+    s.seconds[name]+=dt
+    if dt>s.max.get(name,0.0): s.max[name]=dt
+
+  def __call__(s,key,t0,t1,now):
+    s._record(key[0],t1-t0)
+    if s.per_key and len(key)>1: s._record(f'{key[0]}[{key[1]}]',t1-t0)
+
+  def start(s): pass
+
+  def stop(s): pass
+
+  def summary(s):
+    '''
+    Return a dictionary mapping each subsystem to its ``calls``, total ``seconds`` and ``max`` seconds, in decreasing order of total time.
+    '''
+    names=sorted(s.seconds,key=s.seconds.get,reverse=True)
+    return {name: {'calls': s.calls[name],'seconds': s.seconds[name],'max': s.max[name]} for name in names}
+
+  def table(s):
+    ''' Return the summary as a text table. '''
+    return _table(s.summary(),s.sim.stats()['wall_time'],'Loop_timer: wall-clock time by subsystem (f_callback times are included in UE and cell)')
+
+# END class Loop_timer
+
+class Stack_sampler:
+  '''
+  Estimate where the time goes by sampling the stack of the main thread
+  every ``interval`` seconds from a background thread, with no overhead
+  in the simulation itself.  Each sample is attributed to the innermost
+  main loop on the stack (by kind, as for ``Loop_timer``, or ``simpy``
+  for the scheduler itself), and its innermost function is counted, to
+  find hot spots.  Sampling is started and stopped by ``start`` and ``stop``.
+  '''
+
+  def __init__(s,sim,interval=0.001,top=20):
+    s.sim=sim
+    s.interval=interval
+    s.top=top
+    s.samples=Counter()
+    s.functions=Counter()
+    s.n=0
+    s._stop=Event()
+    s._thread=None
+    s._t0=s._elapsed=0.0
+
+  def _owners(s):
+    # internal use only - map each loop owner to its kind
+    return {id(owner): key[0] for key,owner in s.sim._loop_owners()}
+
+  def _run(s):
+    # internal use only - main function of the sampling thread
+    owners=s._owners()
+    ident=main_thread().ident
+    while not s._stop.wait(s.interval):
+      frame=sys._current_frames().get(ident)
+      if frame is None: continue
+      code=frame.f_code
+      s.functions[f'{code.co_name} ({code.co_filename.rsplit("/",1)[-1]}:{code.co_firstlineno})']+=1
+      kind='simpy'
+      while frame is not None:
+        if frame.f_code.co_name=='loop':
+          owner=frame.f_locals.get('s',frame.f_locals.get('self'))
+          if id(owner) in owners:
+            kind=owners[id(owner)]
+            break
+        frame=frame.f_back
+      s.samples[kind]+=1
+      s.n+=1
+
+  def start(s):
+    s._stop.clear()
+    s._t0=perf_counter()
+    s._thread=Thread(target=s._run,name='Stack_sampler',daemon=True)
+    s._thread.start()
+
+  def stop(s):
+    s._stop.set()
+    s._thread.join()
+    s._elapsed+=perf_counter()-s._t0
+
+  def summary(s):
+    '''
+    Return a dictionary mapping each subsystem to its number of ``samples`` and estimated ``seconds``, in decreasing order, and the most frequently sampled functions under the key ``functions``.
+    '''
+    scale=s._elapsed/s.n if s.n else 0.0
+    out={kind: {'samples': n,'seconds': n*scale} for kind,n in s.samples.most_common()}
+    out['functions']={name: {'samples': n,'seconds': n*scale} for name,n in s.functions.most_common(s.top)}
+    return out
+
+  def table(s):
+    ''' Return the summary as a text table. '''
+    summary=s.summary()
+    functions=summary.pop('functions')
+    lines=[_table(summary,s._elapsed,f'Stack_sampler: estimated wall-clock time by subsystem ({s.n} samples)','samples'),'hottest functions:']
+    for name,r in functions.items():
+      lines.append(f'  {r["samples"]:>8} {100.0*r["samples"]/max(s.n,1):6.1f}%  {name}')
+    return '\n'.join(lines)
+
+# END class Stack_sampler
+
+class Chrome_tracer:
+  '''
+  Record the wall-clock begin and end time, and the simulation time, of
+  resumptions of the main loops of UEs, cells, the MME, RIC, loggers,
+  scenario and metrics store, using ``sim.add_loop_observer``, and write
+  them with ``write`` as a Chrome trace-event JSON file, which can be
+  opened in chrome://tracing or https://ui.perfetto.dev.  Each event is
+  named by its loop (for example ``UE[3]`` or ``ric``), with the
+  simulation time as an argument; each kind of loop has its own track,
+  or each loop if ``per_loop_tracks`` is true.  To bound the overhead and
+  file size, events can be filtered and sampled.  Must be created before
+  the run starts.
+
+  Parameters
+  ----------
+  sim : Sim
+    The Sim instance to trace.
+  kinds : iterable of str
+    Kinds of loop to record (for example ``('ric','logger')``); default all.
+  sample_every : int
+    Record only every ``sample_every``-th resumption of each kind of loop.
+  min_duration : float
+    Record only resumptions taking at least this many wall-clock seconds.
+  max_events : int
+    Stop recording after this many events.
+  per_loop_tracks : bool
+    Whether to give each loop its own track.
+  '''
+
+  def __init__(s,sim,kinds=None,sample_every=1,min_duration=0.0,max_events=1000000,per_loop_tracks=False):
+    s.sim=sim
+    s.kinds=None if kinds is None else set(kinds)
+    s.sample_every=max(1,int(sample_every))
+    s.min_duration=min_duration
+    s.max_events=max_events
+    s.per_loop_tracks=per_loop_tracks
+    s.events=[] # (key,wall_begin,wall_end,sim_time)
+    s.seen=Counter() # resumptions of each kind, recorded or not
+    s.n_dropped=0 # events not recorded because max_events was reached
+    s.t0=perf_counter()
+    sim.add_loop_observer(s)
+
+  def __call__(s,key,t0,t1,now):
+    kind=key[0]
+    if s.kinds is not None and kind not in s.kinds: return
+    s.seen[kind]+=1
+    if (s.seen[kind]-1)%s.sample_every or t1-t0<s.min_duration: return
+    if len(s.events)>=s.max_events:
+      s.n_dropped+=1
+      return
+    s.events.append((key,t0,t1,now))
+
+  def start(s): pass
+
+  def stop(s): pass
+
+  def trace_events(s):
+    '''
+    Return the recorded events as a list of Chrome trace-event dictionaries, with track names as metadata events.
+    '''
+    tracks={}
+    events=[]
+    for key,t0,t1,now in s.events:
+      name=key[0] if len(key)==1 else f'{key[0]}[{key[1]}]'
+      track=name if s.per_loop_tracks else key[0]
+      tid=tracks.setdefault(track,len(tracks)+1)
+      events.append({'name': name,'cat': key[0],'ph': 'X','pid': 1,'tid': tid,
+                     'ts': 1e6*(t0-s.t0),'dur': 1e6*(t1-t0),'args': {'sim_time': float(now)}})
+    events+=[{'name': 'thread_name','ph': 'M','pid': 1,'tid': tid,'args': {'name': track}} for track,tid in tracks.items()]
+    events.append({'name': 'process_name','ph': 'M','pid': 1,'args': {'name': 'AIMM_simulator'}})
+    return events
+
+  def write(s,fn):
+    '''
+    Write the trace to the file ``fn``.
+    '''
+    with open(fn,'w') as f:
+      json.dump({'traceEvents': s.trace_events(),'displayTimeUnit': 'ms',
+                 'otherData': {'sample_every': s.sample_every,'min_duration': s.min_duration,'dropped': s.n_dropped}},f)
+
+# END class Chrome_tracer
+
+def write_profile(profiler,fn):
+  '''
+  Write the summary of a ``Loop_timer`` or ``Stack_sampler``, and ``sim.stats()``, to the file ``fn`` as JSON.
+  '''
+  with open(fn,'w') as f:
+    json.dump({'profiler': type(profiler).__name__,'stats': profiler.sim.stats(),'summary': profiler.summary()},f,indent=1)
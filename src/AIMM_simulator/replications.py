@@ -0,0 +1,96 @@
+# Monte Carlo replications: run the same scenario with many seeds, in
+# parallel in a pool of worker processes.
+
+from os import getpid
+from time import perf_counter
+from math import sqrt
+from numbers import Real
+from functools import partial
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor,as_completed
+
+@dataclass
+class Replication_result:
+  ''' The outcome of one replication, as returned by ``run_replications``. '''
+  seed: int
+  kpis: dict
+  build_time: float # wall-clock seconds spent in build_fn
+  run_time: float   # wall-clock seconds spent in sim.run
+  pid: int          # worker process id
+
+def _build_and_run(build,until,kpi_fn):
+  # internal use only - build and run one Sim; executed in a worker process.
+  # build is a callable with no arguments returning a Sim.  Worker
+  # processes are reused, so warm interpreters run many Sims in turn.
+  t0=perf_counter()
+  sim=build()
+  t1=perf_counter()
+  sim.run(until=until)
+  t2=perf_counter()
+  kpis=sim.kpis if kpi_fn is None else kpi_fn(sim)
+  return kpis,t1-t0,t2-t1,getpid()
+
+def _run_replication(build_fn,seed,until,kpi_fn):
+  # internal use only
+  return Replication_result(seed,*_build_and_run(partial(build_fn,seed),until,kpi_fn))
+
+def run_replications(build_fn,seeds,until,workers=None,kpi_fn=None):
+  '''
+  Run one replication of a scenario for each seed, in a pool of worker
+  processes, and yield a ``Replication_result`` for each as soon as it
+  completes (so not necessarily in the order of seeds).
+
+  Parameters
+  ----------
+  build_fn : function
+    Factory ``build_fn(seed)`` returning a fully configured ``Sim``.  This
+    must be picklable, so it must be defined at the top level of a module.
+  seeds : iterable of int
+    One replication is run for each seed.
+  until : float
+    Simulation time for each replication.
+  workers : int
+    Number of worker processes; the default is the number of CPUs.  If 1,
+    the replications are run one after another in the calling process.
+  kpi_fn : function
+    If given, ``kpi_fn(sim)`` is called after the run to extract the KPIs.
+    Otherwise the KPIs are ``sim.kpis``, which user Logger, RIC or MME
+    objects can fill in from their ``finalize`` functions.  The KPIs must
+    be picklable.
+
+  Example
+  -------
+  ``for r in run_replications(build,range(100),until=1000): print(r.seed,r.kpis)``
+  '''
+  if workers==1:
+    for seed in seeds:
+      yield _run_replication(build_fn,seed,until,kpi_fn)
+    return
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    futures=[pool.submit(_run_replication,build_fn,seed,until,kpi_fn) for seed in seeds]
+    try:
+      for future in as_completed(futures):
+        yield future.result()
+    finally: # on error, or if the caller stops early, don't start any more
+      for future in futures: future.cancel()
+
+def replication_summary(results,z=1.96):
+  '''
+  Summarize the scalar numeric KPIs of a sequence of ``Replication_result``.
+  Return a dictionary mapping each KPI name to a dictionary with keys
+  ``n``, ``mean``, ``std`` (sample standard deviation), and ``ci`` (the
+  half-width of the normal-approximation confidence interval for the mean,
+  with z=1.96 giving 95%).
+  '''
+  values={}
+  for r in results:
+    for k,v in r.kpis.items():
+      if isinstance(v,Real) and not isinstance(v,bool):
+        values.setdefault(k,[]).append(float(v))
+  summary={}
+  for k,v in values.items():
+    n=len(v)
+    mean=sum(v)/n
+    std=sqrt(sum((x-mean)**2 for x in v)/(n-1)) if n>1 else 0.0
+    summary[k]={'n': n, 'mean': mean, 'std': std, 'ci': z*std/sqrt(n)}
+  return summary
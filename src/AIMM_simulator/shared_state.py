@@ -0,0 +1,210 @@
+# Live view of the simulation state in shared memory: a Logger publishes
+# UE positions, serving cells, SINR and throughput, and cell positions,
+# into a multiprocessing.shared_memory block every interval, and any number
+# of other processes (such as a plotter) attach with Shared_state_reader
+# and read any subset of the arrays whenever they like, with no
+# serialization.  A seqlock keeps reads consistent: the writer increments
+# a sequence number before and after each update, and a reader retries
+# if the number was odd (update in progress) or changed while it copied.
+# The simulation never waits for readers.
+
+import os
+import atexit
+import sys
+from multiprocessing import shared_memory
+import numpy as np
+from .AIMM_simulator import Logger
+from .metrics import sample_UEs
+
+_MAGIC=0x41494d4d53484d31 # 'AIMMSHM1'
+_HEADER=8 # uint64 slots: magic,seq,version,max_UEs,max_cells,n_UEs,t,updates
+
+def _layout(max_UEs,max_cells):
+  # internal use only - (name,shape,offset in bytes) of each array
+  fields=[('UE_xyz',(max_UEs,3)),('serving_cell',(max_UEs,)),('sinr_dB',(max_UEs,)),('throughput_Mbps',(max_UEs,)),('cell_xyz',(max_cells,3))]
+  layout,offset=[],8*_HEADER
+  for name,shape in fields:
+    layout.append((name,shape,offset))
+    offset+=8*int(np.prod(shape))
+  return layout,offset
+
+def _arrays(buf,layout):
+  # internal use only - float64 views of the arrays in buf
+  return {name: np.ndarray(shape,dtype=np.float64,buffer=buf,offset=offset) for name,shape,offset in layout}
+
+def _attach(name):
+  # internal use only - attach to the block name without registering it
+  # with the resource tracker, which would remove it when this process
+  # exits (before python 3.13, attaching registers it as if created here;
+  # unregistering afterwards is wrong if the tracker is shared with the
+  # creator, as it is with a child process of the creator)
+  if sys.version_info>=(3,13):
+    return shared_memory.SharedMemory(name=name,track=False)
+  from multiprocessing import resource_tracker
+  register=resource_tracker.register
+  resource_tracker.register=lambda name,rtype: None
+  try:
+    return shared_memory.SharedMemory(name=name)
+  finally:
+    resource_tracker.register=register
+
+class Shared_state_publisher(Logger):
+  '''
+  A Logger which publishes the state of the simulation every
+  ``logging_interval`` into a shared memory block called ``name``, for
+  ``Shared_state_reader``.  The arrays are ``UE_xyz``, ``serving_cell``,
+  ``sinr_dB`` (mean over subbands), ``throughput_Mbps`` (NaN where there is
+  no report) and ``cell_xyz``, all float64.  Space is allocated at the
+  first update for ``max_UEs`` UEs and ``max_cells`` cells (default the
+  numbers then present); any more are not published.  The block is
+  removed by ``finalize``, or at exit, but only in the process which
+  created it, so not in the children of ``Sim.fork`` (which do not
+  publish).  If a block called ``name`` already exists, perhaps
+  published by another running simulation, RuntimeError is raised,
+  unless ``replace`` is true, when it is removed and replaced.
+
+  Parameters
+  ----------
+  sim : Sim
+    The Sim instance which will manage this Logger.
+  name : str
+    Name of the shared memory block.
+  logging_interval : float
+    Time interval between updates.
+  max_UEs : int
+    Number of UEs for which space is allocated.
+  max_cells : int
+    Number of cells for which space is allocated.
+  replace : bool
+    Whether to replace an existing block called ``name``.
+  '''
+
+  def __init__(s,sim,name='AIMM_simulator',logging_interval=1.0,max_UEs=None,max_cells=None,replace=False):
+    s.sim=sim
+    s.name=name
+    s.logging_interval=float(logging_interval)
+    s.max_UEs=max_UEs
+    s.max_cells=max_cells
+    s.replace=replace
+    s.shm=None
+    s.pid=None # of the process which created the block
+    s.enabled=True
+    s.f=None
+
+  def _create(s):
+    # internal use only - create the block and write the header
+    if s.max_UEs is None: s.max_UEs=max(1,len(s.sim.UEs))
+    if s.max_cells is None: s.max_cells=max(1,len(s.sim.cells))
+    s.layout,size=_layout(s.max_UEs,s.max_cells)
+    try:
+      s.shm=shared_memory.SharedMemory(name=s.name,create=True,size=size)
+    except FileExistsError:
+      if not s.replace:
+        raise RuntimeError(f'Shared_state_publisher: shared memory block {s.name} already exists, and may belong to a running simulation; use another name, or replace=True to remove it') from None
+      old=shared_memory.SharedMemory(name=s.name) # registered, as unlink unregisters it
+      old.close()
+      old.unlink()
+      s.shm=shared_memory.SharedMemory(name=s.name,create=True,size=size)
+    s.pid=os.getpid()
+    atexit.register(s.finalize)
+    s.header=np.ndarray(_HEADER,dtype=np.uint64,buffer=s.shm.buf)
+    s.t=np.ndarray(1,dtype=np.float64,buffer=s.shm.buf,offset=8*6)
+    s.arrays=_arrays(s.shm.buf,s.layout)
+    for a in s.arrays.values(): a[...]=np.nan
+    s.header[1:]=(0,1,s.max_UEs,s.max_cells,0,0,0)
+    s.header[0]=_MAGIC # last, so that readers see a complete header
+    if len(s.sim.UEs)>s.max_UEs or len(s.sim.cells)>s.max_cells:
+      print(f'Shared_state_publisher: only the first {s.max_UEs} UEs and {s.max_cells} cells are published.',file=sys.stderr)
+
+  def publish(s):
+    '''
+    Update the shared state now; called every interval by ``loop``.
+    '''
+    if not s.enabled: return
+    if s.shm is None: s._create()
+    tp,sinr,rsrp,serving=sample_UEs(s.sim)
+    n,m=min(len(tp),s.max_UEs),min(len(s.sim.cells),s.max_cells)
+    a=s.arrays
+    s.header[1]+=1 # odd: update in progress
+    a['UE_xyz'][:n]=s.sim.UE_locations[:n]
+    a['serving_cell'][:n]=serving[:n]
+    a['sinr_dB'][:n]=sinr[:n]
+    a['throughput_Mbps'][:n]=tp[:n]
+    a['cell_xyz'][:m]=[cell.xyz for cell in s.sim.cells[:m]]
+    s.header[5]=n
+    s.t[0]=s.sim.env.now
+    s.header[7]+=1
+    s.header[1]+=1 # even: consistent
+
+  def loop(s):
+    '''
+    Main loop of Shared_state_publisher.
+    '''
+    while True:
+      s.publish()
+      yield s.sim.env.timeout(s.logging_interval)
+
+  def finalize(s):
+    '''
+    Remove the shared memory block, if this process created it.
+    '''
+    if s.shm is None: return
+    s.header=s.t=s.arrays=None # release the views before closing
+    s.shm.close()
+    if os.getpid()==s.pid:
+      try:
+        s.shm.unlink()
+      except FileNotFoundError:
+        pass
+    s.shm=None
+
+  def _fork_child(s):
+    # internal use only - a Sim.fork child must not publish its branch
+    # into the parent's block
+    s.enabled=False
+
+# END class Shared_state_publisher
+
+class Shared_state_reader:
+  '''
+  Attach to the shared memory block ``name`` written by a
+  ``Shared_state_publisher``, typically in another process.  ``read``
+  returns a consistent copy of any subset of the arrays.
+  '''
+
+  def __init__(s,name='AIMM_simulator'):
+    s.shm=_attach(name)
+    s.header=np.ndarray(_HEADER,dtype=np.uint64,buffer=s.shm.buf)
+    if s.header[0]!=_MAGIC:
+      s.close()
+      raise RuntimeError(f'Shared_state_reader: {name} is not ready, or was not written by Shared_state_publisher')
+    s.t=np.ndarray(1,dtype=np.float64,buffer=s.shm.buf,offset=8*6)
+    s.layout,size=_layout(int(s.header[3]),int(s.header[4]))
+    s.arrays=_arrays(s.shm.buf,s.layout)
+    s.fields=[name for name,shape,offset in s.layout]
+
+  def read(s,fields=None,retries=1000):
+    '''
+    Return a dictionary with copies of the arrays named in ``fields``
+    (default all), for the UEs published, and the simulation time ``t``
+    and number of ``updates`` so far; or None if no consistent copy could
+    be made in ``retries`` attempts.
+    '''
+    fields=s.fields if fields is None else fields
+    for k in range(retries):
+      seq=int(s.header[1])
+      if seq%2: continue # update in progress
+      n=int(s.header[5])
+      out={name: (s.arrays[name][:n] if name!='cell_xyz' else s.arrays[name]).copy() for name in fields}
+      out['t'],out['updates']=float(s.t[0]),int(s.header[7])
+      if int(s.header[1])==seq: return out
+    return None
+
+  def close(s):
+    '''
+    Detach from the block.
+    '''
+    s.header=s.t=s.arrays=None
+    s.shm.close()
+
+# END class Shared_state_reader
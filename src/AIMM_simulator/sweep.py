@@ -0,0 +1,145 @@
+# Parameter sweeps: run a scenario at every point of a parameter grid, in
+# parallel, caching the KPIs of each point on disk so that an interrupted
+# sweep can be resumed without repeating finished points.
+
+import json
+from os import makedirs,replace,listdir
+from os.path import join,exists
+from hashlib import sha256
+from itertools import product
+from functools import partial
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor,as_completed
+import numpy as np
+from .AIMM_simulator import __version__
+from .replications import _build_and_run
+
+@dataclass
+class Sweep_result:
+  ''' The outcome at one grid point, as returned by ``sweep``. '''
+  point: dict
+  kpis: dict
+  key: str        # content hash identifying the cache entry
+  cached: bool    # True if the result was read from the cache
+  run_time: float # wall-clock seconds spent in sim.run (when it was computed)
+
+def expand_grid(grid):
+  '''
+  Expand a dictionary mapping parameter names to lists of values into a
+  list of dictionaries, one for each combination of values.
+  '''
+  names=list(grid)
+  return [dict(zip(names,values)) for values in product(*(grid[name] for name in names))]
+
+def _json_default(x):
+  # internal use only - make numpy values JSON-serializable.  Anything else
+  # is an error, since a fallback such as repr(x) could contain a memory
+  # address, giving a cache key which is different in every run
+  if isinstance(x,np.generic): return x.item()
+  if isinstance(x,np.ndarray): return x.tolist()
+  raise TypeError(f'sweep: {x!r} of type {type(x).__name__} is not JSON-serializable; grid points and KPIs may only hold numbers, strings, bools, None, lists, tuples, dicts and numpy values')
+
+def point_key(point,until,extra_key=''):
+  '''
+  Return the cache key of a grid point: a hash of the point, the simulation
+  time, the simulator version, and an optional user-supplied ``extra_key``
+  (for example a version string for the user's own scenario code).  The
+  point must be JSON-serializable (numpy values are converted), else
+  TypeError is raised; to sweep over objects such as pathloss models,
+  use their names as values, and look them up in ``build_fn``.
+  '''
+  content=json.dumps({'point': point,'until': until,'version': __version__,'extra_key': extra_key},sort_keys=True,default=_json_default)
+  return sha256(content.encode()).hexdigest()
+
+def _write_atomic(fn,record):
+  # internal use only - write a cache entry so that it is either complete
+  # or absent, even if the process is killed while writing
+  tmp=fn+'.tmp'
+  with open(tmp,'w') as f:
+    json.dump(record,f,default=_json_default)
+  replace(tmp,fn)
+
+def _read_cached(fn):
+  # internal use only - return the cache entry in fn, or None if there is
+  # no usable entry (an unreadable entry is treated as absent, and rerun)
+  if not exists(fn): return None
+  try:
+    with open(fn) as f: return json.load(f)
+  except ValueError:
+    return None
+
+def sweep(build_fn,grid,until,cache_dir='sweep_cache',workers=None,kpi_fn=None,extra_key=''):
+  '''
+  Run a scenario at every point of a parameter grid, and yield a
+  ``Sweep_result`` for each point.  Points whose result is already in the
+  cache are yielded first, without being run; the others are run in a pool
+  of worker processes, and yielded as they complete.  Each result is saved
+  in ``cache_dir`` as soon as it is available, so a sweep which is
+  interrupted can be resumed simply by calling ``sweep`` again.
+
+  Parameters
+  ----------
+  build_fn : function
+    Factory ``build_fn(**point)`` returning a fully configured ``Sim``.  It
+    must be picklable, so it must be defined at the top level of a module.
+  grid : dict or list of dicts
+    Either a dictionary mapping parameter names to lists of values, which
+    is expanded by ``expand_grid``, or an explicit list of points.  To run
+    several seeds, include a seed parameter in the grid.
+  until : float
+    Simulation time for each point.
+  cache_dir : str
+    Directory holding one JSON file per finished point.
+  workers : int
+    Number of worker processes; the default is the number of CPUs.  If 1,
+    the points are run one after another in the calling process.
+  kpi_fn : function
+    As for ``run_replications``.  The KPIs must be JSON-serializable
+    (numpy values are converted).  Every result holds the KPIs as read
+    back from JSON, whether it was computed or cached, so tuples and
+    numpy arrays become lists, numpy scalars become numbers, and
+    dictionary keys become strings.
+  extra_key : str
+    Included in the cache key, so that changing it invalidates the cache.
+    The simulator version ``__version__`` is always included.
+  '''
+  points=expand_grid(grid) if isinstance(grid,dict) else list(grid)
+  makedirs(cache_dir,exist_ok=True)
+  todo={}
+  for point in points:
+    key=point_key(point,until,extra_key)
+    fn=join(cache_dir,key+'.json')
+    record=_read_cached(fn)
+    if record is not None:
+      yield Sweep_result(point,record['kpis'],key,True,record['run_time'])
+    else:
+      todo[key]=point # duplicate points are only run once
+  def finish(key,result):
+    kpis,build_time,run_time,pid=result
+    kpis=json.loads(json.dumps(kpis,default=_json_default)) # as if cached
+    record={'point': todo[key],'until': until,'version': __version__,'extra_key': extra_key,'kpis': kpis,'run_time': run_time}
+    _write_atomic(join(cache_dir,key+'.json'),record)
+    return Sweep_result(todo[key],kpis,key,False,run_time)
+  if workers==1:
+    for key,point in todo.items():
+      yield finish(key,_build_and_run(partial(build_fn,**point),until,kpi_fn))
+    return
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    futures={pool.submit(_build_and_run,partial(build_fn,**point),until,kpi_fn): key for key,point in todo.items()}
+    try:
+      for future in as_completed(futures):
+        yield finish(futures[future],future.result())
+    finally: # on error, or if the caller stops early, don't start any more
+      for future in futures: future.cancel()
+
+def load_sweep(cache_dir='sweep_cache'):
+  '''
+  Return a list of all ``Sweep_result`` instances saved in ``cache_dir``,
+  whatever sweep or simulator version produced them.
+  '''
+  results=[]
+  for fn in sorted(listdir(cache_dir)):
+    if not fn.endswith('.json'): continue
+    with open(join(cache_dir,fn)) as f: record=json.load(f)
+    results.append(Sweep_result(record['point'],record['kpis'],fn[:-5],True,record['run_time']))
+  return results
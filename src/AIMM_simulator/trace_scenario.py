@@ -0,0 +1,120 @@
+# Trace-driven mobility: replay UE trajectories from a binary file, which is
+# memory-mapped so that only the rows near the current time are ever read.
+
+from sys import stderr
+import numpy as np
+from .AIMM_simulator import Scenario
+
+def open_trace(fn):
+  '''
+  Open a trajectory file for reading, without loading it into memory.
+  Each row is (t,ue,x,y,z) as float64, and rows must be sorted by t.
+  The file is either a .npy file holding a 2-axis array with 5 columns,
+  or a raw binary file of float64 values, as written by ``write_trace``.
+  Return a read-only memory-mapped array of shape (nrows,5).
+  '''
+  if fn.endswith('.npy'):
+    trace=np.load(fn,mmap_mode='r')
+  else:
+    trace=np.memmap(fn,dtype=np.float64,mode='r')
+    if trace.shape[0]%5:
+      raise ValueError(f'open_trace: {fn} does not hold a whole number of 5-column rows')
+    trace=trace.reshape(-1,5)
+  if trace.ndim!=2 or trace.shape[1]!=5 or trace.dtype!=np.float64:
+    raise ValueError(f'open_trace: {fn} must hold float64 rows (t,ue,x,y,z), got shape {trace.shape} and dtype {trace.dtype}')
+  return trace
+
+def write_trace(fn,rows,append=False):
+  '''
+  Write rows (t,ue,x,y,z) to a raw binary trajectory file.  With
+  ``append=True`` the rows are added to the end of an existing file, so that
+  long traces can be generated chunk by chunk.  The caller is responsible
+  for keeping the rows sorted by t.
+  '''
+  rows=np.asarray(rows,dtype=np.float64)
+  if rows.ndim!=2 or rows.shape[1]!=5:
+    raise ValueError(f'write_trace: rows must have shape (n,5), got {rows.shape}')
+  with open(fn,'ab' if append else 'wb') as f:
+    rows.tofile(f)
+
+class Trace_Scenario(Scenario):
+  '''
+  Scenario which replays UE trajectories from a binary trace file.  The
+  file is memory-mapped, and a cursor advances through it as simulation
+  time advances, so memory use does not depend on the length of the trace.
+  At each step, all rows with time up to the current time are applied to
+  ``sim.UE_locations`` with one vectorized write.  If a UE appears more than
+  once in a step, its last position wins.
+
+  Parameters
+  ----------
+  sim : Sim
+    Simulator instance which will manage this Scenario.
+  fn : str
+    Trace file name; see ``open_trace`` for the format.  The ue column
+    holds indices into ``sim.UEs``.
+  interval : float
+    Time interval between position updates.
+  chunk_rows : int
+    Number of trace rows examined at a time; this bounds memory use.
+  func : function
+    Optional function ``func(sim)`` called after each position update.
+  verbosity : int
+    Level of debugging output (0=none).
+  '''
+
+  def __init__(s,sim,fn,interval=1.0,chunk_rows=65536,func=None,verbosity=0):
+    super().__init__(sim,func=func,interval=interval,verbosity=verbosity)
+    s.fn=fn
+    s.trace=open_trace(fn)
+    s.chunk_rows=int(chunk_rows)
+    s.cursor=0 # index of the first row not yet applied
+    if verbosity>0:
+      print(f'Trace_Scenario: {fn} has {s.trace.shape[0]} rows.',file=stderr)
+
+  def advance(s,t):
+    '''
+    Apply all trace rows with time <= t not already applied, and return the
+    number of rows applied.
+    '''
+    trace,n=s.trace,s.trace.shape[0]
+    start=s.cursor
+    while s.cursor<n:
+      chunk=trace[s.cursor:s.cursor+s.chunk_rows]
+      k=np.searchsorted(chunk[:,0],t,side='right')
+      if k>0: s._apply(chunk[:k])
+      s.cursor+=k
+      if k<chunk.shape[0]: break
+    return s.cursor-start
+
+  def _apply(s,rows):
+    # internal use only - one vectorized write of the latest position of
+    # each UE in rows.  Fancy-index assignment with repeated indices has
+    # no defined order, so the last row for each UE is selected first.
+    ue=rows[:,1].astype(np.intp)
+    nues=s.sim.UE_locations.shape[0]
+    if ue.min()<0 or ue.max()>=nues:
+      raise ValueError(f'Trace_Scenario: {s.fn} refers to UEs outside 0..{nues-1}')
+    _,last=np.unique(ue[::-1],return_index=True)
+    last=ue.shape[0]-1-last
+    s.sim.UE_locations[ue[last]]=rows[last,2:]
+
+  def exhausted(s):
+    '''
+    Return True if every row of the trace has been applied.
+    '''
+    return s.cursor>=s.trace.shape[0]
+
+  def loop(s):
+    '''
+    Main loop of Trace_Scenario: apply the trace up to the current time,
+    then call func if given.
+    '''
+    while True:
+      nrows=s.advance(s.sim.env.now)
+      if s.verbosity>1:
+        print(f'Trace_Scenario: t={float(s.sim.env.now):.2f} applied {nrows} rows.',file=stderr)
+      if s.func is not None: s.func(s.sim)
+      yield s.sim.env.timeout(s.interval)
+
+# END class Trace_Scenario
@@ -4,8 +4,15 @@
 __version__='2.0.0'
 
 from sys import stdin,stderr,exit,argv
+from os import cpu_count,makedirs
 from os.path import basename
+from shutil import which
+import subprocess
+from multiprocessing import Pool
 from time import time,sleep,strftime,localtime
+from threading import Thread,Lock
+import struct
+import json
 import numpy
 from random import random
 import argparse
@@ -31,10 +38,83 @@ def fig_timestamp(fig,author='',brand='AIMM Sim —',fontsize=6,color='blue',alp
     rotation=rotation,
     transform=fig.transFigure,alpha=alpha)
 
+class Row_buffer:
+  # A preallocated ring buffer of rows of ncols floats, holding the last
+  # capacity rows.  Each row is written twice, capacity apart, so that the
+  # rows held are always one contiguous slice, and reading them is free.
+  def __init__(s,capacity,ncols):
+    s.capacity=capacity
+    s.ncols=ncols
+    s.data=numpy.full((2*capacity,ncols),numpy.nan)
+    s.n=0 # total number of rows ever appended
+  def append(s,rows):
+    # rows: one row, or a 2-d array of rows; truncated or NaN-padded to ncols
+    rows=numpy.atleast_2d(rows)[:,:s.ncols]
+    if rows.shape[1]<s.ncols:
+      rows=numpy.hstack([rows,numpy.full((rows.shape[0],s.ncols-rows.shape[1]),numpy.nan)])
+    rows=rows[-s.capacity:]
+    m=len(rows)
+    k=s.n%s.capacity
+    a=min(m,s.capacity-k) # rows before wrapping round
+    for off in (0,s.capacity):
+      s.data[off+k:off+k+a]=rows[:a]
+      s.data[off:off+m-a]=rows[a:]
+    s.n+=m
+  def rows(s):
+    # the rows held, oldest first, as a view
+    if s.n<=s.capacity: return s.data[:s.n]
+    k=s.n%s.capacity
+    return s.data[k:k+s.capacity]
+
+def decimate_minmax(x,y,nbins):
+  # keep the minimum and maximum of y in each of nbins consecutive bins of
+  # points, in their original order, which preserves the look of the plot
+  # at a width of nbins pixels
+  n=len(x)
+  if n<=2*nbins: return x,y
+  size=-(-n//nbins) # ceiling
+  nb=n//size
+  m=nb*size
+  yy=y[:m].reshape(nb,size)
+  lo=numpy.argmin(numpy.where(numpy.isnan(yy),numpy.inf,yy),axis=1)
+  hi=numpy.argmax(numpy.where(numpy.isnan(yy),-numpy.inf,yy),axis=1)
+  idx=numpy.sort(numpy.stack([lo,hi],axis=1),axis=1)+size*numpy.arange(nb)[:,None]
+  idx=numpy.concatenate([idx.ravel(),numpy.arange(m,n)]) # and the partial last bin
+  return x[idx],y[idx]
+
+def decimate_lttb(x,y,nout):
+  # largest-triangle-three-buckets: keep nout points, choosing in each
+  # bucket the point making the largest triangle with the point kept in
+  # the previous bucket and the mean of the next bucket
+  n=len(x)
+  if n<=nout or nout<3: return x,y
+  edges=numpy.linspace(1,n-1,nout-1).astype(int) # nout-2 buckets, then the last point
+  ok=~numpy.isnan(y)
+  count=numpy.add.reduceat(ok[:n-1],edges[:-1])
+  with numpy.errstate(invalid='ignore',divide='ignore'):
+    mx=numpy.append(numpy.add.reduceat(x[:n-1],edges[:-1])/numpy.diff(edges),x[-1])
+    my=numpy.append(numpy.add.reduceat(numpy.where(ok,y,0.0)[:n-1],edges[:-1])/count,y[-1])
+  idx=numpy.empty(nout,dtype=int)
+  idx[0],idx[-1]=0,n-1
+  a=0
+  for k in range(nout-2):
+    lo,hi=edges[k],edges[k+1]
+    area=numpy.abs((x[a]-mx[k+1])*(y[lo:hi]-y[a])-(x[a]-x[lo:hi])*(my[k+1]-y[a]))
+    a=lo+int(numpy.argmax(numpy.nan_to_num(area,nan=-1.0)))
+    idx[k+1]=a
+  return x[idx],y[idx]
+
 class Animate:
 
-  def __init__(s,getter,naxes,nplots,xlim=(0,1),ylims={},xlabel='',ylabels={},legends={},title='',lw=2,image_fnbase='',tmax=None,figscale=1.5,final_sleep_time=5,author='',extra='',inputfile='',column_to_axis_map={},xlabel_fontsize=10,ylabel_fontsize=10,title_fontsize=12,cmap_type='hsv'):
+  def __init__(s,getter,naxes,nplots,xlim=(0,1),ylims={},xlabel='',ylabels={},legends={},title='',lw=2,image_fnbase='',tmax=None,figscale=1.5,final_sleep_time=5,author='',extra='',inputfile='',column_to_axis_map={},xlabel_fontsize=10,ylabel_fontsize=10,title_fontsize=12,cmap_type='hsv',history=1<<20,window=None,decimate='minmax',fps=10.0,quiet=False):
     # https://matplotlib.org/stable/tutorials/colors/colormaps.html
+    # The last history rows are kept in a Row_buffer; only the last window of time is shown if window
+    # is given; lines are decimated to the axes width in pixels ('minmax',
+    # 'lttb' or 'none'); and when reading stdin, input is read by a
+    # background thread, and frames are drawn fps times a second.
+    # The options are kept, so that render_video can make copies in
+    # worker processes
+    s.options={k: v for k,v in locals().items() if k not in ('s','getter')}
     s.getter=getter
     s.naxes=naxes
     s.nplots=nplots
@@ -46,8 +126,13 @@ class Animate:
     s.tmax=tmax
     s.lines=[]
     s.final_sleep_time=final_sleep_time
-    s.x=[]
-    s.ys=[[] for i in range(s.nplots)]
+    s.buffer=Row_buffer(history,1+s.nplots)
+    s.window=window
+    s.decimate=decimate
+    s.fps=fps
+    s.lock=Lock()
+    s.reader=None # background input thread, see run()
+    s.exhausted=False
     s.fig=plt.figure(figsize=(figscale*6.4,figscale*4.8))
     #s.fig.tight_layout()
     if 0: # old
@@ -67,9 +152,10 @@ class Animate:
         s.column_to_axis_map[x]=y # overwrite defaults with passed argument
     s.ax=[s.fig.add_subplot(s.naxes,1,1+i) for i in range(s.naxes)]
     s.fig.align_ylabels(s.ax)
-    print(f'  naxes={s.naxes} nplots={s.nplots}',file=stderr)
-    print(f'  column_to_axis_map={s.column_to_axis_map}',file=stderr)
-    print(f'  ylims={s.ylims}',file=stderr)
+    if not quiet:
+      print(f'  naxes={s.naxes} nplots={s.nplots}',file=stderr)
+      print(f'  column_to_axis_map={s.column_to_axis_map}',file=stderr)
+      print(f'  ylims={s.ylims}',file=stderr)
     s.transfigure=s.fig.transFigure.inverted()
     s.ax.reverse() # ax[0] at bottom
     s.extra=extra
@@ -108,14 +194,54 @@ class Animate:
     s.pdf_saved=False
     fig_timestamp(s.fig,author=author,rotation=0,fontsize=8)
 
+  @property
+  def x(s): # time, for "extra" code
+    return s.buffer.rows()[:,0]
+
+  @property
+  def ys(s): # data of each plot, for "extra" code
+    rows=s.buffer.rows()
+    return [rows[:,1+i] for i in range(s.nplots)]
+
+  def read_input(s):
+    # main function of the reader thread: move rows from the getter to the buffer
+    for xy in s.getter:
+      if xy is None or len(xy)==0: break
+      with s.lock: s.buffer.append(xy)
+    s.exhausted=True
+
+  def visible(s,i,npixels):
+    # the data of plot i in the time window, decimated to npixels
+    with s.lock:
+      rows=s.buffer.rows()
+      x,y=rows[:,0],rows[:,1+i]
+      if s.window is not None and len(x):
+        k=numpy.searchsorted(x,x[-1]-s.window)
+        x,y=x[k:],y[k:]
+      if s.decimate=='minmax': return decimate_minmax(x,y,npixels)
+      if s.decimate=='lttb': return decimate_lttb(x,y,2*npixels)
+      return x.copy(),y.copy()
+
+  def draw(s):
+    # set the data of all lines from the buffer
+    for i,j in s.column_to_axis_map.items():
+      if i>=s.nplots or i>=len(s.lines): continue
+      s.lines[i].set_data(*s.visible(i,max(1,int(s.ax[j].bbox.width))))
+    if s.window is not None and s.buffer.n:
+      t=s.buffer.rows()[-1,0]
+      for ax in s.ax: ax.set_xlim(t-s.window,t)
+
   def init(s):
     for line in s.lines: line.set_data([],[])
     return s.lines
 
   def animate(s,k,dbg=True):
     global _second_call
-    xy=next(s.getter)
-    if xy is None or len(xy)==0: # no more data
+    if s.reader is None: # synchronous: one row per frame
+      xy=next(s.getter)
+      if xy is None or len(xy)==0: s.exhausted=True
+      else: s.buffer.append(xy)
+    if s.exhausted and (s.reader is None or not s.reader.is_alive()): # no more data
       if dbg: print(f'{basename(__file__)}: input data exhausted.',file=stderr)
       if not _second_call:
         #for i in range(s.nplots): # replot; it gets deleted when show() returns
@@ -124,7 +250,7 @@ class Animate:
           #print(f'not _second_call: s.column_to_axis_map={s.column_to_axis_map}',file=stderr)
           for i,j in s.column_to_axis_map.items(): # 2021-12-17 replot
             #print(f'not _second_call: i={i} j={j}',file=stderr)
-            if i<len(s.ys): s.ax[j].plot(s.x,s.ys[i],lw=s.lw,color=s.colors[i%s.ncolors],alpha=1) # line
+            if i<s.nplots: s.ax[j].plot(*s.visible(i,max(1,int(s.ax[j].bbox.width))),lw=s.lw,color=s.colors[i%s.ncolors],alpha=1) # line
             #s.ax[j].plot(s.x,s.ys[i],lw=0.5,marker='o',markersize=0.5,color=s.colors[i%s.ncolors]) # dot only
         except:
           print(f'not _second_call: plot failed!',file=stderr)
@@ -146,19 +272,8 @@ class Animate:
       _second_call=True
       sleep(s.final_sleep_time)
       exit(0)
-    # else (xy is not None)...
-    s.x.append(xy[0]) # time
-    if 1: # old way
-      for j in range(s.nplots): s.ys[j].append(xy[1+j])
-    else: # FIXME
-      for i,j in s.column_to_axis_map.items():
-        print(f'{i}->{j}',file=stderr)
-        s.ys[j].append(xy[1+i])
-    #print(f'{s.ys}',file=stderr)
-    #exit()
-    for i,ysi in enumerate(s.ys):
-      s.lines[i].set_data(s.x,ysi)
-      #s.lines[s.column_to_axis_map[i]].set_data(s.x,ysi)
+    # else (more data may come)...
+    s.draw()
     return s.lines
 
   def run_OLD(s,nframes=1000):
@@ -169,35 +284,74 @@ class Animate:
     s.anim=animation.FuncAnimation(s.fig,s.animate,init_func=s.init,frames=nframes,interval=0.01,blit=True,save_count=1000) #,repeat=False)
     plt.show(block=True)
 
-  def run(s,nframes=1000):
+  def make_lines(s,dbg=True):
     # create a plot object for each plot, and map them to axes
-    plt.ion()
     for i,j in s.column_to_axis_map.items():
-      print(f'run: column[{i}] is mapped to axis [{j}].',file=stderr)
+      if dbg: print(f'run: column[{i}] is mapped to axis [{j}].',file=stderr)
       s.lines.append(s.ax[j].plot([],[],lw=s.lw,color=s.colors[i%s.ncolors],alpha=1)[0])
       #s.lines.append(s.ax[j].plot(s.x,s.ys[i],lw=0.0,marker='o',markersize=0.5,color=s.colors[i%s.ncolors])[0]) # dot only
-    s.anim=animation.FuncAnimation(s.fig,s.animate,init_func=s.init,frames=nframes,interval=0.01,blit=True,save_count=1000) #,repeat=False)
+
+  def run(s,nframes=1000):
+    plt.ion()
+    s.make_lines()
+    s.reader=Thread(target=s.read_input,daemon=True)
+    s.reader.start()
+    # frames at a fixed rate, whatever the input rate; a moving window
+    # changes the axes, so cannot be blitted
+    s.anim=animation.FuncAnimation(s.fig,s.animate,init_func=s.init,frames=None,interval=1000.0/s.fps,blit=s.window is None,cache_frame_data=False)
     plt.show(block=True)
 
-  def run_noshow(s,nframes=2*5000):
-    # FIXME need a good way to set nframes
-    for i in range(s.naxes):
-      axi=s.ax[i]
-      axi.plot([],[],lw=s.lw)
-      lobj=axi.plot([],[],lw=s.lw,color=s.colors[i%s.ncolors])[0]
-      s.lines.append(lobj)
-    s.anim=animation.FuncAnimation(s.fig,s.animate,init_func=s.init,frames=nframes,interval=0.01,blit=True,save_count=nframes)
-    plt.draw()
-    s.save_mp4()
-
-  def save_mp4(s):
-    print(f's.anim={s.anim}',file=stderr)
-    writervideo=animation.FFMpegWriter(fps=30,bitrate=2000)
-    #print(f'writervideo={writervideo} ...',file=stderr)
-    filename_mp4=f'{s.inputfile}.mp4'
-    print(f'Writing {filename_mp4} ...',end='',file=stderr); stderr.flush()
-    s.anim.save(filename_mp4,writer=writervideo)
+  def render_video(s,rows,nframes=1000,fps=30,processes=None,chunk=8):
+    # Offline rendering of rows (a 2-d array) to f'{s.inputfile}.mp4', in
+    # nframes frames equally spaced in rows, each showing the rows up to
+    # that point.  The frames are rasterized with Agg in a pool of
+    # processes, chunk consecutive frames per task, and piped in order to
+    # one ffmpeg process as raw RGBA; without ffmpeg, they are written as
+    # png files in the directory f'{s.inputfile}_frames'.
+    rows=numpy.atleast_2d(rows)
+    nframes=max(1,min(nframes,len(rows)))
+    ends=numpy.linspace(1,len(rows),nframes).astype(int)
+    ffmpeg=which('ffmpeg')
+    dirname=None if ffmpeg else f'{s.inputfile}_frames'
+    if dirname: makedirs(dirname,exist_ok=True)
+    tasks=[(k,ends[k:k+chunk],dirname) for k in range(0,nframes,chunk)]
+    processes=processes or cpu_count() or 1
+    rc={k: plt.rcParams[k] for k in ('font.size','figure.autolayout')}
+    if ffmpeg: print(f'Writing {s.inputfile}.mp4 ({nframes} frames, {processes} processes) ...',end='',file=stderr)
+    else: print(f'ffmpeg not found; writing {nframes} png frames to {dirname}/ ({processes} processes) ...',end='',file=stderr)
+    stderr.flush()
+    if processes==1:
+      _render_init(s.options,rc,rows)
+      pool,frames=None,map(_render_chunk,tasks)
+    else:
+      pool=Pool(processes,initializer=_render_init,initargs=(s.options,rc,rows))
+      frames=pool.imap(_render_chunk,tasks)
+    pipe=None
+    try:
+      for chunk_frames in frames:
+        for frame in chunk_frames:
+          if pipe is None: # the frame size is known now
+            h,w=frame.shape[:2]
+            pipe=subprocess.Popen([ffmpeg,'-y','-loglevel','error','-f','rawvideo','-pix_fmt','rgba','-s',f'{w}x{h}','-r',str(fps),'-i','-','-vf','pad=ceil(iw/2)*2:ceil(ih/2)*2','-c:v','libx264','-pix_fmt','yuv420p','-b:v','2000k',f'{s.inputfile}.mp4'],stdin=subprocess.PIPE)
+          pipe.stdin.write(frame.tobytes())
+    finally:
+      if pool is not None: pool.terminate()
+      if pipe is not None:
+        pipe.stdin.close()
+        if pipe.wait()!=0: raise RuntimeError(f'ffmpeg failed with exit code {pipe.returncode}')
     print('done',file=stderr)
+    if s.image_fnbase: # final image, with extra
+      s.buffer.append(rows)
+      if not s.lines: s.make_lines(dbg=False)
+      s.draw()
+      if s.extra:
+        s.transfigure=s.fig.transFigure.inverted()
+        try:
+          exec(s.extra)
+        except Exception as e:
+          print(f'extra="{s.extra}" failed with message "{str(e)}"!',file=stderr)
+      s.fig.savefig(s.image_fnbase+'.png')
+      s.fig.savefig(s.image_fnbase+'.pdf')
 
   def add_line_betweenaxes(s,xy0,xy1,ax0,ax1,color='r',lw=1,arrowstyle='-',shrinkB=0): # 2021-10-28
     # Draw an arrow between two points in data coordinates, possibly 
@@ -218,12 +372,38 @@ def _getter_random(n):
     last=nxt
     yield _k,nxt[0],nxt[1],10*nxt[2]
 
+# binary framed stream, as written by AIMM_simulator.Frame_writer: a header
+# (magic, version, ncols, dtype, names), then frames of nrows rows...
+FRAME_MAGIC=b'\x93AIMMROW'
+
+def getter_binary(f,magic_read=False):
+  # yield each frame of the binary stream f as a 2-d array of rows
+  if not magic_read: f.read(len(FRAME_MAGIC))
+  version,ncols,dtype,nnames=struct.unpack('<HH4sI',f.read(12))
+  names=json.loads(f.read(nnames) or b'[]')
+  if names: print(f'getter_binary: {ncols} columns {names}',file=stderr)
+  dtype=numpy.dtype(dtype.rstrip(b'\0').decode())
+  rowbytes=ncols*dtype.itemsize
+  while True:
+    n=f.read(4)
+    if len(n)<4: break
+    n=struct.unpack('<I',n)[0]
+    data=f.read(n*rowbytes)
+    if len(data)<n*rowbytes: break # truncated
+    yield numpy.frombuffer(data,dtype=dtype).reshape(n,ncols).astype(float)
+
 def getter_stdin(nrowsmax=None):
+  # binary frames if stdin starts with FRAME_MAGIC, else text lines
+  head=stdin.buffer.read(len(FRAME_MAGIC))
+  if head==FRAME_MAGIC:
+    yield from getter_binary(stdin.buffer,magic_read=True)
+    while True: yield None
+  pending=(head+stdin.buffer.readline()).decode().splitlines(keepends=True) if head else []
   k=0
   while True:
     if nrowsmax and k>nrowsmax: yield None
     k+=1
-    line=stdin.readline()
+    line=pending.pop(0) if pending else stdin.readline()
     if not line: yield None
     if line and line[0]=='#':
       continue # 2021-10-29
@@ -231,6 +411,37 @@ def getter_stdin(nrowsmax=None):
       yield numpy.fromstring(line,sep='\t') # 2021-12-15
       #yield numpy.array(list(map(float,line.split()))) # 2021-07-15
 
+_renderer=None # Animate of each render_video worker
+_rows=None
+
+def _render_init(options,rc,rows):
+  # initializer of render_video workers: an Animate drawing with Agg
+  global _renderer,_rows
+  plt.switch_backend('Agg')
+  plt.rcParams.update(rc)
+  _renderer=Animate(None,**dict(options,quiet=True))
+  _renderer.make_lines(dbg=False)
+  _rows=rows
+
+def _render_chunk(task):
+  # render frames k0,k0+1,... showing _rows[:end] for each end in ends,
+  # returning them as RGBA arrays, or writing them as png files in dirname
+  k0,ends,dirname=task
+  s=_renderer
+  s.buffer.n=0
+  start=max(0,ends[0]-s.buffer.capacity)
+  frames=[]
+  for k,end in enumerate(ends,k0):
+    s.buffer.append(_rows[start:end])
+    start=end
+    s.draw()
+    if dirname:
+      s.fig.savefig(f'{dirname}/frame_{k:06d}.png')
+    else:
+      s.fig.canvas.draw()
+      frames.append(numpy.array(s.fig.canvas.buffer_rgba()))
+  return frames
+
 def getter_tsv(tsv,skip=10):
   # Keith Briggs 2021-07-19 - return rows of a pre-loaded tsv file
   k=0
@@ -262,6 +473,12 @@ def main():
   parser.add_argument('-extra',type=str,  help='extra features to be added to the plot; raw python code',default='')
   parser.add_argument('-inputfile',type=str,  help='file to read input from instead of stdin; in this case the plot is not displayed, but written to an mp4 file',default='')
   parser.add_argument('-column_to_axis_map',type=str,  help='column_to_axis_map',default='{}')
+  parser.add_argument('-fps',type=float,  help='frames per second when reading stdin',default=10.0)
+  parser.add_argument('-window',type=float,help='show only this much time, scrolling (default all)',default=None)
+  parser.add_argument('-history',type=int,help='number of rows kept',default=1<<20)
+  parser.add_argument('-nframes',type=int,help='number of frames of the video written for -inputfile',default=1000)
+  parser.add_argument('-processes',type=int,help='number of processes rendering the video (default all cpus)',default=None)
+  parser.add_argument('-decimate',type=str,help='decimation of lines to the plot width: minmax, lttb or none',default='minmax',choices=('minmax','lttb','none'))
   args=parser.parse_args()
   if args.selftest:
     global _k,last,nplots
@@ -295,13 +512,18 @@ def main():
       print(f'Could not parse -ylabels="{args.ylabels}"',file=stderr)
   if args.inputfile and args.inputfile not in ('stdin','-',):
     try:
-      tsv=numpy.loadtxt(args.inputfile)
+      with open(args.inputfile,'rb') as f:
+        if f.read(len(FRAME_MAGIC))==FRAME_MAGIC: # binary frames
+          tsv=numpy.vstack(list(getter_binary(f,magic_read=True)))
+        else:
+          tsv=numpy.loadtxt(args.inputfile)
       nrows=tsv.shape[0]
       print(f'Loaded tsv file "{args.inputfile}", {nrows} rows',file=stderr)
     except:
       print(f'Could not load tsv file "{args.inputfile}", quitting',file=stderr)
       exit(1)
-    getter=getter_tsv(tsv)
+    getter=None
+    plt.switch_backend('Agg')
   else:
     getter=getter_stdin()
   if args.naxes>4: plt.rcParams.update({'font.size': 6})
@@ -330,12 +552,16 @@ def main():
     author=args.author,
     extra=args.extra,
     inputfile=args.inputfile,
-    column_to_axis_map=column_to_axis_map
+    column_to_axis_map=column_to_axis_map,
+    history=args.history,
+    window=args.window,
+    decimate=args.decimate,
+    fps=args.fps,
   )
   if args.inputfile in ('','stdin','-',):
     animate.run(nframes=100)
   else:
-    animate.run_noshow()
+    animate.render_video(tsv,nframes=args.nframes,processes=args.processes)
   return parser
 
 if __name__=='__main__':